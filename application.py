@@ -12,15 +12,26 @@ All of the files in this directory and all subdirectories are:
 Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
 """
 import datetime
+import itertools
 import json
+import os
+from typing import Iterable, Iterator, Optional
 
 from contract import TermContract
 from contract import MTMContract
 from contract import PrepaidContract
+from contract import bill_batch
 from customer import Customer
 from phoneline import PhoneLine
 from visualizer import Visualizer
-from call import Call
+from calltable import CallList, CallTable, from_epoch, numpy
+from callstore import CallStore
+from filter import ResetFilter
+from callindex import build_indexes
+from eventlog import EventDecoder, iter_jsonl_from, iter_records, parse_time
+from checkpoint import Checkpoint, load_checkpoint
+from parallel import replay_shards
+from instrument import STATS, configure_from_env
 
 
 def import_data() -> dict[str, list[dict]]:
@@ -35,6 +46,23 @@ def import_data() -> dict[str, list[dict]]:
         return log
 
 
+def import_data_stream(filename: str = "dataset.json") \
+        -> dict[str, Iterable[dict]]:
+    """ Return a dictionary in the same format as import_data, for the dataset
+    stored in the file <filename>, except that the "events" are not loaded
+    into memory. Instead, the "events" value is a generator which reads the
+    events from the file one at a time, as they are consumed.
+
+    The generator can only be consumed once.
+    The <filename> can either be in the json format described in the handout,
+    or in the json-lines format described in the eventlog module.
+
+    Precondition: the dataset file must be in one of the formats above.
+    """
+    return {'customers': list(iter_records(filename, 'customers')),
+            'events': iter_records(filename, 'events')}
+
+
 def create_customers(log: dict[str, list[dict]]) -> list[Customer]:
     """ Returns a list of Customer instances for each customer from the input
     dataset from the dictionary <log>.
@@ -44,8 +72,9 @@ def create_customers(log: dict[str, list[dict]]) -> list[Customer]:
     matching the expected input format described in the handout.
     """
     customer_list = []
+    directory = {}
     for cust in log['customers']:
-        customer = Customer(cust['id'])
+        customer = Customer(cust['id'], directory)
         for line in cust['lines']:
             # comment out the following three lines of code only when you get
             # to implement task 3. These lines are provided as a placeholder so
@@ -82,12 +111,45 @@ def create_customers(log: dict[str, list[dict]]) -> list[Customer]:
     return customer_list
 
 
-def find_customer_by_number(number: str, customer_list: list[Customer]) \
-        -> Customer:
+def get_directory(customer_list: list[Customer]) \
+        -> dict[str, tuple[Customer, PhoneLine]]:
+    """ Return a phone number directory of the customers in <customer_list>,
+    mapping each of their phone numbers to its owning Customer and PhoneLine.
+
+    If the customers share a directory holding only their phone lines, as the
+    customers created by create_customers do, that directory is returned, and
+    it is kept in sync as phone lines are added or cancelled. Otherwise, a new
+    directory is built, which is not kept in sync. The customers are never
+    changed.
+    """
+    shared = customer_list[0].get_directory() if customer_list else None
+    num_lines = 0
+    for customer in customer_list:
+        if customer.get_directory() is not shared:
+            shared = None
+        num_lines += len(customer.get_phone_numbers())
+    if shared is not None and len(shared) == num_lines:
+        return shared
+    return {line.get_number(): (customer, line) for customer in customer_list
+            for line in customer.get_phone_lines()}
+
+
+def find_customer_by_number(number: str, customer_list: list[Customer],
+                            directory: Optional[dict[str,
+                                                     tuple[Customer,
+                                                           PhoneLine]]]
+                            = None) -> Customer:
     """ Return the Customer with the phone number <number> in the list of
     customers <customer_list>.
     If the number does not belong to any customer, return None.
+
+    If a <directory> of <customer_list>, as returned by get_directory, is
+    given, the customer is looked up in it in constant time. Otherwise, every
+    customer of <customer_list> is checked.
     """
+    if directory is not None:
+        entry = directory.get(number)
+        return None if entry is None else entry[0]
     cust = None
     for customer in customer_list:
         if number in customer:
@@ -103,8 +165,105 @@ def new_month(customer_list: list[Customer], month: int, year: int) -> None:
         cust.new_month(month, year)
 
 
-def process_event_history(log: dict[str, list[dict]],
-                          customer_list: list[Customer]) -> None:
+def _billing_month_change(billing_month: int, billing_year: int,
+                          event_date: datetime.datetime) \
+        -> Optional[tuple[int, int]]:
+    """ Return the new billing month and year, as a (month, year) tuple, if an
+    event at <event_date> starts a new billing month after the <billing_month>
+    of the <billing_year>. Otherwise, return None.
+    """
+    if (event_date.month > billing_month and billing_year == event_date
+            .year):
+        # checks to see whether the billing month has changed
+        return event_date.month, billing_year
+    elif (event_date.month < billing_month and billing_year < event_date
+            .year):  # checks for if the new month is due to a new year
+        return event_date.month, event_date.year
+    return None
+
+
+def _count_events(num_calls: int, num_sms: int,
+                  billed: Optional[dict[type, int]]) -> None:
+    """ Add <num_calls> ingested calls and <num_sms> ingested sms to STATS,
+    and the number of calls <billed> under each type of contract, if it is not
+    None.
+    """
+    STATS.count('events.calls', num_calls)
+    STATS.count('events.sms', num_sms)
+    if billed is not None:
+        for contract, count in billed.items():
+            STATS.count('calls.billed.' + contract.__name__, count)
+
+
+def _process_events(events: Iterable[dict], customer_list: list[Customer],
+                    billing: Optional[tuple[int, int]],
+                    table: Optional[CallTable] = None,
+                    decoder: Optional[EventDecoder] = None,
+                    months: Optional[list[tuple[int, int]]] = None,
+                    directory: Optional[dict[str, tuple[Customer,
+                                                        PhoneLine]]] = None) \
+        -> Optional[tuple[int, int]]:
+    """ Process the calls of <events>, as process_event_history does, in the
+    current <billing> month, given as a (month, year) tuple. If <billing> is
+    None, the billing month starts at the month of the first event.
+
+    Return the billing month after the last event, or None if <billing> is
+    None and there are no events.
+    If <months> is given, every new month started is appended to it, as a
+    (month, year) tuple.
+    If <directory> is given, it must be the directory of <customer_list>,
+    including the customers added to it while the <events> are processed.
+    """
+    if decoder is None:
+        decoder = EventDecoder()
+    events = iter(events)
+    if billing is None:
+        first_event = next(events, None)
+        if first_event is None:
+            return None
+        billing_date = parse_time(first_event['time'])
+        billing = billing_date.month, billing_date.year
+        events = itertools.chain((first_event,), events)
+    billing_month, billing_year = billing
+    if directory is None:
+        directory = get_directory(customer_list)
+    num_calls, num_sms = decoder.num_calls, decoder.num_sms
+    # the calls billed under each type of contract, only counted if STATS is
+    # enabled
+    billed = {} if STATS.enabled else None
+    for event_data in events:
+        call_object = decoder.decode(event_data)
+        # makes a new call object for the particular event, unless it is an sms
+        if call_object is not None:
+            event_date = call_object.time
+            change = _billing_month_change(billing_month, billing_year,
+                                           event_date)
+            if change is not None:
+                # if billing month has changed, then new_month is called
+                new_month(customer_list, event_date.month, event_date.year)
+                billing_month, billing_year = change  # sets the new month
+                STATS.count('months.rollovers')
+                if months is not None:
+                    months.append((event_date.month, event_date.year))
+
+            if table is not None:
+                table.append(call_object)
+            if billed is not None:
+                contract = type(directory[call_object.src_number][1].contract)
+                billed[contract] = billed.get(contract, 0) + 1
+            (find_customer_by_number(call_object.src_number, customer_list,
+                                     directory).make_call(call_object))
+            (find_customer_by_number(call_object.dst_number, customer_list,
+                                     directory).receive_call(call_object))
+    _count_events(decoder.num_calls - num_calls, decoder.num_sms - num_sms,
+                  billed)
+    return billing_month, billing_year
+
+
+def process_event_history(log: dict[str, Iterable[dict]],
+                          customer_list: list[Customer],
+                          table: Optional[CallTable] = None,
+                          decoder: Optional[EventDecoder] = None) -> None:
     """ Process the calls from the <log> dictionary. The <customer_list>
     list contains all the customers that exist in the <log> dictionary.
 
@@ -123,53 +282,15 @@ def process_event_history(log: dict[str, list[dict]],
     - The <log> dictionary is in the correct format, as defined in the
     handout.
     - The <customer_list> already contains all the customers from the <log>.
-    """
-    # Implement this method. We are giving you the first few lines of code
-    billing_date = datetime.datetime.strptime(log['events'][0]['time'],
-                                              "%Y-%m-%d %H:%M:%S")
-    billing_month = billing_date.month
-    billing_year = billing_date.year
-    for event_data in log['events']:
-        src_num = ""
-        dst_num = ""
-        time = datetime
-        duration = 0
-        src_loc = tuple
-        dst_loc = tuple
-        for key in event_data:
-            if key == "src_number":
-                src_num = event_data[key]
-            elif key == "dst_number":
-                dst_num = event_data[key]
-            elif key == "time":
-                time = event_data[key]
-            elif key == "duration":
-                duration = event_data[key]
-            elif key == "src_loc":
-                src_loc = event_data[key]
-            elif key == "dst_loc":
-                dst_loc = event_data[key]
-        if event_data["type"] != "sms":
-            event_date = datetime.datetime.strptime(time, "%Y-%m-%d %H:%M:%S")
-            if (event_date.month > billing_month and billing_year == event_date
-                    .year):
-                # checks to see whether the billing month has changed
-                new_month(customer_list, event_date.month, event_date.year)
-                # if billing month has changed, then new_month is called
-                billing_month = event_date.month  # sets the new month
-            elif (event_date.month < billing_month and billing_year < event_date
-                    .year):  # checks for if the new month is due to a new year
-                new_month(customer_list, event_date.month, event_date.year)
-                billing_month = event_date.month
-                billing_year = event_date.year  # set the billing year
 
-            call_object = Call(src_num, dst_num, event_date, duration, src_loc,
-                               dst_loc)
-            # makes a new call object for the particular event
-            (find_customer_by_number(src_num, customer_list)
-             .make_call(call_object))
-            (find_customer_by_number(dst_num, customer_list)
-             .receive_call(call_object))
+    The "events" of <log> are consumed in a single pass, so they can be given
+    as a generator (see import_data_stream).
+    If a <table> is given, every Call is also appended to it, in the order of
+    the events.
+    The events are decoded by <decoder>, or by a new EventDecoder if it is
+    None. Its counts of calls and skipped sms events can be read afterwards.
+    """
+    _process_events(log['events'], customer_list, None, table, decoder)
 
     # start recording the bills from this date
     # Note: uncomment the following lines when you're ready to implement this
@@ -181,15 +302,225 @@ def process_event_history(log: dict[str, list[dict]],
     # ...
 
 
+def process_event_history_sharded(log: dict[str, Iterable[dict]],
+                                  customer_list: list[Customer],
+                                  workers: Optional[int] = None,
+                                  table: Optional[CallTable] = None,
+                                  decoder: Optional[EventDecoder] = None) \
+        -> None:
+    """ Process the calls from the <log> dictionary, exactly as
+    process_event_history does, but replay them in <workers> worker
+    processes, or in one worker process per CPU if <workers> is None.
+
+    The bills of a phone line only depend on its own calls and on the start
+    of each new month, so the customers are split into one group per worker,
+    and each worker replays the calls made or received by its group, starting
+    the new months at the same point as process_event_history would. The
+    customers end up with the same bills, contract state and call histories.
+
+    The preconditions of process_event_history apply, and every phone number
+    of the calls must belong to a customer of <customer_list>.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if decoder is None:
+        decoder = EventDecoder()
+    events = iter(log['events'])
+    first_event = next(events, None)
+    if first_event is None:
+        return
+    billing_date = parse_time(first_event['time'])
+    billing_month = billing_date.month
+    billing_year = billing_date.year
+    directory = get_directory(customer_list)
+    groups = [customer_list[i::workers] for i in range(workers)]
+    group_of = {number: i for i, group in enumerate(groups)
+                for customer in group
+                for number in customer.get_phone_numbers()}
+
+    calls = []
+    shards = [[] for _ in groups]
+    boundaries = []
+    num_calls, num_sms = decoder.num_calls, decoder.num_sms
+    billed = {} if STATS.enabled else None
+    for event_data in itertools.chain((first_event,), events):
+        call_object = decoder.decode(event_data)
+        if call_object is not None:
+            change = _billing_month_change(billing_month, billing_year,
+                                           call_object.time)
+            if change is not None:
+                boundaries.append((len(calls), call_object.time.month,
+                                   call_object.time.year))
+                billing_month, billing_year = change
+            if table is not None:
+                table.append(call_object)
+            if billed is not None:
+                contract = type(directory[call_object.src_number][1].contract)
+                billed[contract] = billed.get(contract, 0) + 1
+            src_group = group_of[call_object.src_number]
+            dst_group = group_of[call_object.dst_number]
+            shards[src_group].append(len(calls))
+            if dst_group != src_group:
+                shards[dst_group].append(len(calls))
+            calls.append(call_object)
+    replay_shards(groups, calls, shards, boundaries, workers)
+    STATS.count('months.rollovers', len(boundaries))
+    _count_events(decoder.num_calls - num_calls, decoder.num_sms - num_sms,
+                  billed)
+
+
+def process_store_history(store: CallStore,
+                          customer_list: list[Customer]) -> None:
+    """ Bill the calls of the call <store> to the customers of
+    <customer_list>, as process_event_history bills the calls of a dataset,
+    but without decoding its events nor creating any Call object. The calls of
+    each billing month are billed at once, with contract.bill_batch.
+
+    Only the bills and contracts of the customers are updated: the calls are
+    not registered into their call histories. The calls can be read from the
+    <store> instead, e.g. from its call_list().
+
+    Preconditions:
+    - NumPy is installed.
+    - The <store> holds the calls of a dataset which meets the preconditions
+    of process_event_history (e.g. as written by callstore.convert_to_store).
+    - Every phone number of the calls belongs to a customer of
+    <customer_list>.
+    """
+    directory = get_directory(customer_list)
+    lines = [directory[number][1] for number in store.numbers]
+    contracts = [line.contract for line in lines]
+    table = store.table()
+    # the calls are in order, so each month is a run of consecutive calls
+    months = table.times.astype('datetime64[s]').astype('datetime64[M]')
+    starts = (numpy.flatnonzero(months[1:] != months[:-1]) + 1).tolist()
+    billing = None
+    for start, stop in zip([0] + starts, starts + [len(table)]):
+        date = from_epoch(int(table.times[start]))
+        if billing is None:
+            billing = date.month, date.year
+        else:
+            change = _billing_month_change(billing[0], billing[1], date)
+            if change is not None:
+                new_month(customer_list, date.month, date.year)
+                billing = change
+                STATS.count('months.rollovers')
+        src_ids = table.src_ids[start:stop]
+        # as in make_call and receive_call, the lines of the calls of the
+        # month start it if they have not yet
+        for nid in numpy.union1d(src_ids, table.dst_ids[start:stop]).tolist():
+            lines[nid].new_month(date.month, date.year)
+        bill_batch(contracts, src_ids, table.durations[start:stop])
+    billed = None
+    if STATS.enabled:
+        billed = {}
+        made = numpy.bincount(table.src_ids, minlength=len(lines)).tolist()
+        for contract, count in zip(contracts, made):
+            billed[type(contract)] = billed.get(type(contract), 0) + count
+    _count_events(len(table), 0, billed)
+
+
+def _add_customer(record: dict, checkpoint: Checkpoint,
+                  directory: dict[str, tuple[Customer, PhoneLine]]) -> None:
+    """ Add a customer created from the customer <record> to <checkpoint>,
+    registered in the <directory> of its customers, with a bill for each
+    month started so far, as if it had been created with the other customers
+    before any event was processed.
+    """
+    customer = create_customers({'customers': [record]})[0]
+    customer.attach_directory(directory)
+    for month, year in checkpoint.months:
+        customer.new_month(month, year)
+    checkpoint.customers.append(customer)
+
+
+def _iter_new_events(filename: str, checkpoint: Checkpoint,
+                     directory: dict[str, tuple[Customer, PhoneLine]]) \
+        -> Iterator[dict]:
+    """ Yield the events of the dataset file <filename> which were not
+    processed into <checkpoint> yet. Customer records found along the way are
+    added to <checkpoint> and to its <directory>, and the position of
+    <checkpoint> in the file is advanced past every record once it is
+    processed.
+    """
+    if filename.endswith(".jsonl"):
+        for record, offset in iter_jsonl_from(filename, checkpoint.offset):
+            if "type" in record:
+                yield record
+            else:
+                _add_customer(record, checkpoint, directory)
+            checkpoint.offset = offset
+            checkpoint.num_events += "type" in record
+    else:
+        # customers may have been added to the file since the last run
+        known = {customer.get_id() for customer in checkpoint.customers}
+        for record in iter_records(filename, 'customers'):
+            if record['id'] not in known:
+                _add_customer(record, checkpoint, directory)
+        events = iter_records(filename, 'events')
+        for event_data in itertools.islice(events, checkpoint.num_events,
+                                           None):
+            yield event_data
+            checkpoint.num_events += 1
+
+
+def ingest_incremental(filename: str, checkpoint_file: str,
+                       decoder: Optional[EventDecoder] = None) -> Checkpoint:
+    """ Process the events of the dataset file <filename> which were not
+    processed yet into the checkpoint saved in <checkpoint_file>, save the
+    updated checkpoint and return it. If <checkpoint_file> does not exist,
+    all events are processed, starting from new customers.
+
+    The events are decoded by <decoder>, or by a new EventDecoder if it is
+    None.
+
+    The call histories of the saved customers are not loaded, so the call
+    histories of the returned checkpoint only hold the calls of the events
+    processed now. Use load_checkpoint to get the full call histories.
+
+    A json-lines file is read from where the checkpoint stopped, so the time
+    taken only depends on the records appended since. New customer records
+    may be appended between the events. A json file has to be read from the
+    start, but the events already processed are skipped without being
+    decoded.
+
+    Precondition:
+    - records are only ever appended to <filename>, after the ones already
+    processed into the checkpoint, and the events stay in chronological order
+    - <filename> is in one of the formats read by import_data_stream
+    """
+    if os.path.exists(checkpoint_file):
+        checkpoint = load_checkpoint(checkpoint_file, history=False)
+    else:
+        checkpoint = Checkpoint()
+    directory = get_directory(checkpoint.customers)
+    checkpoint.billing = _process_events(
+        _iter_new_events(filename, checkpoint, directory),
+        checkpoint.customers, checkpoint.billing, decoder=decoder,
+        months=checkpoint.months, directory=directory)
+    checkpoint.save(checkpoint_file)
+    return checkpoint
+
+
 if __name__ == '__main__':
+    configure_from_env()
     v = Visualizer()
     print("Toronto map coordinates:")
     print("  Lower-left corner: -79.697878, 43.576959")
     print("  Upper-right corner: -79.196382, 43.799568")
 
-    input_dictionary = import_data()
+    input_dictionary = import_data_stream()
     customers = create_customers(input_dictionary)
-    process_event_history(input_dictionary, customers)
+    # If MEWBILE_STORE names a call store file of the dataset (see
+    # callstore.convert_to_store), its calls are billed and shown instead of
+    # decoding the events of the dataset.
+    store_file = os.environ.get('MEWBILE_STORE')
+    store = None
+    if store_file:
+        store = CallStore(store_file)
+        process_store_history(store, customers)
+    else:
+        process_event_history(input_dictionary, customers)
 
     # ----------------------------------------------------------------------
     # NOTE: You do not need to understand any of the implementation below,
@@ -200,42 +531,45 @@ if __name__ == '__main__':
     # Gather all calls to be drawn on screen for filtering, but we only want
     # to plot each call only once, so only plot the outgoing calls to screen.
     # (Each call is registered as both an incoming and outgoing)
-    all_calls = []
-    for c in customers:
-        hist = c.get_history()
-        all_calls.extend(hist[0])
+    # The reset filter also keeps them in a columnar table for the filters.
+    # The calls of a store are not in the call histories of the customers, so
+    # they are shown again when the filters are reset.
+    if store is not None:
+        all_calls = store.call_list()
+        v.set_all_calls(all_calls)
+    else:
+        all_calls = ResetFilter().apply(customers, [], "")
+    if isinstance(all_calls, CallList):
+        build_indexes(all_calls.table)
     print("\n-----------------------------------------")
     print("Total Calls in the dataset:", len(all_calls))
 
     # Main loop for the application.
     # 1) Wait for user interaction with the system and processes everything
     #    appropriately
-    # 2) Take the calls from the results of the filtering and create the
-    #    drawables and connection lines for those calls
-    # 3) Display the calls in the visualization window
+    # 2) Take the calls from the results of the filtering, and display those
+    #    in view in the visualization window, if the calls or the view changed
     events = all_calls
     while not v.has_quit():
         events = v.handle_window_events(customers, events)
 
-        connections = []
-        drawables = []
-        for event in events:
-            connections.append(event.get_connection())
-            drawables.extend(event.get_drawables())
-
-        # Put the connections on top of the other sprites
-        drawables.extend(connections)
-        v.render_drawables(drawables)
+        # Only the calls in view are drawn, with the connections on top of the
+        # other sprites. Nothing is drawn again until the calls or the view
+        # change.
+        v.render_calls(events)
+    v.close()
 
     import python_ta
 
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'json', 'datetime',
-            'visualizer', 'customer', 'call', 'contract', 'phoneline'
+            'python_ta', 'typing', 'json', 'datetime', 'itertools', 'os',
+            'visualizer', 'eventlog', 'calltable', 'callindex', 'parallel',
+            'checkpoint', 'instrument', 'callstore',
+            'customer', 'contract', 'phoneline', 'filter'
         ],
         'allowed-io': [
             'create_customers', 'import_data'
         ],
-        'generated-members': 'pygame.*'
+        'generated-members': 'pygame.*, numpy.*'
     })
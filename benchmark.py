@@ -0,0 +1,375 @@
+"""
+CSC148, Winter 2024
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains benchmarks for the phone management system.
+
+run_suite times every stage of the application, from loading the customers to
+rendering the calls, on a random dataset made by make_dataset, and reports the
+results as a json-compatible dict, so runs can be compared over time. The
+other bench_ functions measure single parts of the system in more detail.
+
+Running this file prints the results of run_suite as json. Run it with
+--help for its options.
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from application import create_customers, process_event_history
+from call import Call
+from callindex import MAP_LOWER, MAP_UPPER, build_indexes
+from callstore import CallStore, convert_to_store
+from calltable import CallList, CallTable, numpy
+from customer import Customer
+from eventlog import TIME_FORMAT, EventDecoder, iter_records, parse_time
+from filter import _RESET_CACHE, CustomerFilter, DurationFilter, Filter, \
+    LocationFilter, ResetFilter
+
+
+def make_calls(num_calls: int, num_numbers: int = 1000,
+               seed: int = 148) -> list[Call]:
+    """ Return a list of <num_calls> random calls between <num_numbers> phone
+    numbers, in chronological order. The same <seed> gives the same calls.
+    """
+    rng = random.Random(seed)
+    numbers = [f"{i // 10000:03}-{i % 10000:04}" for i in range(num_numbers)]
+    time = datetime.datetime(2018, 1, 1)
+    calls = []
+    for _ in range(num_calls):
+        time += datetime.timedelta(seconds=rng.randint(1, 60))
+        calls.append(Call(rng.choice(numbers), rng.choice(numbers), time,
+                          rng.randint(1, 999),
+                          (rng.uniform(MAP_LOWER[0], MAP_UPPER[0]),
+                           rng.uniform(MAP_LOWER[1], MAP_UPPER[1])),
+                          (rng.uniform(MAP_LOWER[0], MAP_UPPER[0]),
+                           rng.uniform(MAP_LOWER[1], MAP_UPPER[1]))))
+    return calls
+
+
+def make_dataset(num_customers: int, num_events: int,
+                 seed: int = 148,
+                 lines_per_customer: tuple[int, int] = (1, 3),
+                 months: int = 24) -> dict[str, list[dict]]:
+    """ Return a random dataset in the format described in the A1 handout,
+    with <num_customers> customers owning between lines_per_customer[0] and
+    lines_per_customer[1] phone lines each, and <num_events> events spread
+    over about <months> months, a tenth of them sms. The same arguments give
+    the same dataset.
+    """
+    rng = random.Random(seed)
+    customers = []
+    numbers = []
+    for cid in range(num_customers):
+        lines = []
+        for _ in range(rng.randint(*lines_per_customer)):
+            number = f"{len(numbers) // 10000:03}-{len(numbers) % 10000:04}"
+            numbers.append(number)
+            lines.append({'number': number,
+                          'contract': rng.choice(['prepaid', 'mtm', 'term'])})
+        customers.append({'id': 1000 + cid, 'lines': lines})
+    time = datetime.datetime(2018, 1, 1)
+    step = months * 365 * 24 * 3600 // 12 // max(1, num_events)
+    events = []
+    for _ in range(num_events):
+        time += datetime.timedelta(seconds=rng.randint(0, 2 * step))
+        src, dst = rng.sample(numbers, 2) if len(numbers) > 1 \
+            else (numbers[0], numbers[0])
+        event = {'type': 'sms' if rng.random() < 0.1 else 'call',
+                 'src_number': src,
+                 'dst_number': dst,
+                 'time': time.strftime(TIME_FORMAT),
+                 'src_loc': [rng.uniform(MAP_LOWER[0], MAP_UPPER[0]),
+                             rng.uniform(MAP_LOWER[1], MAP_UPPER[1])],
+                 'dst_loc': [rng.uniform(MAP_LOWER[0], MAP_UPPER[0]),
+                             rng.uniform(MAP_LOWER[1], MAP_UPPER[1])]}
+        if event['type'] == 'call':
+            event['duration'] = rng.randint(1, 1200)
+        events.append(event)
+    return {'customers': customers, 'events': events}
+
+
+def _measure_memory(build: Callable[[], Any]) -> int:
+    """ Return the number of bytes still allocated by <build>() once it
+    returns, including everything reachable from its result.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_call_memory(num_calls: int = 100000) -> dict[str, float]:
+    """ Return the memory used per call by a list of Call objects and by a
+    CallTable, for <num_calls> random calls.
+    """
+    text = json.dumps([{'src_number': c.src_number,
+                        'dst_number': c.dst_number,
+                        'time': c.time.strftime(TIME_FORMAT),
+                        'duration': c.duration,
+                        'src_loc': c.src_loc,
+                        'dst_loc': c.dst_loc}
+                       for c in make_calls(num_calls)])
+
+    def build_objects() -> list[Call]:
+        """ Build Call objects from json events, as they are built when the
+        dataset is loaded.
+        """
+        return [Call(e['src_number'], e['dst_number'],
+                     parse_time(e['time']),
+                     e['duration'], e['src_loc'], e['dst_loc'])
+                for e in json.loads(text)]
+
+    calls = build_objects()
+    object_bytes = _measure_memory(build_objects)
+    table_bytes = _measure_memory(lambda: CallTable(calls))
+    return {'calls': num_calls,
+            'object_bytes_per_call': object_bytes / num_calls,
+            'table_bytes_per_call': table_bytes / num_calls,
+            'reduction': object_bytes / table_bytes}
+
+
+def bench_parse_time(num_calls: int = 100000) -> dict[str, float]:
+    """ Return the number of event timestamps parsed per second by strptime
+    and by parse_time, for the timestamps of <num_calls> random calls.
+    """
+    stamps = [c.time.strftime(TIME_FORMAT) for c in make_calls(num_calls)]
+    start = time.perf_counter()
+    expected = [datetime.datetime.strptime(s, TIME_FORMAT) for s in stamps]
+    strptime_secs = time.perf_counter() - start
+    start = time.perf_counter()
+    result = [parse_time(s) for s in stamps]
+    parse_secs = time.perf_counter() - start
+    assert result == expected
+    return {'timestamps': num_calls,
+            'strptime_per_sec': num_calls / strptime_secs,
+            'parse_time_per_sec': num_calls / parse_secs,
+            'speedup': strptime_secs / parse_secs}
+
+
+def bench_call_store(num_events: int = 100000) -> dict[str, float]:
+    """ Return the time taken to load the calls of a dataset with
+    <num_events> random events into a CallTable, from its json file and from
+    its call store file.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        json_file = os.path.join(directory, 'dataset.json')
+        store_file = os.path.join(directory, 'dataset.calls')
+        with open(json_file, 'w') as file:
+            json.dump(make_dataset(100, num_events), file)
+        convert_to_store(json_file, store_file)
+
+        start = time.perf_counter()
+        decoder = EventDecoder()
+        calls = (decoder.decode(e) for e in iter_records(json_file, 'events'))
+        json_table = CallTable([c for c in calls if c is not None])
+        json_secs = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = CallStore(store_file)
+        store_table = store.table()
+        store_secs = time.perf_counter() - start
+        assert len(store_table) == len(json_table)
+        del store_table
+        store.close()
+    return {'calls': len(json_table),
+            'json_load_secs': json_secs,
+            'store_load_secs': store_secs,
+            'speedup': json_secs / store_secs}
+
+
+def _run_stage(run: Callable[[Any], Any], setup: Callable[[], Any],
+               count: int, repeat: int) -> dict[str, float]:
+    """ Return the results of the benchmark stage <run>(<setup>()), which
+    processes <count> items: its best time over <repeat> runs, the items
+    processed per second in that run, and the peak memory allocated by a
+    separate run traced by tracemalloc.
+
+    <setup> is called before every run of <run> and is not timed.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        state = setup()
+        gc.collect()
+        start = time.perf_counter()
+        run(state)
+        best = min(best, time.perf_counter() - start)
+    state = setup()
+    gc.collect()
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'secs': best,
+            'per_sec': count / best if best > 0 else float('inf'),
+            'peak_bytes': peak}
+
+
+def _bill_months(log: dict[str, list[dict]]) -> list[tuple[int, int]]:
+    """ Return the (month, year) of every billing cycle of the events in
+    <log>, in order.
+    """
+    if not log['events']:
+        return []
+    first = parse_time(log['events'][0]['time'])
+    last = parse_time(log['events'][-1]['time'])
+    months = []
+    month, year = first.month, first.year
+    while (year, month) <= (last.year, last.month):
+        months.append((month, year))
+        month, year = (1, year + 1) if month == 12 else (month + 1, year)
+    return months
+
+
+def _render(calls: list[Call]) -> Any:
+    """ Return a function drawing <calls> on an off-screen surface, as the
+    main loop of the application draws them, or None if the map or sprite
+    images can not be loaded.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pygame
+    from visualizer import SCREEN_SIZE, Map
+    try:
+        screen_map = Map(SCREEN_SIZE)
+        if calls:
+            calls[0].get_drawables()
+    except (FileNotFoundError, pygame.error):
+        return None
+    screen = pygame.Surface(SCREEN_SIZE)
+
+    def render(_: Any) -> None:
+        """ Draw <calls> on <screen>.
+        """
+        screen.blit(screen_map.get_current_view(), (0, 0))
+        screen_map.render_calls(calls, screen)
+    return render
+
+
+def run_suite(num_customers: int = 50, num_events: int = 20000,
+              lines: tuple[int, int] = (1, 3), months: int = 24,
+              seed: int = 148, repeat: int = 3) -> dict[str, Any]:
+    """ Return the results of benchmarking every stage of the application on
+    the dataset make_dataset(<num_customers>, <num_events>, <seed>, <lines>,
+    <months>), with the best time of <repeat> runs of each stage.
+
+    The results hold the parameters of the run, a description of the
+    environment, and for each stage its time in seconds, the events, calls or
+    bills it processed per second, and its peak memory in bytes. The render
+    stage is None if the map and sprite images are not available.
+    """
+    log = make_dataset(num_customers, num_events, seed, lines, months)
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    calls = ResetFilter().apply(customers, [], "")
+    if isinstance(calls, CallList):
+        build_indexes(calls.table)
+    bill_months = _bill_months(log)
+    num_calls = len(calls)
+
+    def new_customers() -> list[Customer]:
+        """ Return new customers for the dataset, without any event.
+        """
+        return create_customers(log)
+
+    def new_calls() -> list[Call]:
+        """ Return a copy of the calls, in a new table with its own indexes
+        when NumPy is installed, so that the filters find nothing cached by
+        the previous runs. Drop the cached result of the reset filter.
+        """
+        _RESET_CACHE.clear()
+        if not isinstance(calls, CallList):
+            return list(calls)
+        fresh = CallList(calls)
+        build_indexes(fresh.table)
+        return fresh
+
+    stages = {
+        'create_customers': _run_stage(create_customers, lambda: log,
+                                       num_customers, repeat),
+        'process_event_history': _run_stage(
+            lambda c: process_event_history(log, c), new_customers,
+            num_events, repeat)
+    }
+    filters: list[tuple[Filter, str]] = [
+        (ResetFilter(), ""),
+        (CustomerFilter(), str(customers[0].get_id())),
+        (DurationFilter(), "G300"),
+        (LocationFilter(), "-79.6, 43.6, -79.3, 43.7")
+    ]
+    for f, filter_string in filters:
+        stages['filter_' + type(f).__name__] = _run_stage(
+            lambda data, f=f, fs=filter_string: f.apply(customers, data, fs),
+            new_calls, num_calls, repeat)
+    stages['generate_bill'] = _run_stage(
+        lambda _: [c.generate_bill(m, y) for c in customers
+                   for m, y in bill_months],
+        lambda: None, len(customers) * len(bill_months), repeat)
+    render = _render(calls)
+    stages['render'] = None if render is None else \
+        _run_stage(render, lambda: None, num_calls, repeat)
+
+    return {'params': {'customers': num_customers, 'events': num_events,
+                       'lines': list(lines), 'months': months, 'seed': seed,
+                       'repeat': repeat},
+            'environment': {'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'numpy': None if numpy is None
+                            else numpy.__version__,
+                            'cpus': os.cpu_count()},
+            'calls': num_calls,
+            'stages': stages}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark the phone management system and print the "
+                    "results as json.")
+    parser.add_argument('--customers', type=int, default=50)
+    parser.add_argument('--lines', type=int, nargs=2, default=[1, 3],
+                        metavar=('MIN', 'MAX'),
+                        help="phone lines per customer")
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--seed', type=int, default=148)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--micro', action='store_true',
+                        help="also run the call memory, parse_time and call "
+                             "store benchmarks")
+    parser.add_argument('--output', help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {'suite': run_suite(args.customers, args.events,
+                                  tuple(args.lines), args.months, args.seed,
+                                  args.repeat)}
+    if args.micro:
+        results['call_memory'] = bench_call_memory()
+        results['parse_time'] = bench_parse_time()
+        results['call_store'] = bench_call_store()
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,184 @@
+"""
+CSC148, Winter 2024
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the bulk billing functions, which produce the bills of
+many customers over many months at once, e.g. for a month-end run.
+
+The bills are produced in a single pass over the bills of each phone line,
+without building a summary dict per bill as PhoneLine.get_bill does, and
+without printing anything. Each bill is a row with the BILL_COLUMNS, holding
+the same values as the summary returned by PhoneLine.get_bill, along with the
+customer id and the billing month and year. The rows can be collected into
+columns by bill_columns, or streamed to a csv or json-lines file by
+write_bills.
+"""
+import csv
+import io
+import json
+import sys
+from array import array
+from typing import Iterable, Iterator, Optional, TextIO, Union
+
+from customer import Customer
+
+# The columns of a bill row, in order
+BILL_COLUMNS = ('customer', 'number', 'month', 'year', 'type', 'fixed',
+                'free_mins', 'billed_mins', 'min_rate', 'total')
+
+# The array typecode of each numeric column of bill_columns. The other columns
+# are lists of strings.
+_COLUMN_TYPES = {'customer': 'q', 'month': 'q', 'year': 'q', 'fixed': 'd',
+                 'free_mins': 'q', 'billed_mins': 'q', 'min_rate': 'd',
+                 'total': 'd'}
+
+# Number of rows written to a file at a time
+WRITE_BATCH = 4096
+
+BillRow = tuple[int, str, int, int, str, float, int, int, float, float]
+
+
+def iter_bills(customers: Iterable[Customer],
+               months: Optional[Iterable[tuple[int, int]]] = None) \
+        -> Iterator[BillRow]:
+    """ Yield a row with the BILL_COLUMNS for every bill of the phone lines of
+    the <customers>, in order of customer, then phone line, then billing
+    month.
+
+    If <months> is given, only yield the bills of these (month, year)
+    billing cycles, in the order of <months>. Otherwise, yield every bill of
+    each phone line in chronological order.
+    """
+    if months is not None:
+        months = list(months)
+    for customer in customers:
+        cid = customer.get_id()
+        for line in customer.get_phone_lines():
+            number = line.number
+            bills = line.bills
+            if months is None:
+                keys = sorted(bills, key=lambda key: (key[1], key[0]))
+            else:
+                keys = [key for key in months if key in bills]
+            for key in keys:
+                bill = bills[key]
+                yield (cid, number, key[0], key[1], bill.type,
+                       bill.fixed_cost, bill.free_min, bill.billed_min,
+                       bill.min_rate, bill.get_cost())
+
+
+def bill_columns(customers: Iterable[Customer],
+                 months: Optional[Iterable[tuple[int, int]]] = None) \
+        -> dict[str, Union[array, list[str]]]:
+    """ Return the bills of the <customers>, as given by iter_bills with
+    <months>, as a dict mapping each of the BILL_COLUMNS to its values.
+
+    The numeric columns are arrays, the "number" and "type" columns are lists
+    of strings.
+    """
+    columns = {name: array(_COLUMN_TYPES[name]) if name in _COLUMN_TYPES
+               else [] for name in BILL_COLUMNS}
+    appends = [columns[name].append for name in BILL_COLUMNS]
+    for row in iter_bills(customers, months):
+        for append, value in zip(appends, row):
+            append(value)
+    return columns
+
+
+# The line written for a bill row in each format, with the "number" and
+# "type" values already escaped. The other values are written with repr, as
+# both the csv and json modules write them.
+_ROW_FORMATS = {
+    'csv': "%r,%s,%r,%r,%s,%r,%r,%r,%r,%r\n",
+    'jsonl': "{" + ", ".join('"' + name + '": ' + ('%s' if name in
+                                                    ('number', 'type')
+                                                    else '%r')
+                             for name in BILL_COLUMNS) + "}\n"
+}
+
+
+def _csv_field(text: str) -> str:
+    """ Return <text> as a field of a csv row, quoted as the csv module
+    quotes it.
+    """
+    output = io.StringIO()
+    csv.writer(output, lineterminator="").writerow([text])
+    return output.getvalue()
+
+
+def _write_rows(file: TextIO, rows: Iterator[BillRow], fmt: str) -> int:
+    """ Write the bill <rows> to <file>, in the format <fmt> ("csv" or
+    "jsonl"), and return the number of rows written.
+
+    The rows are written exactly as csv.writer or json.dumps would write
+    them, but the "number" and "type" values, which repeat across rows, are
+    only escaped once.
+    """
+    escape = _csv_field if fmt == 'csv' else json.dumps
+    escaped = {}
+    line = _ROW_FORMATS[fmt]
+    if fmt == 'csv':
+        file.write(",".join(BILL_COLUMNS) + "\n")
+    count = 0
+    batch = []
+    for cid, number, month, year, kind, *costs in rows:
+        number_text = escaped.get(number)
+        if number_text is None:
+            number_text = escaped[number] = escape(number)
+        kind_text = escaped.get(kind)
+        if kind_text is None:
+            kind_text = escaped[kind] = escape(kind)
+        batch.append(line % (cid, number_text, month, year, kind_text,
+                             *costs))
+        if len(batch) == WRITE_BATCH:
+            file.write("".join(batch))
+            count += len(batch)
+            batch = []
+    file.write("".join(batch))
+    return count + len(batch)
+
+
+def write_bills(customers: Iterable[Customer], filename: str,
+                fmt: str = 'csv',
+                months: Optional[Iterable[tuple[int, int]]] = None) -> int:
+    """ Write the bills of the <customers>, as given by iter_bills with
+    <months>, to the file <filename>, or to standard output if <filename> is
+    "-". Return the number of bills written.
+
+    If <fmt> is "csv", the file starts with a header row of the BILL_COLUMNS,
+    followed by one row per bill. If <fmt> is "jsonl", every line holds a
+    json object mapping the BILL_COLUMNS to the values of one bill.
+    The bills are written as they are produced, so they are never all held in
+    memory.
+
+    Raise a ValueError if <fmt> is neither "csv" nor "jsonl".
+    """
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError("Unknown bill format: " + fmt)
+    rows = iter_bills(customers, months)
+    if filename == '-':
+        return _write_rows(sys.stdout, rows, fmt)
+    with open(filename, 'w', newline='') as file:
+        return _write_rows(file, rows, fmt)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'array', 'csv', 'io', 'json', 'sys',
+            'customer'
+        ],
+        'allowed-io': ['write_bills'],
+    })
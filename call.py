@@ -21,6 +21,28 @@ import pygame
 START_CALL_SPRITE = 'data/call-start-2.png'
 END_CALL_SPRITE = 'data/call-end-2.png'
 
+# Size in pixels of the sprites drawn on the map
+SPRITE_SIZE = (13, 13)
+
+# Scaled sprite images, loaded once per process and shared by all Drawables.
+# Keys are the sprite file names.
+_SPRITE_CACHE: dict[str, pygame.Surface] = {}
+
+
+def load_sprite(sprite_file: str) -> pygame.Surface:
+    """ Return the image stored in <sprite_file>, scaled to SPRITE_SIZE.
+
+    The image is only read from disk the first time a given <sprite_file> is
+    requested, and the same Surface is returned afterwards.
+    """
+    sprite = _SPRITE_CACHE.get(sprite_file)
+    if sprite is None:
+        sprite = pygame.transform.smoothscale(
+            pygame.image.load(os.path.join(os.path.dirname(__file__),
+                                           sprite_file)), SPRITE_SIZE)
+        _SPRITE_CACHE[sprite_file] = sprite
+    return sprite
+
 
 # ----------------------------------------------------------------------------
 # NOTE: You do not need to understand the implementation of the Drawable class
@@ -57,9 +79,7 @@ class Drawable:
         self.loc = None
 
         if sprite_file is not None and location is not None:
-            self.sprite = pygame.transform.smoothscale(
-                pygame.image.load(os.path.join(os.path.dirname(__file__),
-                                               sprite_file)), (13, 13))
+            self.sprite = load_sprite(sprite_file)
             self.loc = location
         else:
             self.linelimits = linelimits
@@ -100,17 +120,28 @@ class Call:
          connecting line between the two sprites representing the source and
          destination of this Call
 
+    The drawables and connection are only created the first time they are
+    accessed, so that calls which are never displayed do not load any sprite.
+
     === Representation Invariants ===
     -   duration >= 0
     """
+    __slots__ = ('src_number', 'dst_number', 'time', 'duration', 'src_loc',
+                 'dst_loc', '_drawables', '_connection')
+
+    # === Private Attributes ===
+    # _drawables:
+    #     the drawables of this Call, or None if not created yet
+    # _connection:
+    #     the connection of this Call, or None if not created yet
     src_number: str
     dst_number: str
     time: datetime.datetime
     duration: int
     src_loc: tuple[float, float]
     dst_loc: tuple[float, float]
-    drawables: list[Drawable]
-    connection: Drawable
+    _drawables: Optional[list[Drawable]]
+    _connection: Optional[Drawable]
 
     def __init__(self, src_nr: str, dst_nr: str,
                  calltime: datetime.datetime, duration: int,
@@ -124,12 +155,40 @@ class Call:
         self.duration = duration
         self.src_loc = src_loc
         self.dst_loc = dst_loc
-        self.drawables = [Drawable(sprite_file=START_CALL_SPRITE,
-                                   location=src_loc),
-                          Drawable(sprite_file=END_CALL_SPRITE,
-                                   location=dst_loc)]
+        self._drawables = None
+        self._connection = None
 
-        self.connection = Drawable(linelimits=(src_loc, dst_loc))
+    def __getstate__(self) -> tuple:
+        """ Return the state of this Call to be pickled, which leaves out its
+        drawables and connection.
+        """
+        return (self.src_number, self.dst_number, self.time, self.duration,
+                self.src_loc, self.dst_loc)
+
+    def __setstate__(self, state: tuple) -> None:
+        """ Restore this Call from the <state> returned by __getstate__.
+        """
+        self.__init__(*state)
+
+    @property
+    def drawables(self) -> list[Drawable]:
+        """ The sprites for drawing the source and destination of this Call
+        """
+        if self._drawables is None:
+            self._drawables = [Drawable(sprite_file=START_CALL_SPRITE,
+                                        location=self.src_loc),
+                               Drawable(sprite_file=END_CALL_SPRITE,
+                                        location=self.dst_loc)]
+        return self._drawables
+
+    @property
+    def connection(self) -> Drawable:
+        """ The connecting line between the source and destination of this Call
+        """
+        if self._connection is None:
+            self._connection = Drawable(linelimits=(self.src_loc,
+                                                    self.dst_loc))
+        return self._connection
 
     def get_bill_date(self) -> tuple[int, int]:
         """ Return the billing date for this Call, as a tuple containing the
@@ -10,10 +10,105 @@ any changes, are expressly prohibited.
 
 All of the files in this directory and all subdirectories are:
 Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the CallHistory class, which records the calls of a phone
+line by month, and keeps them in a time-ordered index for queries over any
+range of time.
+
+It also contains the HistoryView class, a read-only sequence over parts of
+some lists of calls, returned by these queries instead of copies of the calls.
 """
+import datetime
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator, Optional, Sequence, Union
+
 from call import Call
 
 
+class HistoryView(Sequence[Call]):
+    """ A read-only sequence of calls over ranges of some lists of calls, one
+    range after the other, which does not copy the calls.
+
+    The lists may grow after the view is created, the view keeps covering the
+    same calls.
+    """
+    # === Private Attributes ===
+    # _parts:
+    #     the ranges of calls of this view, in order, each given as a list of
+    #     calls with the start and stop positions of the range in it
+    # _offsets:
+    #     the position in this view of the first call of each range of _parts,
+    #     followed by the length of this view
+    _parts: list[tuple[list[Call], int, int]]
+    _offsets: list[int]
+
+    def __init__(self, parts: Iterable[tuple[list[Call], int, int]] = ()) \
+            -> None:
+        """ Create a new view over the calls calls[start:stop] of each
+        (calls, start, stop) range of <parts>, in order.
+        """
+        self._parts = [part for part in parts if part[1] < part[2]]
+        self._offsets = [0]
+        for _, start, stop in self._parts:
+            self._offsets.append(self._offsets[-1] + stop - start)
+
+    @staticmethod
+    def chain(views: Iterable['HistoryView']) -> 'HistoryView':
+        """ Return a new view over the calls of all the <views>, one view after
+        the other.
+        """
+        return HistoryView(part for view in views
+                           for part in view._parts)
+
+    def __len__(self) -> int:
+        """ Return the number of calls in this view.
+        """
+        return self._offsets[-1]
+
+    def __getitem__(self, index: Union[int, slice]) \
+            -> Union[Call, 'HistoryView']:
+        """ Return the call at <index> of this view, or a new view over the
+        calls in the slice <index>.
+        """
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                calls = list(self)[index]
+                return HistoryView([(calls, 0, len(calls))])
+            parts = []
+            for (calls, first, last), offset in zip(self._parts,
+                                                    self._offsets):
+                low = max(start - offset, 0)
+                high = min(stop - offset, last - first)
+                if low < high:
+                    parts.append((calls, first + low, first + high))
+            return HistoryView(parts)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history view index out of range")
+        part = bisect_right(self._offsets, index) - 1
+        calls, start, _ = self._parts[part]
+        return calls[start + index - self._offsets[part]]
+
+    def __iter__(self) -> Iterator[Call]:
+        """ Return an iterator over the calls of this view.
+        """
+        for calls, start, stop in self._parts:
+            yield from map(calls.__getitem__, range(start, stop))
+
+    def __eq__(self, other: object) -> bool:
+        """ Return whether <other> is a list or a view holding the same calls
+        as this view, in the same order.
+        """
+        if not isinstance(other, (list, HistoryView)):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            map(lambda a, b: a is b or a == b, self, other))
+
+
 class CallHistory:
     """A class for recording incoming and outgoing calls for a particular number
 
@@ -25,14 +120,45 @@ class CallHistory:
          Dictionary of outgoing calls. Keys are tuples containing a month and a
          year, values are a List of Call objects for that month and year.
     """
+    # === Private Attributes ===
+    # _index:
+    #     for the outgoing and incoming calls, in this order, a tuple with the
+    #     list of all the calls in chronological order and the list of their
+    #     times, or None if it must be rebuilt from the monthly dictionaries.
+    #     Calls added to the dictionaries without register_outgoing_call or
+    #     register_incoming_call are detected by the number of calls, and the
+    #     index is then rebuilt.
+    # _changes:
+    #     a counter increased every time a call is registered into this call
+    #     history
     incoming_calls: dict[tuple[int, int], list[Call]]
     outgoing_calls: dict[tuple[int, int], list[Call]]
+    _index: list[Optional[tuple[list[Call], list[datetime.datetime]]]]
+    _changes: int
 
     def __init__(self) -> None:
         """ Create an empty CallHistory.
         """
         self.outgoing_calls = {}
         self.incoming_calls = {}
+        self._index = [None, None]
+        self._changes = 0
+
+    def __getstate__(self) -> dict:
+        """ Return the state of this call history for pickling, without its
+        index, which is rebuilt when needed.
+        """
+        return {'outgoing_calls': self.outgoing_calls,
+                'incoming_calls': self.incoming_calls,
+                'changes': self._changes}
+
+    def __setstate__(self, state: dict) -> None:
+        """ Restore this call history from its pickled <state>.
+        """
+        self.outgoing_calls = state['outgoing_calls']
+        self.incoming_calls = state['incoming_calls']
+        self._index = [None, None]
+        self._changes = state.get('changes', 0)
 
     def register_outgoing_call(self, call: Call) -> None:
         """ Register a Call <call> into this outgoing call history
@@ -42,6 +168,8 @@ class CallHistory:
             self.outgoing_calls[call.get_bill_date()] = [call]
         else:
             self.outgoing_calls[call.get_bill_date()].append(call)
+        self._add_to_index(0, call)
+        self._changes += 1
 
     def register_incoming_call(self, call: Call) -> None:
         """ Register a Call <call> into this incoming call history
@@ -51,6 +179,71 @@ class CallHistory:
             self.incoming_calls[call.get_bill_date()] = [call]
         else:
             self.incoming_calls[call.get_bill_date()].append(call)
+        self._add_to_index(1, call)
+        self._changes += 1
+
+    def get_changes(self) -> int:
+        """ Return a counter which increases every time a call is registered
+        into this call history.
+        """
+        return self._changes
+
+    def mark_changed(self, changes: int = 1) -> None:
+        """ Record that <changes> calls were added to this call history
+        without registering them, e.g. when they were loaded from a file.
+        """
+        self._changes += changes
+
+    def _add_to_index(self, direction: int, call: Call) -> None:
+        """ Add the <call> to the index of the outgoing calls if <direction> is
+        0, or of the incoming calls if it is 1, if that index is built.
+        """
+        index = self._index[direction]
+        if index is not None:
+            if index[1] and call.time < index[1][-1]:
+                # out of order, the index is sorted again when next used
+                self._index[direction] = None
+            else:
+                index[0].append(call)
+                index[1].append(call.time)
+
+    def _get_index(self, direction: int) \
+            -> tuple[list[Call], list[datetime.datetime]]:
+        """ Return the index of the outgoing calls if <direction> is 0, or of
+        the incoming calls if it is 1, building it if needed.
+        """
+        monthly = self.outgoing_calls if direction == 0 \
+            else self.incoming_calls
+        index = self._index[direction]
+        if index is None or len(index[0]) != sum(map(len, monthly.values())):
+            calls = []
+            for key in sorted(monthly, key=lambda key: (key[1], key[0])):
+                calls.extend(monthly[key])
+            times = [call.time for call in calls]
+            if any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+                calls.sort(key=lambda call: call.time)
+                times.sort()
+            index = self._index[direction] = (calls, times)
+        return index
+
+    def get_window(self, start: Optional[datetime.datetime] = None,
+                   end: Optional[datetime.datetime] = None) \
+            -> tuple[HistoryView, HistoryView]:
+        """ Return read-only views over the outgoing and incoming calls made
+        from <start> included to <end> excluded, in chronological order, as a
+        tuple in the following format:
+        (outgoing calls, incoming calls)
+
+        If <start> or <end> is None, the range of time is not bounded on that
+        side.
+        """
+        views = []
+        for direction in (0, 1):
+            calls, times = self._get_index(direction)
+            low = 0 if start is None else bisect_left(times, start)
+            high = len(times) if end is None else bisect_left(times, end)
+            views.append(HistoryView([(calls, low, high)]))
+        return views[0], views[1]
 
     # ----------------------------------------------------------
     # NOTE: You do not need to understand the implementation of
@@ -75,19 +268,13 @@ class CallHistory:
         monthly_history = ([], [])
         if month is not None and year is not None:
             if (month, year) in self.outgoing_calls:
-                for call in self.outgoing_calls[(month, year)]:
-                    monthly_history[0].append(call)
+                monthly_history[0].extend(self.outgoing_calls[(month, year)])
 
             if (month, year) in self.incoming_calls:
-                for call in self.incoming_calls[(month, year)]:
-                    monthly_history[1].append(call)
+                monthly_history[1].extend(self.incoming_calls[(month, year)])
         else:
-            for entry in self.outgoing_calls:
-                for call in self.outgoing_calls[entry]:
-                    monthly_history[0].append(call)
-            for entry in self.incoming_calls:
-                for call in self.incoming_calls[entry]:
-                    monthly_history[1].append(call)
+            monthly_history[0].extend(self._get_index(0)[0])
+            monthly_history[1].extend(self._get_index(1)[0])
         return monthly_history
 
 
@@ -95,8 +282,7 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'datetime', 'call'
-            ''
+            'python_ta', 'typing', 'datetime', 'bisect', 'call'
         ],
         'disable': ['R0902', 'R0913'],
         'generated-members': 'pygame.*'
@@ -0,0 +1,242 @@
+"""
+CSC148, Winter 2024
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the indexes built over the rows of a CallTable, which let
+the filters find the matching calls without checking every call.
+
+An index is built once for a table, through CallTable.get_index, and is
+rebuilt if rows are appended to the table afterwards.
+All indexes require NumPy.
+"""
+from typing import Any
+
+from calltable import CallTable, numpy
+from customer import Customer
+
+# Map lower-left and upper-right coordinates (long, lat)
+MAP_LOWER = (-79.697878, 43.576959)
+MAP_UPPER = (-79.196382, 43.799568)
+
+# Number of grid cells along each axis of the spatial index
+GRID_CELLS = 128
+
+
+class SpatialIndex:
+    """ A uniform grid over the map, storing the source and destination of
+    every call of a CallTable in the cell containing it.
+
+    Locations outside of the map are stored in the nearest cell on the map
+    border, so every call can be found.
+    """
+    # === Private Attributes ===
+    # _cells:
+    #     number of grid cells along each axis
+    # _rows:
+    #     the table row of each call endpoint, ordered by grid cell
+    # _lon, _lat:
+    #     the longitude and latitude of each endpoint in _rows
+    # _starts:
+    #     for each cell id c, the endpoints of cell c are in
+    #     _rows[_starts[c]:_starts[c + 1]]. The cell at column x and row y of
+    #     the grid has id y * _cells + x.
+    # _size:
+    #     the number of rows of the table
+    _cells: int
+    _size: int
+    _rows: Any
+    _lon: Any
+    _lat: Any
+    _starts: Any
+
+    def __init__(self, table: CallTable, cells: int = GRID_CELLS) -> None:
+        """ Build a spatial index with <cells> by <cells> grid cells over the
+        calls of <table>.
+        """
+        self._cells = cells
+        self._size = len(table)
+        lon = numpy.concatenate((table.column('src_lon'),
+                                 table.column('dst_lon')))
+        lat = numpy.concatenate((table.column('src_lat'),
+                                 table.column('dst_lat')))
+        rows = numpy.tile(numpy.arange(len(table), dtype=numpy.int64), 2)
+        cell_ids = self._cell_y(lat) * cells + self._cell_x(lon)
+        order = numpy.argsort(cell_ids, kind='stable')
+        self._rows = rows[order]
+        self._lon = lon[order]
+        self._lat = lat[order]
+        self._starts = numpy.searchsorted(cell_ids[order],
+                                          numpy.arange(cells * cells + 1))
+
+    def _cell_x(self, lon: Any) -> Any:
+        """ Return the grid column of each longitude in <lon>.
+        """
+        x = ((numpy.asarray(lon) - MAP_LOWER[0])
+             / (MAP_UPPER[0] - MAP_LOWER[0]) * self._cells)
+        return numpy.clip(x, 0, self._cells - 1).astype(numpy.int64)
+
+    def _cell_y(self, lat: Any) -> Any:
+        """ Return the grid row of each latitude in <lat>.
+        """
+        y = ((numpy.asarray(lat) - MAP_LOWER[1])
+             / (MAP_UPPER[1] - MAP_LOWER[1]) * self._cells)
+        return numpy.clip(y, 0, self._cells - 1).astype(numpy.int64)
+
+    def _cell_ranges(self, low_long: float, low_lat: float,
+                     up_long: float, up_lat: float) -> list[tuple[int, int]]:
+        """ Return the ranges of _rows holding the endpoints of the cells
+        covering the rectangle from (<low_long>, <low_lat>) to (<up_long>,
+        <up_lat>), one (start, stop) range per grid row.
+        """
+        x0, x1 = self._cell_x([low_long, up_long]).tolist()
+        y0, y1 = self._cell_y([low_lat, up_lat]).tolist()
+        if x0 > x1:
+            return []
+        # the cells x0..x1 of a grid row are contiguous in _rows
+        return [(int(self._starts[y * self._cells + x0]),
+                 int(self._starts[y * self._cells + x1 + 1]))
+                for y in range(y0, y1 + 1)]
+
+    def count_candidates(self, low_long: float, low_lat: float,
+                         up_long: float, up_lat: float) -> int:
+        """ Return the number of call endpoints that query would check for the
+        rectangle from (<low_long>, <low_lat>) to (<up_long>, <up_lat>).
+        This is an upper bound on the number of calls query returns.
+        """
+        return sum(stop - start for start, stop in
+                   self._cell_ranges(low_long, low_lat, up_long, up_lat))
+
+    def query(self, low_long: float, low_lat: float,
+              up_long: float, up_lat: float) -> Any:
+        """ Return the rows of all calls whose source or destination is within
+        the rectangle from (<low_long>, <low_lat>) to (<up_long>, <up_lat>),
+        boundary included, as a sorted NumPy array without duplicates.
+        """
+        ranges = self._cell_ranges(low_long, low_lat, up_long, up_lat)
+        if not ranges:
+            return numpy.zeros(0, dtype=numpy.int64)
+        index = numpy.concatenate([numpy.arange(start, stop)
+                                   for start, stop in ranges])
+        lon = self._lon[index]
+        lat = self._lat[index]
+        inside = ((low_long <= lon) & (lon <= up_long)
+                  & (low_lat <= lat) & (lat <= up_lat))
+        rows = self._rows[index[inside]]
+        if len(rows) * 16 < self._size:
+            return numpy.unique(rows)
+        # sorting many rows is slower than marking them
+        found = numpy.zeros(self._size, dtype=bool)
+        found[rows] = True
+        return numpy.flatnonzero(found)
+
+
+class DurationIndex:
+    """ The rows of a CallTable, sorted by the duration of their call.
+    """
+    # === Private Attributes ===
+    # _rows:
+    #     the table rows, sorted by duration, ties in increasing row order
+    # _durations:
+    #     the duration of the call of each row in _rows
+    _rows: Any
+    _durations: Any
+
+    def __init__(self, table: CallTable) -> None:
+        """ Build a duration index over the calls of <table>.
+        """
+        durations = table.column('durations')
+        self._rows = numpy.argsort(durations, kind='stable')
+        self._durations = durations[self._rows]
+
+    def _range(self, operator: str, duration: int) -> slice:
+        """ Return the part of _rows holding the calls shorter than <duration>
+        seconds if <operator> is "L", or longer if <operator> is "G".
+        """
+        if operator == 'L':
+            return slice(0, int(numpy.searchsorted(self._durations, duration,
+                                                   'left')))
+        return slice(int(numpy.searchsorted(self._durations, duration,
+                                            'right')), len(self._rows))
+
+    def count(self, operator: str, duration: int) -> int:
+        """ Return the number of calls query returns for <operator> and
+        <duration>.
+        """
+        selected = self._range(operator, duration)
+        return selected.stop - selected.start
+
+    def query(self, operator: str, duration: int) -> Any:
+        """ Return the rows of all calls shorter than <duration> seconds if
+        <operator> is "L", or longer if <operator> is "G", as a sorted NumPy
+        array.
+        """
+        return numpy.sort(self._rows[self._range(operator, duration)])
+
+
+class CustomerIndex:
+    """ The rows of the calls made or received by each customer, in a
+    CallTable.
+
+    The rows of a customer are gathered from the rows the table keeps for
+    each phone number, on the first query for that customer, and reused by
+    later queries as long as the customer owns the same phone numbers.
+    """
+    # === Private Attributes ===
+    # _table:
+    #     the table this index is built on
+    # _rows:
+    #     the sorted rows of the calls involving each tuple of phone numbers
+    #     queried so far
+    _table: CallTable
+    _rows: dict[tuple[str, ...], Any]
+
+    def __init__(self, table: CallTable) -> None:
+        """ Create a customer index over the calls of <table>.
+        """
+        self._table = table
+        self._rows = {}
+
+    def query(self, customer: Customer) -> Any:
+        """ Return the rows of all calls made or received by any phone line of
+        <customer>, as a sorted NumPy array without duplicates.
+        """
+        numbers = tuple(customer.get_phone_numbers())
+        rows = self._rows.get(numbers)
+        if rows is None:
+            parts = [numpy.zeros(0, dtype=numpy.int32)]
+            for number in numbers:
+                parts.extend(numpy.frombuffer(r, dtype=numpy.int32)
+                             for r in self._table.rows_of(number))
+            rows = numpy.unique(numpy.concatenate(parts)).astype(numpy.int64)
+            self._rows[numbers] = rows
+        return rows
+
+
+def build_indexes(table: CallTable) -> None:
+    """ Build all the indexes over the rows of <table> now, instead of when
+    they are first used by a filter. Do nothing if NumPy is not installed.
+    """
+    if numpy is not None:
+        table.get_index(SpatialIndex)
+        table.get_index(DurationIndex)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'calltable', 'customer'
+        ],
+        'generated-members': 'numpy.*'
+    })
@@ -0,0 +1,241 @@
+"""
+CSC148, Winter 2024
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the call store, a compact binary file format for the calls
+of an event log, which can be opened without parsing it.
+
+A call store file is made of:
+- a header of HEADER_SIZE bytes, holding STORE_MAGIC, the format version, the
+number of calls and the position of the number dictionary.
+- one fixed-width record of RECORD.size bytes per call, in the order of the
+event log, with its time in seconds since EPOCH, duration, source and
+destination number ids, and the longitude and latitude of its source and
+destination. All values are little-endian.
+- the number dictionary, the phone number of each number id, in order, as
+utf-8 text with one number per line.
+
+The CallStore class memory-maps a store file, so its calls are only read from
+disk when accessed. With NumPy, its columns are views over the mapped file,
+and it can be used as a CallTable by the filters without copying them.
+SMS events are not kept in a call store.
+
+A call store only holds calls, without the customers, so the application
+still builds its customers from the dataset file. It can then bill and show
+the calls of a store instead of decoding the events of the dataset (see
+application.process_store_history). SMS events are not billed, so they are
+not needed.
+"""
+import mmap
+import struct
+from array import array
+from typing import Any, BinaryIO, Iterable, Iterator
+
+from call import Call
+from calltable import ArrayCallTable, TableCallList, from_epoch, numpy, \
+    to_epoch
+from eventlog import EventDecoder, iter_records
+
+# The first bytes of every call store file, followed by the format version
+STORE_MAGIC = b"MWCS"
+STORE_VERSION = 1
+
+# The header holds the magic bytes, the version, the number of calls and the
+# position of the number dictionary, followed by padding up to HEADER_SIZE
+HEADER = struct.Struct("<4sIQQ")
+HEADER_SIZE = 64
+
+# A call record: time, duration, source and destination number ids, 4 bytes
+# of padding to align the coordinates, and the source longitude and latitude
+# followed by the destination longitude and latitude
+RECORD = struct.Struct("<qiii4xdddd")
+
+# The CallTable column stored in each field of RECORD, in order
+RECORD_COLUMNS = ('times', 'durations', 'src_ids', 'dst_ids', 'src_lon',
+                  'src_lat', 'dst_lon', 'dst_lat')
+
+# Number of records written to a store file at a time
+WRITE_BATCH = 4096
+
+
+def write_store(filename: str, calls: Iterable[Call]) -> int:
+    """ Write the <calls> into the call store file <filename>, in order, and
+    return the number of calls written.
+    """
+    number_ids = {}
+    count = 0
+    with open(filename, "wb") as file:
+        file.write(bytes(HEADER_SIZE))
+        batch = bytearray()
+        for call in calls:
+            src = number_ids.setdefault(call.src_number, len(number_ids))
+            dst = number_ids.setdefault(call.dst_number, len(number_ids))
+            batch += RECORD.pack(to_epoch(call.time), call.duration, src, dst,
+                                 call.src_loc[0], call.src_loc[1],
+                                 call.dst_loc[0], call.dst_loc[1])
+            count += 1
+            if count % WRITE_BATCH == 0:
+                file.write(batch)
+                batch = bytearray()
+        file.write(batch)
+        numbers_offset = file.tell()
+        file.write("".join(number + "\n" for number in number_ids)
+                   .encode("utf-8"))
+        file.seek(0)
+        file.write(HEADER.pack(STORE_MAGIC, STORE_VERSION, count,
+                               numbers_offset))
+    return count
+
+
+def convert_to_store(src: str, dst: str) -> int:
+    """ Convert the calls of the dataset file <src>, in one of the formats
+    read by eventlog.iter_records, into the call store file <dst>. Return the
+    number of calls written.
+    """
+    decoder = EventDecoder()
+    calls = (decoder.decode(event) for event in iter_records(src, 'events'))
+    return write_store(dst, (call for call in calls if call is not None))
+
+
+class CallStore:
+    """ A call store file, memory-mapped for reading.
+
+    === Public Attributes ===
+    numbers:
+         the phone number for each number id
+    """
+    # === Private Attributes ===
+    # _file:
+    #     the open store file
+    # _map:
+    #     the memory map over _file
+    # _length:
+    #     the number of calls in the store
+    numbers: list[str]
+    _file: BinaryIO
+    _map: mmap.mmap
+    _length: int
+
+    def __init__(self, filename: str) -> None:
+        """ Open the call store file <filename>.
+
+        Raise a ValueError if <filename> is not a call store file of this
+        version.
+        """
+        self._file = open(filename, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can not be mapped
+            self._file.close()
+            raise ValueError(filename + " is not a call store file")
+        if len(self._map) < HEADER_SIZE:
+            self.close()
+            raise ValueError(filename + " is not a call store file")
+        magic, version, self._length, numbers_offset = \
+            HEADER.unpack_from(self._map)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            self.close()
+            raise ValueError(filename + " is not a call store file of "
+                             "version " + str(STORE_VERSION))
+        self.numbers = self._map[numbers_offset:].decode("utf-8").split("\n")
+        self.numbers.pop()
+
+    def __len__(self) -> int:
+        """ Return the number of calls in this store.
+        """
+        return self._length
+
+    def get_call(self, row: int) -> Call:
+        """ Return a new Call object for the call stored at <row>.
+        """
+        if not 0 <= row < self._length:
+            raise IndexError("call store row out of range")
+        (time, duration, src, dst, src_lon, src_lat, dst_lon,
+         dst_lat) = RECORD.unpack_from(self._map,
+                                       HEADER_SIZE + row * RECORD.size)
+        return Call(self.numbers[src], self.numbers[dst], from_epoch(time),
+                    duration, (src_lon, src_lat), (dst_lon, dst_lat))
+
+    def __iter__(self) -> Iterator[Call]:
+        """ Return an iterator over new Call objects for the calls of this
+        store, in order.
+        """
+        numbers = self.numbers
+        end = HEADER_SIZE + self._length * RECORD.size
+        # unpack the records through a view, without copying them
+        with memoryview(self._map) as view:
+            for (time, duration, src, dst, src_lon, src_lat, dst_lon,
+                 dst_lat) in RECORD.iter_unpack(view[HEADER_SIZE:end]):
+                yield Call(numbers[src], numbers[dst], from_epoch(time),
+                           duration, (src_lon, src_lat), (dst_lon, dst_lat))
+
+    def records(self) -> Any:
+        """ Return the records of this store as a NumPy structured array,
+        whose fields are named after RECORD_COLUMNS, without copying them.
+
+        Precondition: NumPy is installed.
+        """
+        dtype = numpy.dtype({'names': list(RECORD_COLUMNS),
+                             'formats': ['<i8', '<i4', '<i4', '<i4',
+                                         '<f8', '<f8', '<f8', '<f8'],
+                             'offsets': [0, 8, 12, 16, 24, 32, 40, 48],
+                             'itemsize': RECORD.size})
+        return numpy.frombuffer(self._map, dtype=dtype, count=self._length,
+                                offset=HEADER_SIZE)
+
+    def table(self) -> ArrayCallTable:
+        """ Return a read-only CallTable over the calls of this store, whose
+        columns are views over the mapped file.
+
+        Precondition: NumPy is installed.
+        """
+        records = self.records()
+        return ArrayCallTable({name: records[name] for name in RECORD_COLUMNS},
+                              self.numbers)
+
+    def call_list(self) -> TableCallList:
+        """ Return a CallList of all the calls of this store, in order, over
+        the table returned by table(), so that it can be given to the filters.
+        Its Call objects are only created when they are accessed.
+
+        Precondition: NumPy is installed.
+        """
+        rows = numpy.arange(self._length, dtype=numpy.int64)
+        return TableCallList(self.table(), array('q', rows.tobytes()), True)
+
+    def close(self) -> None:
+        """ Close this store. The arrays and tables returned by this store
+        must not be used anymore.
+        """
+        try:
+            self._map.close()
+        except (AttributeError, BufferError):
+            # the map stays open as long as some array still uses it
+            pass
+        self._file.close()
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'array', 'mmap', 'struct', 'call',
+            'calltable',
+            'eventlog'
+        ],
+        'allowed-io': ['write_store', '__init__'],
+        'generated-members': 'numpy.*'
+    })
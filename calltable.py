@@ -0,0 +1,539 @@
+"""
+CSC148, Winter 2024
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the CallTable class, a compact columnar store for calls,
+and the CallView class, a read-only sequence of calls over the rows of a
+CallTable.
+
+A CallTable keeps each call attribute in its own typed array instead of
+keeping a Call object per call, which takes several times less memory.
+Call objects are only created when a row is accessed through a CallView.
+
+The ArrayCallTable class is a read-only CallTable over NumPy arrays, such as
+arrays in shared memory or in a memory-mapped file.
+
+It also contains the CallList class, a list of Call objects which remembers
+the CallTable row of each of its calls, so that the filters can evaluate their
+criteria over whole columns at once, and the TableCallList class, a CallList
+which creates its Call objects from its table only when they are accessed.
+
+NumPy is optional. Without it, the columns can not be accessed as NumPy arrays
+and the filters fall back to checking each Call object in turn.
+"""
+import datetime
+import sys
+from array import array
+from itertools import count, repeat
+from typing import Any, Iterable, Iterator, Optional, Sequence, Union
+
+from call import Call
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Reference time for the epoch seconds stored in a CallTable
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Source of the generation ids of CallLists
+_GENERATIONS = count()
+
+
+def to_epoch(time: datetime.datetime) -> int:
+    """ Return the number of seconds between EPOCH and <time>.
+    """
+    return (time - EPOCH) // datetime.timedelta(seconds=1)
+
+
+def from_epoch(seconds: int) -> datetime.datetime:
+    """ Return the time which is <seconds> seconds after EPOCH.
+    """
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+
+class CallTable:
+    """ A columnar store of calls. Row i of every column describes the i-th
+    call appended to this table.
+
+    === Public Attributes ===
+    times:
+         time of each call, in seconds since EPOCH
+    durations:
+         duration in seconds of each call
+    src_lon, src_lat, dst_lon, dst_lat:
+         longitude and latitude of the source and destination of each call
+    src_ids, dst_ids:
+         number id of the source and destination number of each call
+    numbers:
+         the phone number for each number id
+
+    === Representation Invariants ===
+    - all the columns have the same length
+    - every number id in src_ids and dst_ids is a valid index into numbers
+    """
+    # === Private Attributes ===
+    # _number_ids:
+    #     the number id of each phone number in numbers
+    # _src_rows:
+    #     for each number id, the rows of the calls made from that number
+    # _dst_rows:
+    #     for each number id, the rows of the calls made to that number
+    # _indexes:
+    #     the indexes built over the rows of this table, keyed by index class
+    times: array
+    durations: array
+    src_lon: array
+    src_lat: array
+    dst_lon: array
+    dst_lat: array
+    src_ids: array
+    dst_ids: array
+    numbers: list[str]
+    _number_ids: dict[str, int]
+    _src_rows: list[array]
+    _dst_rows: list[array]
+    _indexes: dict[type, Any]
+
+    def __init__(self, calls: Iterable[Call] = ()) -> None:
+        """ Create a new CallTable containing the <calls>, in order.
+        """
+        self.times = array('q')
+        self.durations = array('i')
+        self.src_lon = array('d')
+        self.src_lat = array('d')
+        self.dst_lon = array('d')
+        self.dst_lat = array('d')
+        self.src_ids = array('i')
+        self.dst_ids = array('i')
+        self.numbers = []
+        self._number_ids = {}
+        self._src_rows = []
+        self._dst_rows = []
+        self._indexes = {}
+        for call in calls:
+            self.append(call)
+
+    def __len__(self) -> int:
+        """ Return the number of calls in this table.
+        """
+        return len(self.times)
+
+    def intern_number(self, number: str) -> int:
+        """ Return the number id of the phone number <number>, assigning it a
+        new id if this table has not seen it before.
+        """
+        nid = self._number_ids.get(number)
+        if nid is None:
+            nid = len(self.numbers)
+            self._number_ids[number] = nid
+            self.numbers.append(sys.intern(number))
+            self._src_rows.append(array('i'))
+            self._dst_rows.append(array('i'))
+        return nid
+
+    def number_id(self, number: str) -> Optional[int]:
+        """ Return the number id of the phone number <number>, or None if no
+        call in this table involves <number>.
+        """
+        return self._number_ids.get(number)
+
+    def rows_of(self, number: str) -> tuple[array, array]:
+        """ Return the rows of the calls made from and to the phone <number>,
+        each in increasing order, as a tuple in the following format:
+        (outgoing rows, incoming rows)
+
+        The returned arrays are owned by this table and must not be mutated.
+        """
+        nid = self._number_ids.get(number)
+        if nid is None:
+            return array('i'), array('i')
+        return self._src_rows[nid], self._dst_rows[nid]
+
+    def append(self, call: Call) -> int:
+        """ Add a row for <call> at the end of this table, and return the
+        index of that row.
+        """
+        if self._indexes:
+            self._indexes = {}
+        row = len(self.times)
+        src = self.intern_number(call.src_number)
+        dst = self.intern_number(call.dst_number)
+        self.times.append(to_epoch(call.time))
+        self.durations.append(call.duration)
+        self.src_lon.append(call.src_loc[0])
+        self.src_lat.append(call.src_loc[1])
+        self.dst_lon.append(call.dst_loc[0])
+        self.dst_lat.append(call.dst_loc[1])
+        self.src_ids.append(src)
+        self.dst_ids.append(dst)
+        self._src_rows[src].append(row)
+        self._dst_rows[dst].append(row)
+        return row
+
+    def get_call(self, row: int) -> Call:
+        """ Return a new Call object for the call stored at <row>.
+        """
+        return Call(self.numbers[self.src_ids[row]],
+                    self.numbers[self.dst_ids[row]],
+                    from_epoch(self.times[row]),
+                    self.durations[row],
+                    (self.src_lon[row], self.src_lat[row]),
+                    (self.dst_lon[row], self.dst_lat[row]))
+
+    def column(self, name: str) -> Any:
+        """ Return the column <name> of this table (e.g. "durations") as a
+        NumPy array sharing memory with the column.
+
+        Rows can not be appended to this table while the returned array is
+        alive, so it must not be kept around.
+
+        Precondition: NumPy is installed.
+        """
+        return numpy.frombuffer(getattr(self, name),
+                                dtype=getattr(self, name).typecode)
+
+    def get_index(self, index_class: type) -> Any:
+        """ Return the index of class <index_class> (e.g. a SpatialIndex) over
+        the rows of this table.
+
+        The index is built the first time it is requested, and rebuilt if rows
+        were appended to this table since.
+        """
+        index = self._indexes.get(index_class)
+        if index is None:
+            index = index_class(self)
+            self._indexes[index_class] = index
+        return index
+
+    def view(self, rows: Optional[Sequence[int]] = None) -> 'CallView':
+        """ Return a CallView over the <rows> of this table, in the given
+        order. If <rows> is None, the view covers all rows of this table.
+        """
+        if rows is None:
+            rows = range(len(self))
+        return CallView(self, rows)
+
+    def get_history(self, numbers: Iterable[str], month: int = None,
+                    year: int = None,
+                    start: Optional[datetime.datetime] = None,
+                    end: Optional[datetime.datetime] = None) \
+            -> tuple['CallView', 'CallView']:
+        """ Return views over the calls made from and to the phone <numbers>,
+        as a tuple in the following format:
+        (outgoing calls, incoming calls)
+
+        The calls of each number are grouped together, in the order of
+        <numbers>, and ordered as they were appended to this table.
+        If <month> and <year> are given, only return the calls made during
+        the <month> month of the <year> year.
+        If <start> or <end> is given, only return the calls made from <start>
+        included to <end> excluded.
+
+        Precondition:
+        - <month> and <year> are either both specified, or are both missing/None
+        - <month> and <year> are not given along with <start> or <end>
+        """
+        history = (array('i'), array('i'))
+        for number in numbers:
+            src_rows, dst_rows = self.rows_of(number)
+            history[0].extend(src_rows)
+            history[1].extend(dst_rows)
+        if month is not None and year is not None:
+            start = datetime.datetime(year, month, 1)
+            if month == 12:
+                end = datetime.datetime(year + 1, 1, 1)
+            else:
+                end = datetime.datetime(year, month + 1, 1)
+        if start is not None or end is not None:
+            # the times are whole seconds, so the bounds are rounded up
+            second = datetime.timedelta(seconds=1)
+            low = (-sys.maxsize if start is None
+                   else -((EPOCH - start) // second))
+            high = sys.maxsize if end is None else -((EPOCH - end) // second)
+            history = tuple(array('i', [row for row in rows
+                                        if low <= self.times[row] < high])
+                            for rows in history)
+        return self.view(history[0]), self.view(history[1])
+
+
+class ArrayCallTable(CallTable):
+    """ A read-only CallTable whose columns are NumPy arrays, for example
+    views over shared memory or over a memory-mapped file.
+
+    The columns are not copied, and they must not change while this table is
+    in use.
+    """
+    # === Private Attributes ===
+    # _length:
+    #     the number of rows of this table
+    _length: int
+
+    def __init__(self, columns: dict[str, Any], numbers: list[str]) -> None:
+        """ Create a table over the NumPy <columns>, whose number ids index
+        the phone <numbers>.
+
+        Precondition: NumPy is installed, and <columns> has an array of the
+        same length for every column of a CallTable (e.g. "times").
+        """
+        super().__init__()
+        for name, values in columns.items():
+            setattr(self, name, values)
+        self._length = len(columns['times'])
+        self.numbers = numbers
+        self._number_ids = {number: i for i, number in enumerate(numbers)}
+        # the rows are only grouped by number once rows_of is first called
+        self._src_rows = None
+        self._dst_rows = None
+
+    def rows_of(self, number: str) -> tuple[Any, Any]:
+        """ Return the rows of the calls made from and to the phone <number>,
+        each in increasing order, as a tuple in the following format:
+        (outgoing rows, incoming rows)
+
+        The first call sorts the rows of the whole table by number, in time
+        O(n log n) for n rows. The returned arrays are owned by this table and
+        must not be mutated.
+        """
+        if self._src_rows is None:
+            self._src_rows = self._group_rows(self.src_ids)
+            self._dst_rows = self._group_rows(self.dst_ids)
+        return super().rows_of(number)
+
+    def _group_rows(self, ids: Any) -> list[Any]:
+        """ Return the increasing rows of each number id in <ids>.
+        """
+        order = numpy.argsort(ids, kind='stable').astype(numpy.int32)
+        bounds = numpy.searchsorted(ids[order],
+                                    numpy.arange(len(self.numbers) + 1))
+        return [order[bounds[i]:bounds[i + 1]]
+                for i in range(len(self.numbers))]
+
+    def __len__(self) -> int:
+        """ Return the number of calls in this table.
+        """
+        return self._length
+
+    def column(self, name: str) -> Any:
+        """ Return the column <name> of this table as a NumPy array.
+        """
+        return getattr(self, name)
+
+    def append(self, call: Call) -> int:
+        """ Raise an error, as rows can not be added to an ArrayCallTable.
+        """
+        raise TypeError("an ArrayCallTable is read-only")
+
+    def get_call(self, row: int) -> Call:
+        """ Return a new Call object for the call stored at <row>.
+        """
+        return Call(self.numbers[self.src_ids[row]],
+                    self.numbers[self.dst_ids[row]],
+                    from_epoch(int(self.times[row])),
+                    int(self.durations[row]),
+                    (float(self.src_lon[row]), float(self.src_lat[row])),
+                    (float(self.dst_lon[row]), float(self.dst_lat[row])))
+
+
+class CallView(Sequence[Call]):
+    """ A read-only sequence of calls over some of the rows of a CallTable.
+
+    A CallView does not store any Call objects. Each time a call is accessed, a
+    new Call object is created from the table, so calls accessed twice are
+    equal in value but are not the same object.
+
+    === Public Attributes ===
+    table:
+         the CallTable holding the calls of this view
+    rows:
+         the row of <table> for each call of this view, in order
+    """
+    table: CallTable
+    rows: Sequence[int]
+
+    def __init__(self, table: CallTable, rows: Sequence[int]) -> None:
+        """ Create a new view over the <rows> of <table>.
+        """
+        self.table = table
+        self.rows = rows
+
+    def __len__(self) -> int:
+        """ Return the number of calls in this view.
+        """
+        return len(self.rows)
+
+    def __getitem__(self, index: Union[int, slice]) \
+            -> Union[Call, 'CallView']:
+        """ Return the call at <index> of this view, or a new view over the
+        calls in the slice <index>.
+        """
+        if isinstance(index, slice):
+            return CallView(self.table, self.rows[index])
+        return self.table.get_call(self.rows[index])
+
+    def __iter__(self) -> Iterator[Call]:
+        """ Return an iterator over the calls of this view.
+        """
+        get_call = self.table.get_call
+        for row in self.rows:
+            yield get_call(row)
+
+
+class CallList(list):
+    """ A list of Call objects which knows the CallTable row holding each of
+    its calls.
+
+    A CallList is never mutated after it is created, as its rows would no
+    longer match its calls. Slicing a CallList returns a new CallList.
+
+    === Public Attributes ===
+    table:
+         the CallTable holding a row for each call of this list
+    rows:
+         the row of <table> for each call of this list, in order
+    sorted_rows:
+         whether <rows> is known to be in increasing order
+    generation:
+         an id unique to this CallList, identifying its set of calls in caches
+    """
+    table: CallTable
+    rows: array
+    sorted_rows: bool
+    generation: int
+
+    def __init__(self, calls: Iterable[Call] = (),
+                 table: Optional[CallTable] = None,
+                 rows: Optional[array] = None,
+                 sorted_rows: bool = False) -> None:
+        """ Create a new CallList with the <calls>, whose rows in <table> are
+        <rows>. <sorted_rows> tells whether <rows> is in increasing order.
+
+        If no <table> is given, a new CallTable is built from the <calls>.
+        """
+        super().__init__(calls)
+        if table is None:
+            table = CallTable(self)
+            rows = array('q', range(len(self)))
+            sorted_rows = True
+        self.table = table
+        self.rows = rows
+        self.sorted_rows = sorted_rows
+        self.generation = next(_GENERATIONS)
+
+    def __getitem__(self, index: Union[int, slice]) \
+            -> Union[Call, 'CallList']:
+        """ Return the call at <index> of this list, or a new CallList with the
+        calls in the slice <index>.
+        """
+        if isinstance(index, slice):
+            return CallList(super().__getitem__(index), self.table,
+                            self.rows[index],
+                            self.sorted_rows and (index.step or 1) > 0)
+        return super().__getitem__(index)
+
+    def row_array(self) -> Any:
+        """ Return the rows of this list as a NumPy array sharing memory with
+        <rows>.
+
+        Precondition: NumPy is installed.
+        """
+        return numpy.frombuffer(self.rows, dtype=numpy.int64)
+
+    def select(self, positions: Any) -> 'CallList':
+        """ Return a new CallList with the calls at the <positions> of this
+        list, in order.
+
+        Precondition: NumPy is installed and <positions> is a NumPy array of
+        integers in increasing order.
+        """
+        rows = array('q', self.row_array()[positions].tobytes())
+        calls = map(list.__getitem__, repeat(self), positions.tolist())
+        return CallList(calls, self.table, rows, self.sorted_rows)
+
+    def positions_of(self, rows: Any) -> Any:
+        """ Return the positions in this list of the calls whose row is in
+        <rows>, in increasing order, as a NumPy array.
+
+        Precondition: NumPy is installed and <rows> is a NumPy array of rows in
+        increasing order, without duplicates.
+        """
+        mine = self.row_array()
+        if not self.sorted_rows:
+            return numpy.flatnonzero(numpy.isin(mine, rows))
+        positions = numpy.searchsorted(mine, rows)
+        found = positions < len(mine)
+        positions = positions[found]
+        return positions[mine[positions] == rows[found]]
+
+
+class TableCallList(CallList):
+    """ A CallList which does not store any Call objects. Like a CallView, it
+    creates a new Call object from its table each time a call is accessed, so
+    calls accessed twice are equal in value but are not the same object.
+
+    Only len, indexing, slicing and iteration are supported: the other list
+    methods (e.g. sort, == or in) see an empty list.
+    """
+    def __init__(self, table: CallTable, rows: array,
+                 sorted_rows: bool = False) -> None:
+        """ Create a new TableCallList over the <rows> of <table>.
+        <sorted_rows> tells whether <rows> is in increasing order.
+        """
+        super().__init__((), table, rows, sorted_rows)
+
+    def __len__(self) -> int:
+        """ Return the number of calls in this list.
+        """
+        return len(self.rows)
+
+    def __getitem__(self, index: Union[int, slice]) \
+            -> Union[Call, 'TableCallList']:
+        """ Return a new Call object for the call at <index> of this list, or
+        a new TableCallList with the calls in the slice <index>.
+        """
+        if isinstance(index, slice):
+            return TableCallList(self.table, self.rows[index],
+                                 self.sorted_rows and (index.step or 1) > 0)
+        return self.table.get_call(self.rows[index])
+
+    def __iter__(self) -> Iterator[Call]:
+        """ Return an iterator over new Call objects for the calls of this
+        list.
+        """
+        get_call = self.table.get_call
+        for row in self.rows:
+            yield get_call(row)
+
+    def select(self, positions: Any) -> 'TableCallList':
+        """ Return a new TableCallList with the calls at the <positions> of
+        this list, in order, without creating any Call object.
+
+        Precondition: NumPy is installed and <positions> is a NumPy array of
+        integers in increasing order.
+        """
+        rows = array('q', self.row_array()[positions].tobytes())
+        return TableCallList(self.table, rows, self.sorted_rows)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'datetime', 'sys', 'array',
+            'itertools', 'call', 'numpy'
+        ],
+        'disable': ['R0902'],
+        'generated-members': 'pygame.*'
+    })
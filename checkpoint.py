@@ -0,0 +1,280 @@
+"""
+CSC148, Winter 2024
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the Checkpoint class, which saves the state of all
+customers after processing the first events of an event log, so that the
+events appended to the log later can be processed without replaying the
+earlier ones.
+
+A checkpoint is saved into two files:
+- the state file, holding the phone lines, contracts (including the free
+minutes left in a term contract and the balance of a prepaid contract) and
+bills of every customer, and the current billing month. It is small, and
+rewritten on every save.
+- the history file, named after the state file with a ".calls" suffix,
+holding the call histories of the phone lines. Each save only appends the
+calls registered since the checkpoint was loaded, so the cost of saving and
+loading a checkpoint does not grow with the history, unless the full history
+is loaded.
+"""
+import os
+import pickle
+from typing import Any, BinaryIO, Optional
+
+from callhistory import CallHistory
+from customer import Customer
+
+# Version of the checkpoint file format, increased whenever the classes saved
+# in a checkpoint change in an incompatible way
+CHECKPOINT_VERSION = 2
+
+
+class Checkpoint:
+    """ The state of all customers after processing the first events of an
+    event log.
+
+    === Public Attributes ===
+    customers:
+         all customers, in the order of their records in the log
+    billing:
+         the current billing month, as a (month, year) tuple, or None if no
+         event was processed yet
+    months:
+         every new month started so far, as (month, year) tuples, in order
+    num_events:
+         the number of events of the log processed so far
+    offset:
+         the position in bytes, in a json-lines log file, right after the last
+         record processed
+    """
+    # === Private Attributes ===
+    # _history_size:
+    #     the size in bytes of the valid part of the history file
+    # _full_history:
+    #     whether the call histories of the customers hold all their calls, or
+    #     only the calls registered since this checkpoint was loaded
+    # _saved:
+    #     for the call history of every phone line, by key, the number of
+    #     outgoing and incoming calls of each month already in the history
+    #     file, as a tuple of two dicts
+    customers: list[Customer]
+    billing: Optional[tuple[int, int]]
+    months: list[tuple[int, int]]
+    num_events: int
+    offset: int
+    _history_size: int
+    _full_history: bool
+    _saved: dict[tuple[int, str], tuple[dict, dict]]
+
+    def __init__(self) -> None:
+        """ Create the checkpoint of an event log with no record processed.
+        """
+        self.customers = []
+        self.billing = None
+        self.months = []
+        self.num_events = 0
+        self.offset = 0
+        self._history_size = 0
+        self._full_history = True
+        self._saved = {}
+
+    def has_full_history(self) -> bool:
+        """ Return whether the call histories of the customers hold all their
+        calls, rather than only the calls registered since this checkpoint
+        was loaded.
+        """
+        return self._full_history
+
+    def read_history(self, filename: str,
+                     histories: dict[tuple[int, str], CallHistory],
+                     full_history: bool) -> None:
+        """ Fill the empty call <histories> of this checkpoint, just loaded
+        from the state file <filename>, by key. If <full_history> is True,
+        they get all their calls from the history file. Otherwise, they stay
+        empty, and only the calls registered from now on are saved.
+        """
+        self._full_history = full_history
+        self._saved = {}
+        if not full_history:
+            return
+        with open(filename + ".calls", "rb") as file:
+            while file.tell() < self._history_size:
+                for key, calls in pickle.load(file).items():
+                    registered = histories.get(key)
+                    if registered is not None:
+                        _extend(registered.outgoing_calls, calls[0])
+                        _extend(registered.incoming_calls, calls[1])
+                        registered.mark_changed(
+                            sum(map(len, calls[0].values()))
+                            + sum(map(len, calls[1].values())))
+        # the calls loaded are all saved already
+        for key, registered in histories.items():
+            self._saved[key] = (
+                {m: len(c) for m, c in registered.outgoing_calls.items()},
+                {m: len(c) for m, c in registered.incoming_calls.items()})
+
+    def _histories(self) -> dict[tuple[int, str], CallHistory]:
+        """ Return the call history of every phone line, by key. The key of a
+        call history is a tuple of the customer id and the phone number of its
+        line.
+        """
+        histories = {}
+        for customer in self.customers:
+            for number, history in zip(customer.get_phone_numbers(),
+                                       customer.get_call_history()):
+                histories[(customer.get_id(), number)] = history
+        return histories
+
+    def _new_calls(self, key: tuple[int, str], history: CallHistory) \
+            -> Optional[tuple[dict, dict]]:
+        """ Return the outgoing and incoming calls of each month of the
+        call <history> with <key> which are not in the history file yet, or
+        None if there are none, and count them as saved.
+        """
+        saved = self._saved.setdefault(key, ({}, {}))
+        new_calls = ({}, {})
+        for calls, counts, new in zip((history.outgoing_calls,
+                                       history.incoming_calls), saved,
+                                      new_calls):
+            for month, month_calls in calls.items():
+                count = counts.get(month, 0)
+                if len(month_calls) > count:
+                    new[month] = month_calls[count:]
+                    counts[month] = len(month_calls)
+        if not new_calls[0] and not new_calls[1]:
+            return None
+        return new_calls
+
+    def save(self, filename: str) -> None:
+        """ Save this checkpoint into the state file <filename> and its
+        history file.
+
+        The state file is replaced at once, and only refers to the part of
+        the history file written for it, so the files still hold the previous
+        checkpoint if saving fails midway.
+        """
+        histories = self._histories()
+        segment = {}
+        for key, history in histories.items():
+            new_calls = self._new_calls(key, history)
+            if new_calls is not None:
+                segment[key] = new_calls
+        with open(filename + ".calls", "ab") as file:
+            # drop anything written after the last complete save
+            file.truncate(self._history_size)
+            pickle.dump(segment, file, pickle.HIGHEST_PROTOCOL)
+            self._history_size = file.tell()
+
+        temp = filename + ".tmp"
+        with open(temp, "wb") as file:
+            pickle.dump(CHECKPOINT_VERSION, file)
+            _HistoryPickler(file, {id(history): key for key, history
+                                   in histories.items()}).dump(self)
+        os.replace(temp, filename)
+
+
+class _HistoryPickler(pickle.Pickler):
+    """ A pickler which leaves out the call histories of the phone lines, and
+    saves their key instead.
+    """
+    # === Private Attributes ===
+    # _keys:
+    #     the key of every call history to leave out, by the id of the
+    #     CallHistory object
+    _keys: dict[int, tuple[int, str]]
+
+    def __init__(self, file: BinaryIO,
+                 keys: dict[int, tuple[int, str]]) -> None:
+        """ Create a pickler writing into <file>, which leaves out the call
+        histories with a key in <keys>.
+        """
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self._keys = keys
+
+    def persistent_id(self, obj: Any) -> Optional[tuple[int, str]]:
+        """ Return the key of <obj> if it is a call history to leave out,
+        or None to pickle it as usual.
+        """
+        if type(obj) is CallHistory:
+            return self._keys.get(id(obj))
+        return None
+
+
+class _HistoryUnpickler(pickle.Unpickler):
+    """ An unpickler which creates an empty call history for every call
+    history left out by a _HistoryPickler.
+    """
+    # === Public Attributes ===
+    # histories:
+    #     the call histories created so far, by key
+    histories: dict[tuple[int, str], CallHistory]
+
+    def __init__(self, file: BinaryIO) -> None:
+        """ Create an unpickler reading from <file>.
+        """
+        super().__init__(file)
+        self.histories = {}
+
+    def persistent_load(self, pid: Any) -> CallHistory:
+        """ Return the call history with the key <pid>.
+        """
+        key = tuple(pid)
+        history = self.histories.get(key)
+        if history is None:
+            history = CallHistory()
+            self.histories[key] = history
+        return history
+
+
+def load_checkpoint(filename: str, history: bool = True) -> Checkpoint:
+    """ Return the checkpoint saved in the state file <filename>.
+
+    If <history> is True, the call histories of its customers hold all their
+    calls. Otherwise, they start empty, and only the calls registered from
+    now on are added to the history file when the checkpoint is saved again.
+
+    Raise a ValueError if it was saved in another version of the checkpoint
+    file format.
+    """
+    with open(filename, "rb") as file:
+        version = pickle.load(file)
+        if version != CHECKPOINT_VERSION:
+            raise ValueError("Checkpoint " + filename + " has version "
+                             + str(version) + ", expected "
+                             + str(CHECKPOINT_VERSION))
+        unpickler = _HistoryUnpickler(file)
+        checkpoint = unpickler.load()
+    checkpoint.read_history(filename, unpickler.histories, history)
+    return checkpoint
+
+
+def _extend(registered: dict[tuple[int, int], list],
+            calls: dict[tuple[int, int], list]) -> None:
+    """ Add the <calls> of each month after the <registered> calls of that
+    month.
+    """
+    for month, month_calls in calls.items():
+        registered.setdefault(month, []).extend(month_calls)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'os', 'pickle', 'callhistory', 'customer'
+        ],
+        'allowed-io': ['save', 'read_history', 'load_checkpoint'],
+        'generated-members': 'pygame.*'
+    })
@@ -10,13 +10,30 @@ any changes, are expressly prohibited.
 
 All of the files in this directory and all subdirectories are:
 Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the contracts of the phone lines, which bill their calls
+one at a time through bill_call.
+
+It also contains a batch billing engine, which bills many calls of the same
+month at once from their durations: call_minutes rounds the durations up to
+minutes, Contract.bill_calls bills the calls of one contract, and bill_batch
+bills the calls of many contracts. They give exactly the same bills as
+calling bill_call for each call, in order, and use NumPy when it is
+installed.
 """
 import datetime
 from math import ceil
-from typing import Optional
+from typing import Any, Optional, Sequence
 from bill import Bill
 from call import Call
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # Constants for the month-to-month contract monthly fee and term deposit
 MTM_MONTHLY_FEE = 50.00
@@ -35,6 +52,10 @@ TERM_MINS_COST = 0.1
 # Cost per minute and per SMS in the prepaid contract
 PREPAID_MINS_COST = 0.025
 
+# Number of calls from which TermContract.bill_calls bills them with NumPy
+# rather than one at a time
+SMALL_BATCH = 512
+
 
 class Contract:
     """ A contract for a phone line
@@ -77,6 +98,17 @@ class Contract:
         """
         self.bill.add_billed_minutes(ceil(call.duration / 60.0))
 
+    def bill_calls(self, minutes: Sequence[int]) -> None:
+        """ Add calls lasting <minutes> minutes each, as returned by
+        call_minutes, to the bill, as bill_call would add them one at a time
+        in order.
+
+        Precondition:
+        - the bill of this contract has already been advanced to the
+        month+year of all the calls.
+        """
+        self.bill.add_billed_minutes(_total(minutes))
+
     def cancel_contract(self) -> float:
         """ Return the amount owed in order to close the phone line associated
         with this contract.
@@ -136,12 +168,64 @@ class TermContract(Contract):
         was made. In other words, you can safely assume that self.bill has been
         already advanced to the right month+year.
         """
-        if self.remaining_free_mins < ceil(call.duration / 60.0):
-            self.bill.add_billed_minutes(ceil(call.duration / 60.0))
+        minutes = ceil(call.duration / 60.0)
+        if self.remaining_free_mins < minutes:
+            self.bill.add_billed_minutes(minutes)
+        else:
+            self.remaining_free_mins -= minutes
+            self.bill.add_free_minutes(minutes)
+
+    def bill_calls(self, minutes: Sequence[int]) -> None:
+        """ Add calls lasting <minutes> minutes each, as returned by
+        call_minutes, to the bill, as bill_call would add them one at a time
+        in order.
+
+        A call is free as long as it fits in the remaining free minutes, so the
+        calls are free up to the first one overflowing the running total of
+        their minutes. That call is billed, and the free minutes are consumed
+        again from the next call which fits in them.
+
+        Precondition:
+        - the bill of this contract has already been advanced to the
+        month+year of all the calls.
+        """
+        remaining = self.remaining_free_mins
+        if numpy is None or len(minutes) < SMALL_BATCH:
+            if numpy is not None and isinstance(minutes, numpy.ndarray):
+                # iterating a list of ints is faster than iterating an array
+                minutes = minutes.tolist()
+            free = billed = 0
+            for minute in minutes:
+                if remaining < minute:
+                    billed += minute
+                else:
+                    remaining -= minute
+                    free += minute
         else:
-            used_free_minutes = ceil(call.duration / 60.0)
-            self.remaining_free_mins -= ceil(call.duration / 60.0)
-            self.bill.add_free_minutes(used_free_minutes)
+            minutes = numpy.asarray(minutes, dtype=numpy.int64)
+            billed = int(minutes.sum())
+            # the calls of 0 minutes are free and use no free minute, so each
+            # pass over the other calls uses at least one free minute, and
+            # there are at most TERM_MINS passes
+            minutes = minutes[minutes > 0]
+            free = 0
+            start = 0
+            while start < len(minutes) and remaining > 0:
+                # skip the calls longer than the remaining free minutes
+                fits = numpy.flatnonzero(minutes[start:] <= remaining)
+                if len(fits) == 0:
+                    break
+                start += int(fits[0])
+                used = numpy.cumsum(minutes[start:])
+                overflow = int(numpy.searchsorted(used, remaining, 'right'))
+                remaining -= int(used[overflow - 1])
+                free += int(used[overflow - 1])
+                # the call at <overflow> is billed, continue after it
+                start += overflow + 1
+            billed -= free
+        self.remaining_free_mins = remaining
+        self.bill.add_free_minutes(free)
+        self.bill.add_billed_minutes(billed)
 
     def cancel_contract(self) -> float:
         """ Return the amount owed in order to close the phone line associated
@@ -274,12 +358,75 @@ class PrepaidContract(Contract):
 # Implement the MTMContract, TermContract, and PrepaidContract
 
 
+def _total(minutes: Sequence[int]) -> int:
+    """ Return the sum of <minutes>, as an int.
+    """
+    if numpy is not None and not isinstance(minutes, list):
+        return int(numpy.sum(minutes))
+    return sum(minutes)
+
+
+def call_minutes(durations: Sequence[int]) -> Any:
+    """ Return the length in minutes of calls lasting <durations> seconds,
+    rounded up to the next minute as bill_call rounds them, as a NumPy array
+    or as a list if NumPy is not installed.
+
+    Precondition: every duration is a non-negative int.
+    """
+    if numpy is None:
+        return [-(-duration // 60) for duration in durations]
+    return -(-numpy.asarray(durations, dtype=numpy.int64) // 60)
+
+
+def bill_batch(contracts: list[Contract], owners: Sequence[int],
+               durations: Sequence[int]) -> None:
+    """ Bill calls lasting <durations> seconds, where the call at index i is
+    billed by the contract contracts[owners[i]], as bill_call would bill them
+    one at a time in order.
+
+    Precondition:
+    - the bill of each contract has already been advanced to the
+    month+year of all its calls.
+    """
+    minutes = call_minutes(durations)
+    if numpy is None:
+        groups = [[] for _ in contracts]
+        for owner, minute in zip(owners, minutes):
+            groups[owner].append(minute)
+        for contract, group in zip(contracts, groups):
+            if group:
+                contract.bill_calls(group)
+        return
+    owners = numpy.asarray(owners, dtype=numpy.int64)
+    if not any(isinstance(contract, TermContract) for contract in contracts):
+        # the minutes of these contracts are all billed, only their sum counts
+        totals = numpy.bincount(owners, weights=minutes,
+                                minlength=len(contracts))
+        for contract, total in zip(contracts, totals.tolist()):
+            if total:
+                contract.bill.add_billed_minutes(int(total))
+        return
+    order = numpy.argsort(owners, kind='stable')
+    minutes = minutes[order]
+    starts = numpy.searchsorted(owners[order],
+                                numpy.arange(len(contracts) + 1)).tolist()
+    # most contracts have few calls, which are billed faster from a list
+    small = minutes.tolist()
+    for i, contract in enumerate(contracts):
+        start, stop = starts[i], starts[i + 1]
+        if stop - start >= SMALL_BATCH:
+            contract.bill_calls(minutes[start:stop])
+        elif start < stop:
+            contract.bill_calls(small[start:stop])
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'datetime', 'bill', 'call', 'math'
+            'python_ta', 'typing', 'datetime', 'bill', 'call', 'math',
+            'numpy'
         ],
         'disable': ['R0902', 'R0913'],
-        'generated-members': 'pygame.*'
+        'generated-members': 'pygame.*, numpy.*'
     })
@@ -11,10 +11,12 @@ any changes, are expressly prohibited.
 All of the files in this directory and all subdirectories are:
 Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
 """
-from typing import Union
+import datetime
+from typing import Optional, Sequence, Union
 from phoneline import PhoneLine
 from call import Call
-from callhistory import CallHistory
+from callhistory import CallHistory, HistoryView
+from calltable import CallTable
 
 
 class Customer:
@@ -26,14 +28,48 @@ class Customer:
     #     this customer's 4 digit Customer id
     # _phone_lines:
     #     this customer's phone lines
+    # _lines_by_number:
+    #     this customer's phone lines, keyed by phone number
+    # _directory:
+    #     phone number directory shared with other customers, mapping each
+    #     number to its owning Customer and PhoneLine, or None
+    # _generation:
+    #     a counter increased every time the phone lines of this customer
+    #     change. The calls recorded are counted by the call histories of the
+    #     phone lines instead, see get_generation.
+    # _history:
+    #     the views over all the outgoing and incoming calls of this customer
+    #     last returned by get_history, with the get_generation they were
+    #     made at, or None
     _id: int
     _phone_lines: list[PhoneLine]
+    _lines_by_number: dict[str, PhoneLine]
+    _directory: Optional[dict[str, tuple['Customer', PhoneLine]]]
+    _generation: int
+    _history: Optional[tuple[int, tuple[HistoryView, HistoryView]]]
 
-    def __init__(self, cid: int) -> None:
-        """ Create a new Customer with the <cid> id
+    def __init__(self, cid: int,
+                 directory: Optional[dict[str, tuple['Customer', PhoneLine]]]
+                 = None) -> None:
+        """ Create a new Customer with the <cid> id.
+
+        If <directory> is given, every phone line added to this customer is
+        registered into it, and removed from it when the line is cancelled.
         """
         self._id = cid
         self._phone_lines = []
+        self._lines_by_number = {}
+        self._directory = directory
+        self._generation = 0
+        self._history = None
+
+    def __getstate__(self) -> dict:
+        """ Return the state of this customer for pickling, without the views
+        cached by get_history.
+        """
+        state = self.__dict__.copy()
+        state['_history'] = None
+        return state
 
     def new_month(self, month: int, year: int) -> None:
         """ Advance to a new month (specified by <month> and <year>) in the
@@ -51,10 +87,9 @@ class Customer:
         Precondition: The phone line associated with the source phone number of
         <call>, is owned by this customer
         """
-        # Implement this method
-        for phone_line in self._phone_lines:
-            if call.src_number == phone_line.get_number():
-                phone_line.make_call(call)
+        phone_line = self._lines_by_number.get(call.src_number)
+        if phone_line is not None:
+            phone_line.make_call(call)
 
     def receive_call(self, call: Call) -> None:
         """ Record that a call was made to the destination phone number of
@@ -63,22 +98,26 @@ class Customer:
         Precondition: The phone line associated with the destination phone
         number of <call>, is owned by this customer
         """
-        # Implement this method
-        for phone_line in self._phone_lines:
-            if call.dst_number == phone_line.get_number():
-                phone_line.receive_call(call)
+        phone_line = self._lines_by_number.get(call.dst_number)
+        if phone_line is not None:
+            phone_line.receive_call(call)
 
     def cancel_phone_line(self, number: str) -> Union[float, None]:
         """ Remove PhoneLine with number <number> from this customer and return
         the amount still owed by this customer.
         Return None if <number> is not owned by this customer.
         """
-        fee = None
-        for pl in self._phone_lines:
-            if pl.get_number() == number:
-                self._phone_lines.remove(pl)
-                fee = pl.cancel_line()
-        return fee
+        pl = self._lines_by_number.pop(number, None)
+        if pl is None:
+            return None
+        self._phone_lines.remove(pl)
+        # the calls of the line stay counted, so the generation never
+        # decreases
+        self._generation += 1 + pl.get_call_history().get_changes()
+        if (self._directory is not None
+                and self._directory.get(number, (None,))[0] is self):
+            del self._directory[number]
+        return pl.cancel_line()
 
     # ----------------------------------------------------------
     # NOTE: You do not need to understand the implementation of
@@ -90,6 +129,27 @@ class Customer:
         """ Add a new PhoneLine to this customer.
         """
         self._phone_lines.append(pline)
+        self._lines_by_number[pline.get_number()] = pline
+        self._generation += 1
+        if self._directory is not None:
+            self._directory[pline.get_number()] = (self, pline)
+
+    def attach_directory(self,
+                         directory: dict[str, tuple['Customer', PhoneLine]]) \
+            -> None:
+        """ Register all phone lines of this customer into <directory>, and
+        keep it in sync with any phone line added or cancelled from now on.
+        """
+        self._directory = directory
+        for line in self._phone_lines:
+            directory[line.get_number()] = (self, line)
+
+    def get_directory(self) \
+            -> Optional[dict[str, tuple['Customer', PhoneLine]]]:
+        """ Return the phone number directory this customer is registered in,
+        or None if there is none.
+        """
+        return self._directory
 
     def get_phone_numbers(self) -> list[str]:
         """ Return a list of all of the numbers this customer owns
@@ -99,19 +159,39 @@ class Customer:
             numbers.append(line.get_number())
         return numbers
 
+    def get_phone_lines(self) -> list[PhoneLine]:
+        """ Return a list of the phone lines this customer owns, in the order
+        they were added.
+        """
+        return list(self._phone_lines)
+
     def get_id(self) -> int:
         """ Return the id for this customer
         """
         return self._id
 
+    def get_generation(self) -> int:
+        """ Return a counter which increases every time a call is recorded, or
+        a phone line is added or cancelled, for this customer.
+
+        The calls are counted by the call histories of the phone lines, so
+        the calls registered directly into a PhoneLine or CallHistory of this
+        customer are counted too.
+        """
+        return self._generation + sum(line.get_call_history().get_changes()
+                                      for line in self._phone_lines)
+
+    def mark_changed(self, changes: int = 1) -> None:
+        """ Record that the calls or phone lines of this customer changed
+        <changes> times without going through its methods, e.g. when its calls
+        were replayed in another process.
+        """
+        self._generation += changes
+
     def __contains__(self, item: str) -> bool:
         """ Check if this customer owns the phone number <item>
         """
-        contains = False
-        for line in self._phone_lines:
-            if line.get_number() == item:
-                contains = True
-        return contains
+        return item in self._lines_by_number
 
     def generate_bill(self, month: int, year: int) \
             -> tuple[int, float, list[dict]]:
@@ -146,17 +226,38 @@ class Customer:
             print("\tnumber: " + line['number'] + "  type: " + line['type'])
         print("==========================")
 
-    def get_history(self) \
-            -> tuple[list[Call], list[Call]]:
+    def get_history(self, table: Optional[CallTable] = None,
+                    start: Optional[datetime.datetime] = None,
+                    end: Optional[datetime.datetime] = None) \
+            -> tuple[Sequence[Call], Sequence[Call]]:
         """ Return all the calls from the call history of this
         customer, as a tuple in the following format:
         (outgoing calls, incoming calls)
+
+        The calls are returned as read-only views, which do not copy them. The
+        calls of each phone line are grouped together, in the order the lines
+        were added. The views over all the calls are cached, and returned
+        again until calls or phone lines of this customer change.
+
+        If a <table> is given, return views over the calls of this customer
+        stored in <table> instead.
+        If <start> or <end> is given, only return the calls made from <start>
+        included to <end> excluded.
         """
-        history = ([], [])
-        for line in self._phone_lines:
-            line_history = line.get_monthly_history()
-            history[0].extend(line_history[0])
-            history[1].extend(line_history[1])
+        if table is not None:
+            return table.get_history(self.get_phone_numbers(), start=start,
+                                     end=end)
+        if start is None and end is None and self._history is not None \
+                and self._history[0] == self.get_generation():
+            return self._history[1]
+        windows = [line.get_monthly_history(start=start, end=end)
+                   if start is not None or end is not None
+                   else line.get_call_history().get_window()
+                   for line in self._phone_lines]
+        history = (HistoryView.chain(window[0] for window in windows),
+                   HistoryView.chain(window[1] for window in windows))
+        if start is None and end is None:
+            self._history = (self.get_generation(), history)
         return history
 
     def get_call_history(self, number: str = None) -> list[CallHistory]:
@@ -178,7 +279,8 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'phoneline', 'call', 'callhistory'
+            'python_ta', 'typing', 'datetime', 'phoneline', 'call',
+            'callhistory', 'calltable'
         ],
         'allowed-io': ['print_bill'],
         'disable': ['R0902', 'R0913'],
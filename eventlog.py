@@ -0,0 +1,331 @@
+"""
+CSC148, Winter 2024
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the readers for the input dataset, which stream the
+"customers" and "events" records one at a time instead of loading the whole
+file into memory.
+
+Two formats are supported:
+- the json format described in the A1 handout, a single object with the
+"customers" and "events" lists, parsed incrementally.
+- a json-lines variant (files ending in ".jsonl"), where every line holds a
+single customer or event record. Customer records have an "id" key, event
+records have a "type" key.
+
+It also contains parse_time, which parses the timestamps of the events, and
+the EventDecoder class, which turns call events into Call objects.
+"""
+import datetime
+import json
+import re
+from typing import Any, Iterator, Optional, TextIO
+
+from call import Call
+
+# Number of characters read from the dataset file at a time
+CHUNK_SIZE = 1 << 16
+
+# Format of the event timestamps in the dataset
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_WHITESPACE = re.compile(r'\s*')
+
+# The last timestamp parsed by parse_time, and its value
+_LAST_TIME = ["", datetime.datetime(1970, 1, 1)]
+
+
+def parse_time(text: str) -> datetime.datetime:
+    """ Return the time described by the timestamp <text>, in the TIME_FORMAT
+    of the dataset (e.g. "2018-01-01 10:25:58").
+
+    This gives the same result as datetime.datetime.strptime(<text>,
+    TIME_FORMAT), but is many times faster. The last timestamp parsed is
+    remembered, as consecutive events often share the same second.
+
+    Raise a ValueError if <text> is not in the TIME_FORMAT.
+    """
+    if text == _LAST_TIME[0]:
+        return _LAST_TIME[1]
+    if (len(text) == 19 and text.isascii()
+            and text[4] == text[7] == "-" and text[10] == " "
+            and text[13] == text[16] == ":"
+            and (text[:4] + text[5:7] + text[8:10] + text[11:13]
+                 + text[14:16] + text[17:]).isdigit()):
+        time = datetime.datetime.fromisoformat(text)
+    else:
+        # not a timestamp of the dataset, let strptime report the error
+        time = datetime.datetime.strptime(text, TIME_FORMAT)
+    _LAST_TIME[0] = text
+    _LAST_TIME[1] = time
+    return time
+
+
+class _JsonStream:
+    """ A buffered reader over a json text file, which decodes one value at a
+    time.
+    """
+    # === Private Attributes ===
+    # _file:
+    #     the file the json text is read from
+    # _buf:
+    #     the text read from _file which has not been consumed yet
+    # _pos:
+    #     the position of the next character to consume in _buf
+    # _eof:
+    #     whether all of _file has been read into _buf
+    # _decoder:
+    #     the decoder used to parse single json values
+    _file: TextIO
+    _buf: str
+    _pos: int
+    _eof: bool
+    _decoder: json.JSONDecoder
+
+    def __init__(self, file: TextIO) -> None:
+        """ Create a new stream reading json text from <file>.
+        """
+        self._file = file
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, size: Optional[int] = None) -> bool:
+        """ Read up to <size> more characters into the buffer, or CHUNK_SIZE
+        if <size> is None, dropping the consumed part of it. Return False if
+        the end of the file was reached.
+        """
+        if self._eof:
+            return False
+        if size is None:
+            size = CHUNK_SIZE
+        chunk = self._file.read(size)
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        if not chunk:
+            self._eof = True
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """ Skip any whitespace and return the next character without
+        consuming it. Return "" at the end of the file.
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf) or not self._fill():
+                break
+        return self._buf[self._pos:self._pos + 1]
+
+    def expect(self, char: str) -> None:
+        """ Consume the next non-whitespace character, which must be <char>.
+        """
+        if self.peek() != char:
+            raise ValueError("Malformed dataset: expected '" + char + "'")
+        self._pos += 1
+
+    def decode(self) -> Any:
+        """ Decode and return the next json value.
+        """
+        self.peek()
+        size = CHUNK_SIZE
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                end = None
+            # a value ending on the buffer boundary may continue (e.g. a number)
+            if end is not None and (end < len(self._buf) or self._eof):
+                self._pos = end
+                return value
+            if self._eof:
+                raise ValueError("Malformed dataset: truncated json value")
+            self._fill(size)
+            size *= 2
+
+    def iter_array(self) -> Iterator[Any]:
+        """ Decode the next json value, which must be a list, and yield its
+        items one at a time.
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.peek() == ",":
+                self._pos += 1
+            else:
+                self.expect("]")
+                return
+
+
+# The keys of a call event, with the type of their value, in the order of the
+# arguments of the Call constructor
+CALL_SCHEMA = (('src_number', str), ('dst_number', str), ('time', str),
+               ('duration', int), ('src_loc', list), ('dst_loc', list))
+
+
+class EventDecoder:
+    """ A decoder turning the call events of a dataset into Call objects.
+
+    The first call event decoded is checked against CALL_SCHEMA. The following
+    events are assumed to have the same keys and types, so their values are
+    read directly. SMS events are counted and skipped without being decoded.
+
+    === Public Attributes ===
+    num_calls:
+         the number of call events decoded so far
+    num_sms:
+         the number of sms events skipped so far
+    """
+    # === Private Attributes ===
+    # _checked:
+    #     whether a call event was checked against CALL_SCHEMA
+    num_calls: int
+    num_sms: int
+    _checked: bool
+
+    def __init__(self) -> None:
+        """ Create a new decoder, which has not seen any event yet.
+        """
+        self.num_calls = 0
+        self.num_sms = 0
+        self._checked = False
+
+    def _check(self, event: dict) -> None:
+        """ Raise a ValueError if the call <event> does not match CALL_SCHEMA.
+        """
+        for key, value_type in CALL_SCHEMA:
+            if not isinstance(event.get(key), value_type):
+                raise ValueError("Malformed dataset: call event without a "
+                                 "valid '" + key + "'")
+        parse_time(event['time'])
+        self._checked = True
+
+    def decode(self, event: dict) -> Optional[Call]:
+        """ Return a new Call for the call <event>, or None if <event> is an
+        sms.
+
+        Raise a ValueError if <event> is the first call event decoded and does
+        not match CALL_SCHEMA.
+        """
+        if event['type'] == 'sms':
+            self.num_sms += 1
+            return None
+        if not self._checked:
+            self._check(event)
+        self.num_calls += 1
+        return Call(event['src_number'], event['dst_number'],
+                    parse_time(event['time']), event['duration'],
+                    event['src_loc'], event['dst_loc'])
+
+
+def _iter_json_records(file: TextIO, key: str) -> Iterator[dict]:
+    """ Yield the items of the list stored under <key> in the json object read
+    from <file>. The lists stored under any other key before <key> are skipped
+    one item at a time, so that they are never fully loaded into memory.
+    """
+    stream = _JsonStream(file)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        name = stream.decode()
+        stream.expect(":")
+        if stream.peek() == "[":
+            items = stream.iter_array()
+            if name == key:
+                yield from items
+                return
+            else:
+                for _ in items:
+                    pass
+        else:
+            stream.decode()
+        if stream.peek() == ",":
+            stream.expect(",")
+        else:
+            stream.expect("}")
+            return
+
+
+def _iter_jsonl_records(file: TextIO, key: str) -> Iterator[dict]:
+    """ Yield the "customers" or "events" records, as specified by <key>, from
+    the json-lines text read from <file>.
+    """
+    record_key = "id" if key == "customers" else "type"
+    for line in file:
+        if line.strip():
+            record = json.loads(line)
+            if record_key in record:
+                yield record
+
+
+def iter_jsonl_from(filename: str, offset: int = 0) \
+        -> Iterator[tuple[dict, int]]:
+    """ Yield, one at a time, the records of the json-lines dataset file
+    <filename> which start at or after the position <offset> in bytes, each
+    in a tuple with the position right after it.
+
+    A last line not ending in a newline is still being written, and is not
+    read.
+
+    Precondition: <offset> is at the start of a line of <filename>.
+    """
+    with open(filename, "rb") as file:
+        file.seek(offset)
+        for line in file:
+            if not line.endswith(b"\n"):
+                return
+            offset += len(line)
+            if line.strip():
+                yield json.loads(line), offset
+
+
+def iter_records(filename: str, key: str) -> Iterator[dict]:
+    """ Yield, one at a time, the records stored under <key> ("customers" or
+    "events") in the dataset file <filename>, in file order.
+
+    The file is read incrementally, so only a single record is held in memory
+    at any time.
+    Files ending in ".jsonl" are read as json-lines, any other file is read as
+    the json format described in the handout.
+    """
+    with open(filename) as file:
+        if filename.endswith(".jsonl"):
+            yield from _iter_jsonl_records(file, key)
+        else:
+            yield from _iter_json_records(file, key)
+
+
+def convert_to_jsonl(src: str, dst: str) -> None:
+    """ Convert the json dataset file <src> into the json-lines file <dst>,
+    writing all the customer records first, followed by all the events.
+    """
+    with open(dst, "w") as out:
+        for key in ("customers", "events"):
+            for record in iter_records(src, key):
+                out.write(json.dumps(record) + "\n")
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'datetime', 'json', 're', 'call'
+        ],
+        'allowed-io': ['iter_jsonl_from', 'iter_records', 'convert_to_jsonl'],
+        'generated-members': 'pygame.*'
+    })
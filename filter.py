@@ -13,19 +13,50 @@ Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
 """
 import time
 import datetime
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional
 from call import Call
+from callhistory import HistoryView
+from calltable import CallList, numpy
+from callindex import CustomerIndex, DurationIndex, SpatialIndex
 from customer import Customer
 
+# LocationFilter only uses the SpatialIndex when it has to check at least this
+# many times fewer call endpoints than there are calls to filter
+LOCATION_SCAN_RATIO = 32
+
+# DurationFilter only uses the DurationIndex when it matches at least this many
+# times fewer calls than there are calls to filter
+DURATION_SCAN_RATIO = 16
+
+# Maximum number of results kept by a FilterCache, and maximum number of calls
+# in all of these results together
+FILTER_CACHE_ENTRIES = 32
+FILTER_CACHE_CALLS = 5000000
+
 
 class Filter:
     """ A class for filtering customer data on some criterion. A filter is
     applied to a set of calls.
 
     This is an abstract class. Only subclasses should be instantiated.
+
+    === Public Attributes ===
+    keep_if_no_match:
+         whether applying this filter returns its input unchanged, rather than
+         an empty list, when no call matches its criterion
     """
+    keep_if_no_match: bool = True
+
     def __init__(self) -> None:
         pass
 
+    def normalize(self, filter_string: str) -> str:
+        """ Return a canonical form of <filter_string>. Two filter strings with
+        the same canonical form give the same result when applied.
+        """
+        return filter_string
+
     def apply(self, customers: list[Customer],
               data: list[Call],
               filter_string: str) \
@@ -51,12 +82,86 @@ class Filter:
         """
         raise NotImplementedError
 
+    def parse(self, customers: list[Customer], filter_string: str) -> Any:
+        """ Return the criterion described by <filter_string>, in the form
+        expected by match and match_call, or None if <filter_string> is
+        invalid.
+        """
+        raise NotImplementedError
+
+    def estimate(self, data: CallList, criterion: Any) -> int:
+        """ Return an upper bound on the number of calls of the table of
+        <data> which match <criterion>, found without checking every call.
+
+        Precondition: NumPy is installed.
+        """
+        raise NotImplementedError
+
+    def match(self, data: CallList, criterion: Any,
+              positions: Any = None) -> Any:
+        """ Return the positions in <data> of the calls matching <criterion>,
+        in increasing order, as a NumPy array. If <positions> is not None, only
+        the calls at these <positions> are considered.
+
+        Precondition: NumPy is installed and <positions> is either None or a
+        NumPy array of positions in <data> in increasing order.
+        """
+        raise NotImplementedError
+
+    def match_call(self, criterion: Any, call: Call) -> bool:
+        """ Return whether <call> matches <criterion>.
+        """
+        raise NotImplementedError
+
+    def _apply_criterion(self, customers: list[Customer], data: list[Call],
+                         filter_string: str) -> list[Call]:
+        """ Return the calls of <data> which match the criterion described by
+        <filter_string>, in order, or <data> itself if <filter_string> is
+        invalid.
+        """
+        criterion = self.parse(customers, filter_string)
+        if criterion is None:
+            return data
+        if numpy is not None and isinstance(data, CallList):
+            positions = self.match(data, criterion)
+            if len(positions) == 0 and self.keep_if_no_match:
+                return data
+            return data.select(positions)
+        fil_list = [call for call in data
+                    if self.match_call(criterion, call)]
+        if not fil_list and self.keep_if_no_match:
+            return data
+        return fil_list
+
     def __str__(self) -> str:
         """ Return a description of this filter to be displayed in the UI menu
         """
         raise NotImplementedError
 
 
+def _restrict(matches: Any, positions: Any) -> Any:
+    """ Return the sorted positions <matches> which are also in the sorted
+    <positions>, or all of <matches> if <positions> is None.
+    """
+    if positions is None:
+        return matches
+    return numpy.intersect1d(matches, positions, assume_unique=True)
+
+
+def _compress(mask: Any, positions: Any) -> Any:
+    """ Return the <positions> for which <mask> is True, where <mask> has one
+    value per position. If <positions> is None, <mask> covers all positions.
+    """
+    if positions is None:
+        return numpy.flatnonzero(mask)
+    return positions[mask]
+
+
+# The last result of ResetFilter, under 'calls', the list of customers it was
+# computed for, under 'customers', and the state of these customers, under 'key'
+_RESET_CACHE = {}
+
+
 class ResetFilter(Filter):
     """
     A class for resetting all previously applied filters, if any.
@@ -70,14 +175,30 @@ class ResetFilter(Filter):
         The <data> and <filter_string> arguments for this type of filter are
         ignored.
 
+        The result is cached, and the same list is returned again until the
+        calls or phone lines of <customers> change. It must not be mutated.
+        If NumPy is installed, the result is a new CallList, which copies the
+        calls and builds a CallTable of them, so a reset which misses the
+        cache takes time linear in the number of calls. Otherwise, the result
+        is a read-only HistoryView over the call histories of the customers,
+        which does not copy the calls.
+
         Precondition:
         - <customers> contains the list of all customers from the input dataset
         """
-        filtered_calls = []
-        for c in customers:
-            customer_history = c.get_history()
-            # only take outgoing calls, we don't want to include calls twice
-            filtered_calls.extend(customer_history[0])
+        key = (len(customers), sum(c.get_generation() for c in customers))
+        if _RESET_CACHE.get('customers') is customers \
+                and _RESET_CACHE['key'] == key:
+            return _RESET_CACHE['calls']
+        # only take outgoing calls, we don't want to include calls twice.
+        filtered_calls = HistoryView.chain(c.get_history()[0]
+                                           for c in customers)
+        if numpy is not None:
+            # copy the calls into a new columnar table, for the filters
+            filtered_calls = CallList(filtered_calls)
+        _RESET_CACHE['customers'] = customers
+        _RESET_CACHE['key'] = key
+        _RESET_CACHE['calls'] = filtered_calls
         return filtered_calls
 
     def __str__(self) -> str:
@@ -107,23 +228,56 @@ class CustomerFilter(Filter):
 
         Do not mutate any of the function arguments!
         """
-        # Implement this method
-        fil_list = set()
-        phone_lines = []
+        return self._apply_criterion(customers, data, filter_string)
+
+    def parse(self, customers: list[Customer],
+              filter_string: str) -> Optional[tuple[Customer, set[str]]]:
+        """ Return the customer with the id in <filter_string> and the set of
+        their phone numbers, or None if there is no such customer.
+        """
         try:
-            int(filter_string)
+            cid = int(filter_string)
         except ValueError:
-            return data
+            return None
+        found = None
         for customer in customers:  # change this to check for valid id
-            if customer.get_id() == int(filter_string):
-                phone_lines.extend(customer.get_phone_numbers())
-        for call in data:
-            if call.src_number in phone_lines or call.dst_number in phone_lines:
-                fil_list.add(call)
+            if customer.get_id() == cid:
+                found = customer
+        if found is None:
+            return None
+        return found, set(found.get_phone_numbers())
+
+    def estimate(self, data: CallList,
+                 criterion: tuple[Customer, set[str]]) -> int:
+        """ Return the number of calls of the table of <data> made or received
+        by the customer of <criterion>.
+        """
+        return len(data.table.get_index(CustomerIndex).query(criterion[0]))
 
-        if not fil_list:
-            return data
-        return list(fil_list)
+    def match(self, data: CallList, criterion: tuple[Customer, set[str]],
+              positions: Any = None) -> Any:
+        """ Return the positions in <data> of the calls made or received by
+        the customer of <criterion>, among <positions> if not None.
+        """
+        rows = data.table.get_index(CustomerIndex).query(criterion[0])
+        return _restrict(data.positions_of(rows), positions)
+
+    def match_call(self, criterion: tuple[Customer, set[str]],
+                   call: Call) -> bool:
+        """ Return whether <call> was made or received by the customer of
+        <criterion>.
+        """
+        return (call.src_number in criterion[1]
+                or call.dst_number in criterion[1])
+
+    def normalize(self, filter_string: str) -> str:
+        """ Return a canonical form of <filter_string>. Two filter strings with
+        the same canonical form give the same result when applied.
+        """
+        try:
+            return str(int(filter_string))
+        except ValueError:
+            return filter_string
 
     def __str__(self) -> str:
         """ Return a description of this filter to be displayed in the UI menu
@@ -136,6 +290,8 @@ class DurationFilter(Filter):
     A class for selecting only the calls lasting either over or under a
     specified duration.
     """
+    keep_if_no_match = False
+
     def apply(self, customers: list[Customer],
               data: list[Call],
               filter_string: str) \
@@ -154,40 +310,60 @@ class DurationFilter(Filter):
 
         Do not mutate any of the function arguments!
         """
-        # Implement this method
-        fil_list = set()
-        try:
-            assert len(filter_string) == 4
-        except AssertionError:
-            return data
-        try:
-            try:
-                assert filter_string[0] == "L" or filter_string[0] == "G"
-            except AssertionError:
-                return data
-
-            operator = filter_string[0]
-            try:
-                int(filter_string[1:])
-            except ValueError:
-                return data
+        return self._apply_criterion(customers, data, filter_string)
 
+    def parse(self, customers: list[Customer],
+              filter_string: str) -> Optional[tuple[str, int]]:
+        """ Return the operator ("L" or "G") and the duration in <filter_string>
+        as a tuple, or None if <filter_string> is invalid.
+        """
+        if len(filter_string) != 4:
+            return None
+        operator = filter_string[0]
+        if operator not in ("L", "G"):
+            return None
+        try:
             duration = int(filter_string[1:])
+        except ValueError:
+            return None
+        # Check if duration is a valid integer
+        if not 0 <= duration <= 999:
+            return None
+        return operator, duration
+
+    def estimate(self, data: CallList, criterion: tuple[str, int]) -> int:
+        """ Return the number of calls of the table of <data> lasting under or
+        over the duration of <criterion>.
+        """
+        return data.table.get_index(DurationIndex).count(*criterion)
 
-            # Check if duration is a valid integer
-            if not 0 <= duration <= 999:
-                return data
-
-            # Perform filtering based on operator and duration
-            for call in data:
-                if operator == 'L' and call.duration < duration:
-                    fil_list.add(call)
-                elif operator == 'G' and call.duration > duration:
-                    fil_list.add(call)
-        except IndexError:
-            return data
-
-        return list(fil_list)
+    def match(self, data: CallList, criterion: tuple[str, int],
+              positions: Any = None) -> Any:
+        """ Return the positions in <data> of the calls lasting under or over
+        the duration of <criterion>, among <positions> if not None.
+        """
+        operator, duration = criterion
+        index = data.table.get_index(DurationIndex)
+        size = len(data) if positions is None else len(positions)
+        if index.count(operator, duration) * DURATION_SCAN_RATIO < size:
+            return _restrict(data.positions_of(index.query(operator, duration)),
+                             positions)
+        rows = data.row_array()
+        if positions is not None:
+            rows = rows[positions]
+        durations = data.table.column('durations')[rows]
+        if operator == 'L':
+            return _compress(durations < duration, positions)
+        return _compress(durations > duration, positions)
+
+    def match_call(self, criterion: tuple[str, int], call: Call) -> bool:
+        """ Return whether <call> lasted under or over the duration of
+        <criterion>.
+        """
+        operator, duration = criterion
+        if operator == 'L':
+            return call.duration < duration
+        return call.duration > duration
 
     def __str__(self) -> str:
         """ Return a description of this filter to be displayed in the UI menu
@@ -226,45 +402,85 @@ class LocationFilter(Filter):
 
         Do not mutate any of the function arguments!
         """
-        # Implement this method
-        fil_list = set()
+        return self._apply_criterion(customers, data, filter_string)
+
+    def parse(self, customers: list[Customer], filter_string: str) \
+            -> Optional[tuple[float, float, float, float]]:
+        """ Return the coordinates in <filter_string> as a tuple in the
+        following format:
+        (lowerLong, lowerLat, upperLong, upperLat)
+        or None if <filter_string> is invalid.
+        """
         filter_list = filter_string.split(', ')
+        if len(filter_list) != 4:
+            return None
         try:
-            assert len(filter_list) == 4
-        except AssertionError:
-            return data
-        try:
-            float(filter_list[0])
-            float(filter_list[1])
-            float(filter_list[2])
-            float(filter_list[3])
-        except TypeError:
-            return data
-
-        try:  # check within boundaries
-            assert float(filter_list[0]) > -79.697878
-            assert float(filter_list[1]) > 43.576959
-            assert float(filter_list[2]) < -79.196382
-            assert float(filter_list[3]) < 43.799568
-        except AssertionError:
-            return data
-        for call in data:
-            s_c = call.src_loc[0]
-            d_c = call.dst_loc[0]
-            s_c1 = call.src_loc[1]
-            f_0 = float(filter_list[0])
-            f_3 = float(filter_list[3])
-            if (float(filter_list[2]) >= s_c >= f_0 and float(filter_list[3])
-                    >= s_c1 >= float(filter_list[1])):
-                fil_list.add(call)
-            elif (float(filter_list[2]) >= d_c >= float(filter_list[0]) and f_3
-                  >= call.dst_loc[1] >= float(filter_list[1])):
-                fil_list.add(call)
-
-        if not fil_list:
-            return data
+            low_long = float(filter_list[0])
+            low_lat = float(filter_list[1])
+            up_long = float(filter_list[2])
+            up_lat = float(filter_list[3])
+        except (TypeError, ValueError):
+            return None
+
+        # check within boundaries
+        if not (low_long > -79.697878 and low_lat > 43.576959
+                and up_long < -79.196382 and up_lat < 43.799568):
+            return None
+        return low_long, low_lat, up_long, up_lat
+
+    def estimate(self, data: CallList,
+                 criterion: tuple[float, float, float, float]) -> int:
+        """ Return an upper bound on the number of calls of the table of
+        <data> within the rectangle of <criterion>.
+        """
+        return data.table.get_index(SpatialIndex).count_candidates(*criterion)
 
-        return list(fil_list)
+    def match(self, data: CallList,
+              criterion: tuple[float, float, float, float],
+              positions: Any = None) -> Any:
+        """ Return the positions in <data> of the calls within the rectangle
+        of <criterion>, among <positions> if not None.
+        """
+        low_long, low_lat, up_long, up_lat = criterion
+        index = data.table.get_index(SpatialIndex)
+        size = len(data) if positions is None else len(positions)
+        if index.count_candidates(*criterion) * LOCATION_SCAN_RATIO < size:
+            return _restrict(data.positions_of(index.query(*criterion)),
+                             positions)
+        # most calls may match, checking them all is cheaper
+        rows = data.row_array()
+        if positions is not None:
+            rows = rows[positions]
+        mask = numpy.zeros(len(rows), dtype=bool)
+        for lon, lat in (('src_lon', 'src_lat'), ('dst_lon', 'dst_lat')):
+            longs = data.table.column(lon)[rows]
+            lats = data.table.column(lat)[rows]
+            mask |= ((low_long <= longs) & (longs <= up_long)
+                     & (low_lat <= lats) & (lats <= up_lat))
+        return _compress(mask, positions)
+
+    def match_call(self, criterion: tuple[float, float, float, float],
+                   call: Call) -> bool:
+        """ Return whether the source or destination of <call> is within the
+        rectangle of <criterion>.
+        """
+        low_long, low_lat, up_long, up_lat = criterion
+        s_c = call.src_loc
+        d_c = call.dst_loc
+        return ((up_long >= s_c[0] >= low_long
+                 and up_lat >= s_c[1] >= low_lat)
+                or (up_long >= d_c[0] >= low_long
+                    and up_lat >= d_c[1] >= low_lat))
+
+    def normalize(self, filter_string: str) -> str:
+        """ Return a canonical form of <filter_string>. Two filter strings with
+        the same canonical form give the same result when applied.
+        """
+        filter_list = filter_string.split(', ')
+        try:
+            return ', '.join(repr(float(f)) for f in filter_list)
+        except ValueError:
+            return filter_string
 
     def __str__(self) -> str:
         """ Return a description of this filter to be displayed in the UI menu
@@ -274,11 +490,169 @@ class LocationFilter(Filter):
                "upperLong, upperLat\" (e.g., -79.6, 43.6, -79.3, 43.7)"
 
 
+# The filters which can be composed into a FilterPipeline
+PIPELINE_FILTERS = (CustomerFilter, DurationFilter, LocationFilter)
+
+
+class FilterPipeline:
+    """ A sequence of filters, each with its filter string, applied to a list
+    of calls as a single query.
+
+    Applying a pipeline gives the same calls, in the same order, as applying
+    each of its filters in turn to the result of the previous one. For a
+    CallList, the filters are instead evaluated from the most selective one,
+    according to the indexes of its table, and each following filter only
+    checks the calls matched so far.
+    """
+    # === Private Attributes ===
+    # _steps:
+    #     the filters of this pipeline with their filter strings, in the order
+    #     they are applied
+    _steps: list[tuple[Filter, str]]
+
+    def __init__(self, steps: Iterable[tuple[Filter, str]] = ()) -> None:
+        """ Create a pipeline applying the filters of <steps>, given as
+        (filter, filter string) tuples, in order.
+        """
+        self._steps = []
+        for f, filter_string in steps:
+            self.add(f, filter_string)
+
+    def __len__(self) -> int:
+        """ Return the number of filters in this pipeline.
+        """
+        return len(self._steps)
+
+    def add(self, f: Filter, filter_string: str) -> None:
+        """ Add the filter <f> with <filter_string> at the end of this
+        pipeline.
+
+        Raise a ValueError if <f> is not one of PIPELINE_FILTERS.
+        """
+        if not isinstance(f, PIPELINE_FILTERS):
+            raise ValueError(f"{type(f).__name__} can not be used in a "
+                             f"FilterPipeline")
+        self._steps.append((f, filter_string))
+
+    def apply(self, customers: list[Customer],
+              data: list[Call]) -> list[Call]:
+        """ Return the calls of <data> left after applying every filter of
+        this pipeline in turn, as Filter.apply would.
+
+        Precondition:
+        - <customers> contains the list of all customers from the input dataset
+        - all calls included in <data> are valid calls from the input dataset
+        """
+        if numpy is None or not isinstance(data, CallList):
+            for f, filter_string in self._steps:
+                data = f.apply(customers, data, filter_string)
+            return data
+        # filters with an invalid filter string return their input unchanged
+        steps = [(f, f.parse(customers, filter_string))
+                 for f, filter_string in self._steps]
+        steps = [(f, criterion) for f, criterion in steps
+                 if criterion is not None]
+        if not steps:
+            return data
+
+        # If some call matches every filter, no filter returns its input for
+        # a lack of matches, and the result is the calls matching them all,
+        # found in any order.
+        plan = sorted(steps, key=lambda step: step[0].estimate(data, step[1]))
+        positions = None
+        for f, criterion in plan:
+            positions = f.match(data, criterion, positions)
+            if len(positions) == 0:
+                break
+        if len(positions) > 0 \
+                or not any(f.keep_if_no_match for f, _ in steps):
+            return data.select(positions)
+
+        # Otherwise, which filters keep their input depends on the order.
+        positions = None
+        for f, criterion in steps:
+            matched = f.match(data, criterion, positions)
+            if len(matched) > 0 or not f.keep_if_no_match:
+                positions = matched
+        if positions is None:
+            return data
+        return data.select(positions)
+
+
+class FilterCache:
+    """ A cache of the results of applying filters, which drops the least
+    recently used results when it is full.
+
+    Results are only cached for inputs which are CallLists, identified by
+    their generation id, and never for a ResetFilter.
+    """
+    # === Private Attributes ===
+    # _results:
+    #     the cached results, from least to most recently used. Keys are tuples
+    #     of the filter class, the canonical filter string, the generation of
+    #     the input calls and a fingerprint of the customers.
+    # _max_entries:
+    #     maximum number of results in _results
+    # _max_calls:
+    #     maximum number of calls in all results of _results together
+    # _num_calls:
+    #     number of calls in all results of _results together
+    _results: OrderedDict[tuple, list[Call]]
+    _max_entries: int
+    _max_calls: int
+    _num_calls: int
+
+    def __init__(self, max_entries: int = FILTER_CACHE_ENTRIES,
+                 max_calls: int = FILTER_CACHE_CALLS) -> None:
+        """ Create an empty cache holding at most <max_entries> results, and
+        at most <max_calls> calls in all of them together.
+        """
+        self._results = OrderedDict()
+        self._max_entries = max_entries
+        self._max_calls = max_calls
+        self._num_calls = 0
+
+    def __len__(self) -> int:
+        """ Return the number of results in this cache.
+        """
+        return len(self._results)
+
+    def apply(self, f: Filter, customers: list[Customer], data: list[Call],
+              filter_string: str,
+              apply: Callable[[Filter, list[Customer], list[Call], str],
+                              list[Call]] = None) -> list[Call]:
+        """ Return the result of applying the filter <f> to <data>, from this
+        cache if it was computed before. Otherwise, compute it by calling
+        <apply>(<f>, <customers>, <data>, <filter_string>), or
+        <f>.apply(<customers>, <data>, <filter_string>) if <apply> is None.
+        """
+        if apply is None:
+            apply = type(f).apply
+        if isinstance(f, ResetFilter) or not isinstance(data, CallList):
+            return apply(f, customers, data, filter_string)
+        key = (type(f), f.normalize(filter_string), data.generation,
+               id(customers), sum(c.get_generation() for c in customers))
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+            return result
+        result = apply(f, customers, data, filter_string)
+        if len(result) <= self._max_calls:
+            self._results[key] = result
+            self._num_calls += len(result)
+            while (len(self._results) > self._max_entries
+                   or self._num_calls > self._max_calls):
+                self._num_calls -= len(self._results.popitem(last=False)[1])
+        return result
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'time', 'datetime', 'call', 'customer'
+            'python_ta', 'typing', 'time', 'datetime', 'collections', 'call',
+            'callhistory', 'calltable',
+            'callindex', 'customer'
         ],
         'max-nested-blocks': 4,
         'allowed-io': ['apply', '__str__'],
@@ -0,0 +1,312 @@
+"""
+CSC148, Winter 2024
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the instrumentation of the phone management system: named
+counters and timing histograms, recorded into the shared STATS object, and an
+optional profiler around a whole run.
+
+Nothing is recorded until STATS is enabled. The application reads the
+following environment variables, through configure_from_env:
+- MEWBILE_STATS: enable STATS, and export it at exit to this file, or to
+standard output if it is "-".
+- MEWBILE_PROFILE: profile the run with cProfile, and write the profile to
+this file (it can be read with the pstats module).
+- MEWBILE_TRACEMALLOC: if set, trace the memory allocations of the run, and
+add the lines allocating the most memory to the exported stats.
+
+The counters and histograms recorded by the application are:
+- "events.calls" and "events.sms": the events ingested
+- "months.rollovers": the new billing months started
+- "calls.billed.<contract>": the calls billed under each type of contract
+- "filter.<filter>": the time taken by each filter applied in the visualizer
+- "render.frame": the time taken to render each frame of the visualizer
+"""
+import atexit
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+# Upper bound, in seconds, of the first bucket of a Histogram. Each following
+# bucket has twice the upper bound of the previous one.
+FIRST_BUCKET = 1e-6
+
+# Number of buckets of a Histogram. The last bucket has no upper bound.
+NUM_BUCKETS = 32
+
+# Number of source lines reported by the memory tracing
+TOP_ALLOCATIONS = 10
+
+
+class Histogram:
+    """ A histogram of durations, in seconds, with exponential buckets.
+
+    === Public Attributes ===
+    count:
+         the number of durations recorded
+    total:
+         the sum of the durations recorded
+    low:
+         the shortest duration recorded, or None if none was
+    high:
+         the longest duration recorded, or None if none was
+    buckets:
+         the number of durations recorded in each bucket. The durations up to
+         FIRST_BUCKET are in bucket 0, and those between
+         FIRST_BUCKET * 2 ** (i - 1) and FIRST_BUCKET * 2 ** i in bucket i.
+    """
+    count: int
+    total: float
+    low: Optional[float]
+    high: Optional[float]
+    buckets: list[int]
+
+    def __init__(self) -> None:
+        """ Create a new empty histogram.
+        """
+        self.count = 0
+        self.total = 0.0
+        self.low = None
+        self.high = None
+        self.buckets = [0] * NUM_BUCKETS
+
+    def add(self, seconds: float) -> None:
+        """ Record the duration <seconds>.
+        """
+        self.count += 1
+        self.total += seconds
+        if self.low is None or seconds < self.low:
+            self.low = seconds
+        if self.high is None or seconds > self.high:
+            self.high = seconds
+        bucket = 0
+        bound = FIRST_BUCKET
+        while seconds > bound and bucket < NUM_BUCKETS - 1:
+            bucket += 1
+            bound *= 2
+        self.buckets[bucket] += 1
+
+    def summary(self) -> dict[str, Any]:
+        """ Return a json-compatible summary of this histogram, with the upper
+        bound of each non-empty bucket mapped to its count.
+        """
+        buckets = {}
+        for i, count in enumerate(self.buckets):
+            if count:
+                bound = 'inf' if i == NUM_BUCKETS - 1 \
+                    else f'{FIRST_BUCKET * 2 ** i:.6g}'
+                buckets[bound] = count
+        return {'count': self.count,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else None,
+                'min': self.low,
+                'max': self.high,
+                'buckets': buckets}
+
+
+class Stats:
+    """ A set of named counters and timing histograms.
+
+    === Public Attributes ===
+    enabled:
+         whether anything is recorded. Recording into a disabled Stats does
+         nothing.
+    counters:
+         the value of each counter
+    histograms:
+         the histogram of each timing
+    extra:
+         other json-compatible results to export with the stats, by name
+    """
+    enabled: bool
+    counters: dict[str, int]
+    histograms: dict[str, Histogram]
+    extra: dict[str, Any]
+
+    def __init__(self, enabled: bool = False) -> None:
+        """ Create a new Stats with no record, which is <enabled> or not.
+        """
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self.extra = {}
+
+    def count(self, name: str, value: int = 1) -> None:
+        """ Add <value> to the counter <name>.
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """ Record the duration <seconds> in the histogram <name>.
+        """
+        if self.enabled:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """ Return a context manager recording the time spent in its block in
+        the histogram <name>.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def reset(self) -> None:
+        """ Remove all the records of this Stats.
+        """
+        self.counters = {}
+        self.histograms = {}
+        self.extra = {}
+
+    def snapshot(self) -> dict[str, Any]:
+        """ Return a json-compatible copy of the records of this Stats.
+        """
+        return {'counters': dict(sorted(self.counters.items())),
+                'histograms': {name: self.histograms[name].summary()
+                               for name in sorted(self.histograms)},
+                **self.extra}
+
+    def export(self, filename: Optional[str] = None) -> None:
+        """ Write the records of this Stats as json to the file <filename>,
+        or to standard output if <filename> is None or "-".
+        """
+        text = json.dumps(self.snapshot(), indent=2)
+        if filename is None or filename == '-':
+            print(text)
+        else:
+            with open(filename, 'w') as file:
+                file.write(text + "\n")
+
+
+# The stats recorded by the application
+STATS = Stats()
+
+
+class Profile:
+    """ A cProfile profiler and a memory tracer, both optional, running around
+    a part of the program.
+
+    Use a Profile in a with statement, or call start and stop.
+    """
+    # === Private Attributes ===
+    # _filename:
+    #     the file the cProfile profile is written to, or None if cProfile is
+    #     not used
+    # _memory:
+    #     whether the memory allocations are traced
+    # _profiler:
+    #     the running profiler, or None
+    _filename: Optional[str]
+    _memory: bool
+    _profiler: Optional[cProfile.Profile]
+
+    def __init__(self, filename: Optional[str] = None,
+                 memory: bool = False) -> None:
+        """ Create a new Profile writing a cProfile profile to <filename> if it
+        is not None, and tracing the memory allocations if <memory> is True.
+        """
+        self._filename = filename
+        self._memory = memory
+        self._profiler = None
+
+    def start(self) -> None:
+        """ Start profiling.
+        """
+        if self._memory:
+            tracemalloc.start()
+        if self._filename is not None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self) -> None:
+        """ Stop profiling, write the cProfile profile, and add the peak memory
+        and the lines allocating the most memory to STATS.
+        """
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self._filename)
+            self._profiler = None
+        if self._memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            top = snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+            STATS.extra['memory'] = {
+                'peak_bytes': peak,
+                'top': [{'line': str(stat.traceback[0]),
+                         'bytes': stat.size, 'blocks': stat.count}
+                        for stat in top]}
+
+    def __enter__(self) -> 'Profile':
+        """ Start profiling, and return this Profile.
+        """
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """ Stop profiling.
+        """
+        self.stop()
+
+
+def configure_from_env() -> Optional[Profile]:
+    """ Enable STATS and start profiling as asked by the MEWBILE_STATS,
+    MEWBILE_PROFILE and MEWBILE_TRACEMALLOC environment variables, described
+    in the module description. The results are written when the program
+    exits.
+
+    Return the running Profile, or None if no profiling was asked for.
+    """
+    stats_file = os.environ.get('MEWBILE_STATS')
+    profile_file = os.environ.get('MEWBILE_PROFILE')
+    memory = bool(os.environ.get('MEWBILE_TRACEMALLOC'))
+    # the exit functions run in the reverse order of their registration, so
+    # the profile is stopped before the stats are exported
+    if stats_file:
+        STATS.enabled = True
+        atexit.register(STATS.export, stats_file)
+    elif memory:
+        atexit.register(lambda: print(json.dumps(STATS.extra, indent=2),
+                                      file=sys.stderr))
+    profile = None
+    if profile_file or memory:
+        profile = Profile(profile_file, memory)
+        profile.start()
+        atexit.register(profile.stop)
+    return profile
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'atexit', 'cProfile', 'contextlib', 'json',
+            'os', 'sys', 'time', 'tracemalloc'
+        ],
+        'allowed-io': ['export', 'configure_from_env'],
+    })
@@ -0,0 +1,368 @@
+"""
+CSC148, Winter 2024
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the filter executors, which apply a Filter to a list of
+calls on behalf of the visualizer.
+
+The FilterExecutor applies filters directly. The ProcessFilterExecutor splits
+the calls into chunks and filters them in a pool of worker processes, which
+are not limited by the GIL. The columns of the CallTable are copied once into
+shared memory when the executor is created, so a query only sends the rows
+of each chunk to the workers, and only receives the positions of the matching
+calls back.
+
+It also contains replay_shards, which replays the calls of several groups of
+customers in worker processes, for process_event_history_sharded.
+"""
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Optional
+
+from call import Call
+from callhistory import CallHistory
+from calltable import ArrayCallTable, CallList, CallTable, from_epoch, numpy, \
+    to_epoch
+from contract import Contract
+from customer import Customer
+from filter import Filter, CustomerFilter, DurationFilter, LocationFilter
+from phoneline import PhoneLine
+
+# The CallTable columns shared with the worker processes
+SHARED_COLUMNS = ('times', 'durations', 'src_lon', 'src_lat', 'dst_lon',
+                  'dst_lat', 'src_ids', 'dst_ids')
+
+# The filters which can be applied by the worker processes
+PARALLEL_FILTERS = (CustomerFilter, DurationFilter, LocationFilter)
+
+# Lists with fewer calls than this are filtered directly, as sending them to
+# the workers costs more than filtering them
+MIN_PARALLEL_CALLS = 100000
+
+
+class FilterExecutor:
+    """ An executor applying filters directly, in the calling thread.
+    """
+    def apply(self, f: Filter, customers: list[Customer], data: list[Call],
+              filter_string: str) -> list[Call]:
+        """ Return the result of applying the filter <f> to <data>, as
+        f.apply(<customers>, <data>, <filter_string>) would.
+        """
+        return f.apply(customers, data, filter_string)
+
+    def covers(self, data: list[Call]) -> bool:
+        """ Return whether this executor can apply filters to <data> in
+        parallel.
+        """
+        return False
+
+    def close(self) -> None:
+        """ Release the resources held by this executor.
+        """
+
+
+# The state of a worker process, set up by _init_worker
+_WORKER: dict[str, Any] = {}
+
+
+def _init_worker(columns: list[tuple[str, str, str, int]],
+                 numbers: list[str],
+                 customers: list[Customer]) -> None:
+    """ Attach this worker process to the shared table <columns>, given as
+    (column name, shared memory name, NumPy dtype, length) tuples.
+    """
+    arrays = {}
+    blocks = []
+    for name, shm_name, dtype, length in columns:
+        block = SharedMemory(name=shm_name)
+        blocks.append(block)
+        arrays[name] = numpy.ndarray((length,), dtype=dtype,
+                                     buffer=block.buf)
+    _WORKER['blocks'] = blocks
+    _WORKER['table'] = ArrayCallTable(arrays, numbers)
+    _WORKER['customers'] = customers
+
+
+def _apply_chunk(filter_class: type, rows: Any, sorted_rows: bool,
+                 filter_string: str) -> Optional[Any]:
+    """ Apply a filter of class <filter_class> to the calls at <rows> of the
+    shared table, and return the positions in <rows> of the matching calls.
+    Return None if the filter returned its input unchanged.
+    """
+    # the "calls" of this list are their own positions, so the positions of
+    # the matching calls are returned as their "calls"
+    data = CallList(range(len(rows)), _WORKER['table'],
+                    array('q', rows.tobytes()), sorted_rows)
+    result = filter_class().apply(_WORKER['customers'], data, filter_string)
+    if result is data:
+        return None
+    return numpy.array(result, dtype=numpy.int64)
+
+
+def _customer_stub(customer: Customer) -> Customer:
+    """ Return a copy of <customer> with the same id and phone numbers, but
+    with no contracts nor call history, to be sent to the workers.
+    """
+    stub = Customer(customer.get_id())
+    for number in customer.get_phone_numbers():
+        stub.add_phone_line(PhoneLine(number, Contract(None)))
+    return stub
+
+
+class ProcessFilterExecutor(FilterExecutor):
+    """ An executor applying filters to the calls of one CallTable in a pool
+    of worker processes.
+
+    The workers see the customers and calls as they were when this executor
+    was created. Filters are applied directly to any call list this executor
+    does not cover.
+    """
+    # === Private Attributes ===
+    # _table:
+    #     the table whose calls are shared with the workers
+    # _size:
+    #     the number of rows of _table when it was shared
+    # _workers:
+    #     the number of worker processes
+    # _blocks:
+    #     the shared memory holding the columns of _table
+    # _pool:
+    #     the pool of worker processes
+    _table: CallTable
+    _size: int
+    _workers: int
+    _blocks: list[SharedMemory]
+    _pool: ProcessPoolExecutor
+
+    def __init__(self, table: CallTable, customers: list[Customer],
+                 workers: int) -> None:
+        """ Share the columns of <table> and the phone numbers of <customers>
+        with a new pool of <workers> worker processes.
+
+        Precondition: NumPy is installed.
+        """
+        self._table = table
+        self._size = len(table)
+        self._workers = workers
+        self._blocks = []
+        columns = []
+        for name in SHARED_COLUMNS:
+            source = table.column(name)
+            block = SharedMemory(create=True, size=max(1, source.nbytes))
+            numpy.ndarray(source.shape, dtype=source.dtype,
+                          buffer=block.buf)[:] = source
+            self._blocks.append(block)
+            columns.append((name, block.name, source.dtype.str, self._size))
+            del source
+        self._pool = ProcessPoolExecutor(
+            workers, initializer=_init_worker,
+            initargs=(columns, table.numbers,
+                      [_customer_stub(c) for c in customers]))
+
+    def covers(self, data: list[Call]) -> bool:
+        """ Return whether <data> is a CallList over the table shared with the
+        workers, and the table did not change since.
+        """
+        return (isinstance(data, CallList) and data.table is self._table
+                and len(self._table) == self._size)
+
+    def apply(self, f: Filter, customers: list[Customer], data: list[Call],
+              filter_string: str) -> list[Call]:
+        """ Return the result of applying the filter <f> to <data>, as
+        f.apply(<customers>, <data>, <filter_string>) would.
+
+        The calls are split into one chunk per worker, and the matching calls
+        of all chunks are merged back in their original order.
+        """
+        if (not isinstance(f, PARALLEL_FILTERS) or not self.covers(data)
+                or len(data) < MIN_PARALLEL_CALLS):
+            return f.apply(customers, data, filter_string)
+        rows = data.row_array()
+        size = -(-len(rows) // self._workers)
+        starts = range(0, len(rows), size)
+        futures = [self._pool.submit(_apply_chunk, type(f),
+                                     rows[start:start + size],
+                                     data.sorted_rows, filter_string)
+                   for start in starts]
+        results = [future.result() for future in futures]
+        if all(result is None for result in results):
+            # the filter string is invalid, or no call matches at all
+            return data
+        positions = [result + start for start, result in zip(starts, results)
+                     if result is not None]
+        return data.select(numpy.concatenate(positions))
+
+    def close(self) -> None:
+        """ Stop the worker processes and release the shared memory.
+        """
+        self._pool.shutdown()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def _replay_shard(lines: list[list[PhoneLine]], numbers: list[str],
+                  calls: tuple[array, array, array, array, array],
+                  boundaries: list[tuple[int, int, int]]) \
+        -> list[tuple[int, list[tuple[Contract, dict, dict, dict]]]]:
+    """ Replay the <calls> on the phone <lines> of a group of customers, one
+    list of lines per customer, and return the resulting state of each
+    customer.
+
+    The <calls> are given as a tuple of columns, in the following format:
+    (index in the event log, source number id, destination number id,
+     time in seconds since EPOCH, duration)
+    where a number id is the index of the number in <numbers>, or -1 for a
+    number which does not belong to this group.
+    Each boundary is given as a tuple (call index, month, year), meaning that
+    all customers advance to that new month just before the call at that
+    index, or at the end if no such call is replayed here.
+
+    The state of each customer is returned as a tuple of the number of times
+    it was changed and of the state of each of its lines, in order. The state
+    of a line is a tuple of its contract, its bills, and the indexes of its
+    outgoing and incoming calls for each month.
+    """
+    directory = {}
+    customers = []
+    for customer_lines in lines:
+        customer = Customer(len(customers), directory)
+        for line in customer_lines:
+            customer.add_phone_line(line)
+        customers.append(customer)
+    start = [customer.get_generation() for customer in customers]
+    # the calls from and to other groups have an empty number
+    numbers = numbers + [""]
+    call_indexes = {}
+    b = 0
+    for index, src, dst, time, duration in zip(*calls):
+        while b < len(boundaries) and boundaries[b][0] <= index:
+            for customer in customers:
+                customer.new_month(boundaries[b][1], boundaries[b][2])
+            b += 1
+        # only the numbers, time and duration of a call are used for billing
+        call = Call(numbers[src], numbers[dst], from_epoch(time), duration,
+                    None, None)
+        call_indexes[id(call)] = index
+        if src >= 0:
+            directory[call.src_number][0].make_call(call)
+        if dst >= 0:
+            directory[call.dst_number][0].receive_call(call)
+    for _, month, year in boundaries[b:]:
+        for customer in customers:
+            customer.new_month(month, year)
+
+    result = []
+    for customer, generation, customer_lines in zip(customers, start, lines):
+        states = []
+        for line in customer_lines:
+            history = line.get_call_history()
+            states.append((line.contract, line.bills,
+                           {key: [call_indexes[id(c)] for c in month_calls]
+                            for key, month_calls
+                            in history.outgoing_calls.items()},
+                           {key: [call_indexes[id(c)] for c in month_calls]
+                            for key, month_calls
+                            in history.incoming_calls.items()}))
+        result.append((customer.get_generation() - generation, states))
+    return result
+
+
+def _shard_columns(calls: list[Call], rows: list[int],
+                   numbers: list[str]) \
+        -> tuple[array, array, array, array, array]:
+    """ Return the calls at the <rows> of <calls> as columns, in the format
+    expected by _replay_shard, for a group of customers owning the phone
+    <numbers>.
+    """
+    ids = {number: i for i, number in enumerate(numbers)}
+    shard = [calls[i] for i in rows]
+    return (array('q', rows),
+            array('i', [ids.get(call.src_number, -1) for call in shard]),
+            array('i', [ids.get(call.dst_number, -1) for call in shard]),
+            array('q', [to_epoch(call.time) for call in shard]),
+            array('i', [call.duration for call in shard]))
+
+
+def replay_shards(customers: list[list[Customer]], calls: list[Call],
+                  shards: list[list[int]],
+                  boundaries: list[tuple[int, int, int]],
+                  workers: int) -> None:
+    """ Replay the <calls> of the event log on the <customers>, split into
+    groups of customers, with the calls of each group replayed in one of
+    <workers> worker processes.
+
+    <shards> holds, for each group, the indexes in <calls> of the calls made
+    or received by its customers, in increasing order. <boundaries> holds
+    the new months started while processing the calls, as (call index, month,
+    year) tuples, in order.
+
+    The customers end up with the same bills, contract state and call history
+    as if the calls were replayed in order, in this process, and their call
+    histories hold the Call objects of <calls>.
+    """
+    jobs = []
+    with ProcessPoolExecutor(workers) as pool:
+        for group, rows in zip(customers, shards):
+            # only the contracts and bills are sent, the calls already in the
+            # call histories stay in this process
+            lines = []
+            numbers = []
+            for customer in group:
+                stubs = []
+                for line in customer.get_phone_lines():
+                    number = line.get_number()
+                    stub = PhoneLine(number, line.contract)
+                    stub.bills = line.bills
+                    stubs.append(stub)
+                    numbers.append(number)
+                lines.append(stubs)
+            jobs.append(pool.submit(_replay_shard, lines, numbers,
+                                    _shard_columns(calls, rows, numbers),
+                                    boundaries))
+
+        for group, job in zip(customers, jobs):
+            for customer, (changes, states) in zip(group, job.result()):
+                for line, state in zip(customer.get_phone_lines(), states):
+                    line.contract, line.bills = state[0], state[1]
+                    _merge_history(line.get_call_history(), calls,
+                                   state[2], state[3])
+                customer.mark_changed(changes)
+
+
+def _merge_history(history: CallHistory, calls: list[Call],
+                   outgoing: dict[tuple[int, int], list[int]],
+                   incoming: dict[tuple[int, int], list[int]]) -> None:
+    """ Register into <history> the <calls> at the <outgoing> and <incoming>
+    indexes of each month, after the calls it already holds.
+    """
+    for registered, indexes in ((history.outgoing_calls, outgoing),
+                                (history.incoming_calls, incoming)):
+        for key, month_indexes in indexes.items():
+            registered.setdefault(key, []).extend(
+                map(calls.__getitem__, month_indexes))
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'array', 'concurrent.futures',
+            'multiprocessing.shared_memory', 'call', 'callhistory',
+            'calltable', 'contract', 'customer', 'filter', 'phoneline'
+        ],
+        'generated-members': 'numpy.*'
+    })
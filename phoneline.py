@@ -11,7 +11,8 @@ any changes, are expressly prohibited.
 All of the files in this directory and all subdirectories are:
 Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
 """
-from typing import Optional, Union
+import datetime
+from typing import Optional, Sequence, Union
 from call import Call
 from callhistory import CallHistory
 from bill import Bill
@@ -108,20 +109,28 @@ class PhoneLine:
         """
         return self.callhistory
 
-    def get_monthly_history(self, month: int = None, year: int = None) -> \
-            tuple[list[Call], list[Call]]:
+    def get_monthly_history(self, month: int = None, year: int = None,
+                            start: Optional[datetime.datetime] = None,
+                            end: Optional[datetime.datetime] = None) -> \
+            tuple[Sequence[Call], Sequence[Call]]:
         """ Return all calls this line has made during the <month> month of the
         <year> year, formatted as a Tuple containing two lists, in this order:
         outgoing calls, incoming calls
 
         If month and year are both None, then return all calls from the
         callhistory of this phone line.
+        If <start> or <end> is given instead, return read-only views over the
+        calls made from <start> included to <end> excluded, without copying
+        them (see CallHistory.get_window).
 
         Precondition:
         - <month> and <year> are either both specified, or are both missing/None
         - if <month> and <year> are specified (non-None), they are both valid
         monthly cycles according to the input dataset
+        - <month> and <year> are not given along with <start> or <end>
         """
+        if start is not None or end is not None:
+            return self.callhistory.get_window(start, end)
         return self.callhistory.get_monthly_history(month, year)
 
     def get_bill(self, month: int, year: int) \
@@ -151,7 +160,7 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing',
+            'python_ta', 'typing', 'datetime',
             'call', 'callhistory', 'bill', 'contract'
         ],
         'generated-members': 'pygame.*'
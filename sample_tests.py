@@ -11,14 +11,37 @@ any changes, are expressly prohibited.
 All of the files in this directory and all subdirectories are:
 Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
 """
+import csv
 import datetime
+import json
+import pickle
+import time
 
+import pygame
 import pytest
 
-from application import create_customers, process_event_history
-from contract import TermContract, MTMContract, PrepaidContract
+import call as call_module
+import contract
+import eventlog
+import filter as filter_module
+import parallel
+import visualizer
+from application import create_customers, process_event_history, \
+    find_customer_by_number, get_directory, import_data_stream, \
+    process_event_history_sharded, process_store_history, ingest_incremental
+from benchmark import make_calls, make_dataset, run_suite
+from bill import Bill
+from billing import BILL_COLUMNS, bill_columns, iter_bills, write_bills
+from call import Call
+from callstore import CallStore, convert_to_store
+from callhistory import CallHistory, HistoryView
+from calltable import CallList, CallTable
+from checkpoint import load_checkpoint
+from contract import TermContract, MTMContract, PrepaidContract, bill_batch
 from customer import Customer
-from filter import DurationFilter, CustomerFilter, ResetFilter
+from filter import DurationFilter, CustomerFilter, ResetFilter, \
+    LocationFilter, FilterCache, FilterPipeline
+from instrument import STATS, Profile, Stats
 from phoneline import PhoneLine
 
 """
@@ -187,6 +210,847 @@ def test_contract_start_dates() -> None:
                     year=2019, month=6, day=25)
 
 
+def test_ingest_loads_no_sprites(monkeypatch) -> None:
+    """ Test that processing the events does not load any sprite images, since
+    the drawables of a Call are only created when they are displayed.
+    """
+    def fail_load(*args) -> None:
+        raise AssertionError("sprite loaded during ingestion")
+
+    monkeypatch.setattr(pygame.image, 'load', fail_load)
+    customers = create_customers(test_dict)
+    process_event_history(test_dict, customers)
+    assert len(customers[0].get_history()[0]) == 3
+
+
+def test_call_table() -> None:
+    """ Test that a CallTable stores the calls compactly, and that views over
+    it give back the same calls as the call history.
+    """
+    customers = create_customers(test_dict)
+    table = CallTable()
+    process_event_history(test_dict, customers, table)
+    assert len(table) == 3
+
+    history = customers[0].get_history()
+    view = customers[0].get_history(table)
+    for calls, views in zip(history, view):
+        assert len(calls) == len(views)
+        for call, row in zip(calls, views):
+            assert (row.src_number, row.dst_number, row.time, row.duration) \
+                == (call.src_number, call.dst_number, call.time, call.duration)
+            assert list(row.src_loc) == list(call.src_loc)
+            assert list(row.dst_loc) == list(call.dst_loc)
+
+    monthly = table.get_history(['867-5309'], 1, 2018)
+    assert [c.duration for c in monthly[0]] == [50]
+    assert [c.duration for c in monthly[1]] == [10]
+    assert len(table.get_history(['867-5309'], 2, 2018)[0]) == 0
+
+
+def _customers_of(calls: list[Call]) -> list[Customer]:
+    """ Return customers owning ten of the source numbers of <calls> each,
+    with ids 0, 10, 20...
+    """
+    customers = []
+    numbers = sorted({c.src_number for c in calls})
+    for i in range(0, len(numbers), 10):
+        customer = Customer(i)
+        for number in numbers[i:i + 10]:
+            customer.add_phone_line(PhoneLine(
+                number, MTMContract(datetime.date(2017, 12, 25))))
+        customers.append(customer)
+    return customers
+
+
+def test_vectorized_filters() -> None:
+    """ Test that filtering a CallList over its columns gives the same calls,
+    in the same order, as filtering a plain list of the same calls.
+    """
+    calls = make_calls(2000)
+    call_list = CallList(calls)
+    filters = [
+        (DurationFilter(), ["L050", "G010", "L000", "G999", "G500", "L020",
+                            "G980", "50"]),
+        (LocationFilter(), ["-79.6, 43.6, -79.3, 43.7",
+                            "-79.5, 43.6, -79.49, 43.61",
+                            "-79.6, 43.6, -79.3",
+                            "a, b, c, d"])
+    ]
+    for f, filter_strings in filters:
+        for filter_string in filter_strings:
+            expected = f.apply([], calls, filter_string)
+            result = f.apply([], call_list, filter_string)
+            assert isinstance(result, CallList)
+            assert list(result) == list(expected)
+            assert list(result.rows) == [calls.index(c) for c in result]
+
+    customers = _customers_of(calls)
+    for filter_string in ["0", "10", "990", "1", "x"]:
+        for data in [calls, calls[::-1], calls[500:]]:
+            expected = CustomerFilter().apply(customers, data, filter_string)
+            result = CustomerFilter().apply(customers, CallList(data),
+                                            filter_string)
+            assert list(result) == list(expected)
+        result = CustomerFilter().apply(customers, call_list[::-1],
+                                        filter_string)
+        assert list(result) == list(CustomerFilter().apply(
+            customers, calls[::-1], filter_string))
+
+    # small or unordered inputs do not use the same code path
+    for data in [call_list[:50], call_list[::-1], call_list[::3]]:
+        for filter_string in ["-79.6, 43.6, -79.3, 43.7",
+                              "-79.5, 43.6, -79.49, 43.61"]:
+            expected = LocationFilter().apply([], list(data), filter_string)
+            result = LocationFilter().apply([], data, filter_string)
+            assert list(result) == list(expected)
+
+    # filters can be chained on the result of a previous filter
+    result = DurationFilter().apply([], call_list[100:], "G500")
+    result = LocationFilter().apply([], result, "-79.6, 43.6, -79.3, 43.7")
+    expected = DurationFilter().apply([], calls[100:], "G500")
+    expected = LocationFilter().apply([], expected,
+                                      "-79.6, 43.6, -79.3, 43.7")
+    assert list(result) == expected
+
+
+def test_filter_pipeline() -> None:
+    """ Test that a FilterPipeline gives the same calls as applying its
+    filters one after the other, including when some filter matches no call.
+    """
+    calls = make_calls(3000)
+    call_list = CallList(calls)
+    customers = _customers_of(calls)
+    pipelines = [
+        [(DurationFilter(), "G500"), (CustomerFilter(), "10"),
+         (LocationFilter(), "-79.6, 43.6, -79.3, 43.7")],
+        [(LocationFilter(), "-79.5, 43.6, -79.49, 43.61"),
+         (DurationFilter(), "L020")],
+        # the location matches no call of the customer, so it keeps them all
+        [(CustomerFilter(), "0"), (DurationFilter(), "G990"),
+         (LocationFilter(), "-79.5, 43.6, -79.49, 43.61")],
+        [(DurationFilter(), "L000"), (CustomerFilter(), "0")],
+        [(CustomerFilter(), "x"), (DurationFilter(), "G999")],
+        [(LocationFilter(), "-79.6, 43.6, -79.3"), (CustomerFilter(), "1")],
+        []
+    ]
+    for steps in pipelines:
+        for data in [call_list, call_list[::-1], call_list[1000:]]:
+            expected = list(data)
+            for f, filter_string in steps:
+                expected = f.apply(customers, expected, filter_string)
+            result = FilterPipeline(steps).apply(customers, data)
+            assert list(result) == list(expected)
+    with pytest.raises(ValueError):
+        FilterPipeline([(ResetFilter(), "")])
+
+
+def test_process_filter_executor(monkeypatch) -> None:
+    """ Test that filtering calls in worker processes gives the same result as
+    filtering them directly.
+    """
+    pytest.importorskip('numpy')
+    monkeypatch.setattr(parallel, 'MIN_PARALLEL_CALLS', 0)
+    calls = make_calls(3000)
+    call_list = CallList(calls)
+    customers = create_customers(test_dict)
+    customers.append(Customer(1))
+    customers[-1].add_phone_line(PhoneLine(
+        calls[0].src_number, MTMContract(datetime.date(2017, 12, 25))))
+    executor = parallel.ProcessFilterExecutor(call_list.table, customers, 3)
+    try:
+        cases = [(DurationFilter(), ["L050", "G500", "G999", "x"]),
+                 (LocationFilter(), ["-79.6, 43.6, -79.3, 43.7",
+                                     "-79.5, 43.6, -79.49, 43.61",
+                                     "-79.6, 43.6, -79.3"]),
+                 (CustomerFilter(), ["7777", "1", "1234"])]
+        for f, filter_strings in cases:
+            for filter_string in filter_strings:
+                for data in [call_list, call_list[::2], call_list[::-1]]:
+                    expected = f.apply(customers, data, filter_string)
+                    result = executor.apply(f, customers, data, filter_string)
+                    assert list(result) == list(expected)
+                    assert (result is data) == (expected is data)
+    finally:
+        executor.close()
+
+
+def test_filter_cache() -> None:
+    """ Test that filter results are reused for the same filter, filter
+    string and input calls, and that the cache stays within its bounds.
+    """
+    pytest.importorskip('numpy')
+    customers = create_customers(test_dict)
+    process_event_history(test_dict, customers)
+    all_calls = ResetFilter().apply(customers, [], "")
+    assert ResetFilter().apply(customers, all_calls, "") is all_calls
+
+    cache = FilterCache(max_entries=2)
+    first = cache.apply(DurationFilter(), customers, all_calls, "G010")
+    assert len(first) == 2
+    assert cache.apply(DurationFilter(), customers, all_calls, "G010") \
+        is first
+    assert cache.apply(CustomerFilter(), customers, all_calls, "7777") \
+        is not first
+    assert cache.apply(CustomerFilter(), customers, all_calls, " 7777") \
+        is cache.apply(CustomerFilter(), customers, all_calls, "7777")
+    assert len(cache) == 2
+    cache.apply(DurationFilter(), customers, all_calls, "G020")
+    assert len(cache) == 2
+    # the least recently used result was evicted
+    assert cache.apply(DurationFilter(), customers, all_calls, "G010") \
+        is not first
+
+    # new calls invalidate the full list of calls
+    process_event_history(test_dict, customers)
+    reset = ResetFilter().apply(customers, all_calls, "")
+    assert reset is not all_calls
+    assert len(reset) == 6
+
+
+def test_phone_directory() -> None:
+    """ Test that the phone number directory built by create_customers is kept
+    in sync when phone lines are added or cancelled.
+    """
+    customers = create_customers(test_dict)
+    customer = customers[0]
+    assert find_customer_by_number('867-5309', customers) is customer
+    assert find_customer_by_number('555-5555', customers) is None
+
+    customer.add_phone_line(
+        PhoneLine('555-5555',
+                  MTMContract(start=datetime.date(year=2017, month=12,
+                                                  day=25))))
+    assert find_customer_by_number('555-5555', customers) is customer
+    assert '555-5555' in customer
+
+    customer.new_month(12, 2017)
+    assert customer.cancel_phone_line('555-5555') == 50
+    assert find_customer_by_number('555-5555', customers) is None
+    assert '555-5555' not in customer
+    assert customer.cancel_phone_line('555-5555') is None
+
+    # a lookup only finds the customers of the list given, and does not
+    # change the customers
+    customers = create_customers(make_dataset(6, 10))
+    assert get_directory(customers) is customers[0].get_directory()
+    number = customers[5].get_phone_numbers()[0]
+    assert find_customer_by_number(number, customers[:2]) is None
+    assert find_customer_by_number(number, customers) is customers[5]
+    assert number not in get_directory(customers[:2])
+    alone = Customer(1000)
+    alone.add_phone_line(PhoneLine('555-1234', MTMContract(
+        start=datetime.date(year=2017, month=12, day=25))))
+    assert get_directory([customers[0], alone])['555-1234'][0] is alone
+    assert alone.get_directory() is None
+    assert '555-1234' not in customers[0].get_directory()
+
+
+def test_streaming_import(tmp_path, monkeypatch) -> None:
+    """ Test that streaming the dataset from a json or json-lines file gives
+    the same records, and the same bills, as loading it all in memory.
+    """
+    # use a tiny chunk size so values are split across buffer boundaries
+    monkeypatch.setattr(eventlog, 'CHUNK_SIZE', 7)
+    json_file = str(tmp_path / 'dataset.json')
+    jsonl_file = str(tmp_path / 'dataset.jsonl')
+    with open(json_file, 'w') as f:
+        json.dump(test_dict, f, indent=2)
+    eventlog.convert_to_jsonl(json_file, jsonl_file)
+
+    for filename in [json_file, jsonl_file]:
+        log = import_data_stream(filename)
+        assert log['customers'] == test_dict['customers']
+        customers = create_customers(log)
+        process_event_history(log, customers)
+        bill = customers[0].generate_bill(1, 2018)
+        assert bill[1] == pytest.approx(-29.925)
+        assert list(eventlog.iter_records(filename, 'events')) \
+            == test_dict['events']
+
+
+def test_parse_time() -> None:
+    """ Test that parse_time gives the same times as strptime, and rejects the
+    same timestamps.
+    """
+    for text in ["2018-01-01 14:29:05", "2018-01-01 14:29:05",
+                 "2019-12-31 23:59:59", "2020-02-29 00:00:00"]:
+        assert eventlog.parse_time(text) == datetime.datetime.strptime(
+            text, eventlog.TIME_FORMAT)
+    for text in ["2018-01-01T14:29:05", "2018-01-01", "2018-13-01 00:00:00",
+                 "2018-01-01 14:29:5 ", "2018-W01-1 14:29:05",
+                 "2018-01-01 14:29+01", ""]:
+        with pytest.raises(ValueError):
+            eventlog.parse_time(text)
+
+
+def test_event_decoder() -> None:
+    """ Test that the event decoder skips and counts sms events, and rejects
+    call events which do not match the schema.
+    """
+    decoder = eventlog.EventDecoder()
+    customers = create_customers(test_dict)
+    process_event_history(test_dict, customers, decoder=decoder)
+    assert (decoder.num_calls, decoder.num_sms) == (3, 3)
+    assert len(customers[0].get_history()[0]) == 3
+
+    event = dict(test_dict['events'][3])
+    del event['duration']
+    with pytest.raises(ValueError):
+        eventlog.EventDecoder().decode(event)
+    event = dict(test_dict['events'][3], time="Jan 1 2018")
+    with pytest.raises(ValueError):
+        eventlog.EventDecoder().decode(event)
+
+
+def _customer_state(customer: Customer) -> list:
+    """ Return the bills, contract state and call history of <customer>.
+    """
+    state = [customer.get_generation()]
+    for number in customer.get_phone_numbers():
+        line = customer.get_directory()[number][1]
+        contract = {k: v for k, v in vars(line.contract).items() if k != 'bill'}
+        history = line.get_call_history()
+        state.append((number, contract, line.contract.bill.get_summary(),
+                      {k: b.get_summary() for k, b in line.bills.items()},
+                      {k: [(c.src_number, c.time) for c in v]
+                       for k, v in history.outgoing_calls.items()},
+                      {k: [(c.src_number, c.time) for c in v]
+                       for k, v in history.incoming_calls.items()}))
+    return state
+
+
+def test_sharded_replay() -> None:
+    """ Test that replaying the calls in worker processes gives the same
+    bills, contract state and call histories as processing them in order.
+    """
+    log = make_dataset(7, 3000)
+    expected = create_customers(log)
+    process_event_history(log, expected)
+    assert len(expected[0].get_history()[0]) > 0
+    for workers in [1, 3]:
+        customers = create_customers(log)
+        decoder = eventlog.EventDecoder()
+        process_event_history_sharded(log, customers, workers,
+                                      decoder=decoder)
+        assert decoder.num_sms > 0
+        for cust, exp in zip(customers, expected):
+            assert _customer_state(cust) == _customer_state(exp)
+            assert [cust.generate_bill(m, 2018) for m in range(1, 13)] \
+                == [exp.generate_bill(m, 2018) for m in range(1, 13)]
+        # calls between two customers are shared by both histories
+        call = customers[0].get_history()[0][0]
+        receiver = find_customer_by_number(call.dst_number, customers)
+        assert any(c is call for c in receiver.get_history()[1])
+
+
+def test_incremental_ingest(tmp_path) -> None:
+    """ Test that ingesting an event log in several parts, resuming from a
+    checkpoint each time, gives the same state as processing it at once.
+    """
+    log = make_dataset(6, 3000)
+    late = set(line['number'] for line in log['customers'][-1]['lines'])
+    # the last customer only appears in the log after its first 1000 events
+    events = [e for e in log['events'][:1000]
+              if e['src_number'] not in late and e['dst_number'] not in late]
+    joined = len(events)
+    events += log['events'][1000:]
+    expected = create_customers(log)
+    process_event_history({'events': events}, expected)
+
+    records = log['customers'][:-1] + events[:400]
+    parts = [records,
+             events[400:joined] + log['customers'][-1:]
+             + events[joined:len(events) // 2],
+             events[len(events) // 2:]]
+    checkpoint_file = str(tmp_path / 'checkpoint')
+    jsonl_file = str(tmp_path / 'dataset.jsonl')
+    for part in parts:
+        text = "".join(json.dumps(record) + "\n" for record in part)
+        with open(jsonl_file, 'a') as f:
+            f.write(text[:-10])
+        # the last record is not complete yet, so it is not processed
+        checkpoint = ingest_incremental(jsonl_file, checkpoint_file)
+        with open(jsonl_file, 'a') as f:
+            f.write(text[-10:])
+        assert checkpoint.num_events < len(events)
+    checkpoint = ingest_incremental(jsonl_file, checkpoint_file)
+    assert checkpoint.num_events == len(events)
+    assert not checkpoint.has_full_history()
+    checkpoint = load_checkpoint(checkpoint_file)
+    # saving a checkpoint with its full history does not duplicate calls
+    checkpoint.save(checkpoint_file)
+    checkpoint = load_checkpoint(checkpoint_file)
+    assert len(checkpoint.customers) == len(expected)
+    for cust, exp in zip(checkpoint.customers, expected):
+        assert _customer_state(cust) == _customer_state(exp)
+
+    json_file = str(tmp_path / 'dataset.json')
+    checkpoint_file = str(tmp_path / 'json_checkpoint')
+    for end in [0, 400, len(events)]:
+        # the last customer is only added to the file with its events
+        customers = log['customers'] if end > joined else log['customers'][:-1]
+        with open(json_file, 'w') as f:
+            json.dump({'customers': customers, 'events': events[:end]}, f)
+        ingest_incremental(json_file, checkpoint_file)
+    checkpoint = load_checkpoint(checkpoint_file)
+    assert len(checkpoint.customers) == len(expected)
+    for cust, exp in zip(checkpoint.customers, expected):
+        assert _customer_state(cust) == _customer_state(exp)
+
+
+def test_call_store(tmp_path) -> None:
+    """ Test that a call store holds the calls of its dataset, in order, and
+    that filtering the calls of a store gives the same calls as filtering the
+    calls of the dataset.
+    """
+    log = make_dataset(20, 3000)
+    json_file = str(tmp_path / 'dataset.json')
+    store_file = str(tmp_path / 'dataset.calls')
+    with open(json_file, 'w') as f:
+        json.dump(log, f)
+    decoder = eventlog.EventDecoder()
+    calls = [decoder.decode(e) for e in log['events']]
+    calls = [c for c in calls if c is not None]
+    assert convert_to_store(json_file, store_file) == len(calls)
+
+    store = CallStore(store_file)
+    assert len(store) == len(calls)
+    for expected, call in zip(calls, store):
+        assert (call.src_number, call.dst_number, call.time, call.duration,
+                call.src_loc, call.dst_loc) == \
+            (expected.src_number, expected.dst_number, expected.time,
+             expected.duration, tuple(expected.src_loc),
+             tuple(expected.dst_loc))
+    call = store.get_call(len(calls) - 1)
+    assert (call.time, call.duration) == (calls[-1].time, calls[-1].duration)
+    with pytest.raises(IndexError):
+        store.get_call(len(calls))
+
+    table = store.table()
+    assert len(table) == len(calls)
+    assert list(table.column('durations')) == [c.duration for c in calls]
+    data = store.call_list()
+    # the calls of the list are only created when accessed
+    assert len(data) == len(calls) and data[5] is not data[5]
+    assert data[5].time == data[1:][4].time == calls[5].time
+    customers = create_customers(log)
+    for f, filter_string in [(DurationFilter(), "G500"),
+                             (LocationFilter(), "-79.6, 43.6, -79.3, 43.7"),
+                             (CustomerFilter(), str(customers[3].get_id()))]:
+        result = f.apply(customers, data, filter_string)
+        expected = f.apply(customers, calls, filter_string)
+        assert [c.time for c in result] == [c.time for c in expected]
+
+    # billing the calls of the store gives the same bills
+    process_store_history(store, customers)
+    expected = create_customers(log)
+    process_event_history(log, expected)
+    for cust, exp in zip(customers, expected):
+        assert _customer_state(cust)[1:] == [
+            state[:4] + ({}, {}) for state in _customer_state(exp)[1:]]
+    del table, data, result
+    store.close()
+
+    with open(json_file, 'rb') as f, open(store_file, 'wb') as out:
+        out.write(f.read(100))
+    with pytest.raises(ValueError):
+        CallStore(store_file)
+
+
+def test_benchmark_suite() -> None:
+    """ Test that the benchmark suite reports every stage as json, and that
+    its datasets follow the given parameters.
+    """
+    log = make_dataset(5, 100, lines_per_customer=(2, 2), months=3)
+    assert all(len(c['lines']) == 2 for c in log['customers'])
+    assert log['events'][-1]['time'] < '2018-04-15'
+
+    results = json.loads(json.dumps(run_suite(5, 300, repeat=1)))
+    assert results['params']['events'] == 300
+    for stage in ['create_customers', 'process_event_history',
+                  'filter_ResetFilter', 'filter_CustomerFilter',
+                  'filter_DurationFilter', 'filter_LocationFilter',
+                  'generate_bill']:
+        assert results['stages'][stage]['secs'] >= 0
+        assert results['stages'][stage]['peak_bytes'] > 0
+    assert 'render' in results['stages']
+
+
+def test_instrumentation(tmp_path) -> None:
+    """ Test that the events, new months and billed calls processed are
+    counted in STATS once it is enabled, and that stats can be exported.
+    """
+    log = make_dataset(6, 2000)
+    decoder = eventlog.EventDecoder()
+    process_event_history(log, create_customers(log), decoder=decoder)
+    assert STATS.snapshot()['counters'] == {}
+
+    STATS.enabled = True
+    try:
+        with Profile(memory=True):
+            process_event_history(log, create_customers(log))
+        process_event_history_sharded(log, create_customers(log), workers=2)
+        counters = STATS.snapshot()['counters']
+        assert counters['events.calls'] == 2 * decoder.num_calls
+        assert counters['events.sms'] == 2 * decoder.num_sms
+        assert counters['months.rollovers'] == 2 * 23
+        assert sum(counters[name] for name in counters
+                   if name.startswith('calls.billed.')) \
+            == 2 * decoder.num_calls
+        assert STATS.snapshot()['memory']['peak_bytes'] > 0
+    finally:
+        STATS.enabled = False
+        STATS.reset()
+
+    stats = Stats(enabled=True)
+    for seconds in [0.5e-6, 3e-6, 3e-6, 10.0]:
+        stats.observe('timing', seconds)
+    with stats.timer('timer'):
+        pass
+    stats.count('counter', 3)
+    stats.export(str(tmp_path / 'stats.json'))
+    with open(tmp_path / 'stats.json') as f:
+        exported = json.load(f)
+    assert exported['counters'] == {'counter': 3}
+    histogram = exported['histograms']['timing']
+    assert histogram['count'] == 4
+    assert histogram['max'] == 10.0
+    assert histogram['buckets']['4e-06'] == 2
+    assert exported['histograms']['timer']['count'] == 1
+
+
+def test_bulk_billing(tmp_path) -> None:
+    """ Test that the bulk billing functions give the same bills as
+    PhoneLine.get_bill, as rows, columns, csv and json-lines.
+    """
+    log = make_dataset(8, 2000)
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    months = [(m, 2018) for m in range(1, 13)] + [(1, 2019), (13, 2019)]
+    expected = []
+    for customer in customers:
+        for line in customer.get_phone_lines():
+            for month, year in months:
+                bill = line.get_bill(month, year)
+                if bill is not None:
+                    expected.append({'customer': customer.get_id(),
+                                     'month': month, 'year': year, **bill})
+    rows = [dict(zip(BILL_COLUMNS, row))
+            for row in iter_bills(customers, months)]
+    assert rows == expected
+    assert len(list(iter_bills(customers))) > len(rows)
+
+    columns = bill_columns(customers, months)
+    assert list(columns['total']) == [bill['total'] for bill in expected]
+    assert columns['number'] == [bill['number'] for bill in expected]
+
+    assert write_bills(customers, str(tmp_path / 'bills.csv'),
+                       months=months) == len(expected)
+    with open(tmp_path / 'bills.csv', newline='') as f:
+        reader = csv.DictReader(f)
+        assert tuple(reader.fieldnames) == BILL_COLUMNS
+        for row, bill in zip(reader, expected):
+            assert row['number'] == bill['number']
+            assert float(row['total']) == bill['total']
+    write_bills(customers, str(tmp_path / 'bills.jsonl'), 'jsonl', months)
+    with open(tmp_path / 'bills.jsonl') as f:
+        assert [json.loads(line) for line in f] == expected
+    with pytest.raises(ValueError):
+        write_bills(customers, str(tmp_path / 'bills.xml'), 'xml')
+
+
+def test_batch_billing(monkeypatch) -> None:
+    """ Test that billing calls in a batch gives the same bills, and the same
+    remaining free minutes, as billing them one at a time.
+    """
+    calls = make_calls(3000)
+    start = datetime.date(2017, 12, 25)
+    for use_numpy in [True, False]:
+        if not use_numpy:
+            monkeypatch.setattr(contract, 'numpy', None)
+        for kinds in [[TermContract], [MTMContract, PrepaidContract],
+                      [TermContract, MTMContract, TermContract]]:
+            single = []
+            batch = []
+            for kind in kinds:
+                for contracts in [single, batch]:
+                    if kind is TermContract:
+                        c = kind(start, datetime.date(2019, 6, 25))
+                    elif kind is PrepaidContract:
+                        c = kind(start, 100)
+                    else:
+                        c = kind(start)
+                    c.new_month(1, 2018, Bill())
+                    contracts.append(c)
+            # the first contract gets most of the calls, to bill them with
+            # NumPy in a single batch
+            owners = [0 if i % 4 else i % len(kinds) for i in range(len(calls))]
+            durations = [0, 60, 61] + [c.duration % 400 for c in calls[3:]]
+            for owner, call, duration in zip(owners, calls, durations):
+                call.duration = duration
+                single[owner].bill_call(call)
+            bill_batch(batch, owners, durations)
+            for c1, c2 in zip(single, batch):
+                assert vars(c1.bill) == vars(c2.bill)
+                if isinstance(c1, TermContract):
+                    assert c1.remaining_free_mins == c2.remaining_free_mins
+
+    # calls of 0 minutes between billed calls, once the free minutes ran out
+    monkeypatch.undo()
+    durations = [3000, 2400] + [0, 600] * 20000
+    single = TermContract(start, datetime.date(2019, 6, 25))
+    batch = TermContract(start, datetime.date(2019, 6, 25))
+    for c in [single, batch]:
+        c.new_month(1, 2018, Bill())
+    for duration in durations:
+        calls[0].duration = duration
+        single.bill_call(calls[0])
+    batch.bill_calls(contract.call_minutes(durations))
+    assert vars(single.bill) == vars(batch.bill)
+    assert single.remaining_free_mins == batch.remaining_free_mins
+
+    # any sequence of minutes can be billed
+    for c in [single, batch]:
+        c.new_month(2, 2018, Bill())
+    for minutes in [(1, 2, 3), range(4)]:
+        single.bill_calls(list(minutes))
+        batch.bill_calls(minutes)
+    assert vars(single.bill) == vars(batch.bill)
+
+
+def test_history_windows() -> None:
+    """ Test that the calls of a customer or phone line over a range of time
+    are the same as found by checking every call, with and without a table.
+    """
+    log = make_dataset(5, 3000)
+    table = CallTable()
+    customers = create_customers(log)
+    process_event_history(log, customers, table)
+    sharded = create_customers(log)
+    process_event_history_sharded(log, sharded, workers=2)
+    windows = [(None, None), (datetime.datetime(2018, 3, 1), None),
+               (None, datetime.datetime(2018, 3, 1)),
+               (datetime.datetime(2018, 5, 17, 10, 30),
+                datetime.datetime(2019, 2, 3, 0, 0, 0, 500)),
+               (datetime.datetime(2019, 2, 3), datetime.datetime(2019, 2, 3))]
+    for customer, other in zip(customers, sharded):
+        history = customer.get_history()
+        for start, end in windows:
+            expected = tuple([c for c in calls
+                              if (start is None or start <= c.time)
+                              and (end is None or c.time < end)]
+                             for calls in history)
+            expected = [[(c.src_number, c.time) for c in calls]
+                        for calls in expected]
+            for cust in [customer, other]:
+                result = cust.get_history(start=start or datetime.datetime.min,
+                                          end=end)
+                assert isinstance(result[0], HistoryView)
+                assert [[(c.src_number, c.time) for c in calls]
+                        for calls in result] == expected
+            result = customer.get_history(table, start, end)
+            assert [[(c.src_number, c.time) for c in calls]
+                    for calls in result] == expected
+
+    # views are not affected by calls registered afterwards, and calls
+    # registered out of order or directly into the monthly lists are indexed
+    history = CallHistory()
+    calls = make_calls(200)
+    for call in calls[100:150]:
+        history.register_outgoing_call(call)
+    view = history.get_window()[0]
+    for call in calls[150:] + calls[:50]:
+        history.register_outgoing_call(call)
+    history.outgoing_calls.setdefault(calls[50].get_bill_date(),
+                                      []).extend(calls[50:100])
+    assert list(view) == calls[100:150]
+    window = history.get_window(calls[20].time, calls[180].time)[0]
+    assert list(window) == calls[20:180]
+    assert list(window[10:-10]) == calls[30:170]
+    assert window[-1] is calls[179]
+    assert list(HistoryView.chain([window[:5], view[:5]])) \
+        == calls[20:25] + calls[100:105]
+    assert history.get_monthly_history()[0] == calls
+
+
+def test_history_views(monkeypatch) -> None:
+    """ Test that the history of a customer is a cached view over its calls,
+    which is only rebuilt when its calls change, and that the reset filter
+    chains these views without copying the calls.
+    """
+    log = make_dataset(4, 1000)
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    customer = customers[0]
+    history = customer.get_history()
+    assert customer.get_history() is history
+    expected = ([], [])
+    for line in customer.get_phone_lines():
+        line_history = line.get_monthly_history()
+        expected[0].extend(line_history[0])
+        expected[1].extend(line_history[1])
+    assert history == expected
+
+    number = customer.get_phone_numbers()[0]
+    call = make_calls(1)[0]
+    call.src_number = number
+    call.time = datetime.datetime(2020, 1, 1)
+    customer.make_call(call)
+    assert customer.get_history() is not history
+    assert list(customer.get_history()[0]).count(call) == 1
+    assert call not in history[0]
+    # calls registered directly into a phone line are seen too
+    reset = ResetFilter().apply(customers, [], "")
+    views = customer.get_history()
+    direct = make_calls(1)[0]
+    direct.src_number = number
+    direct.time = datetime.datetime(2020, 1, 2)
+    customer.get_directory()[number][1].make_call(direct)
+    assert customer.get_history() is not views
+    assert direct in list(customer.get_history()[0])
+    assert direct in list(ResetFilter().apply(customers, [], ""))
+    assert direct not in list(reset)
+    # the cached views are not pickled along with the customer
+    restored = pickle.loads(pickle.dumps(customer))
+    assert restored._history is None
+    assert len(restored.get_history()[0]) == len(history[0]) + 2
+
+    monkeypatch.setattr(filter_module, 'numpy', None)
+    monkeypatch.setattr(filter_module, '_RESET_CACHE', {})
+    calls = ResetFilter().apply(customers, [], "")
+    assert isinstance(calls, HistoryView)
+    assert list(calls) == [c for cust in customers
+                           for c in cust.get_history()[0]]
+    assert ResetFilter().apply(customers, [], "") is calls
+
+
+@pytest.fixture
+def fake_images(monkeypatch) -> None:
+    """ Replace the map and sprite images, which are not shipped with the
+    tests, with blank images.
+    """
+    monkeypatch.setattr(pygame.image, 'load',
+                        lambda *args: pygame.Surface((1200, 840)))
+    monkeypatch.setattr(call_module, '_SPRITE_CACHE', {})
+
+
+def test_map_culling(monkeypatch, fake_images) -> None:
+    """ Test that the map only draws the calls with an endpoint in view, and
+    draws a heatmap instead of the calls when too many of them are in view.
+    """
+    pytest.importorskip('numpy')
+    screen_map = visualizer.Map(visualizer.SCREEN_SIZE)
+    screen = pygame.Surface(visualizer.SCREEN_SIZE)
+    calls = make_calls(3000)
+    call_list = CallList(calls)
+    screen_map.zoom(2)
+    screen_map.pan((-300, -200))
+    width, height = visualizer.SCREEN_SIZE
+    positions = set(screen_map.visible_positions(call_list).tolist())
+    assert 0 < len(positions) < len(calls)
+    for i, call in enumerate(calls):
+        ends = [screen_map._longlat_to_screen(call.src_loc),
+                screen_map._longlat_to_screen(call.dst_loc)]
+        if any(0 <= x < width and 0 <= y < height for x, y in ends):
+            assert i in positions
+        if i in positions:
+            assert any(-14 <= x <= width + 14 and -14 <= y <= height + 14
+                       for x, y in ends)
+
+    screen.fill((255, 255, 255))
+    screen_map.render_calls(call_list, screen)
+    drawn = pygame.transform.average_color(screen)
+    screen.fill((255, 255, 255))
+    screen_map.render_objects(visualizer.call_drawables(calls), screen)
+    assert pygame.transform.average_color(screen) == drawn
+    monkeypatch.setattr(visualizer, 'LOD_CALLS', 10)
+    screen.fill((255, 255, 255))
+    screen_map.render_calls(call_list, screen)
+    heatmap = pygame.transform.average_color(screen)
+    assert heatmap != drawn and heatmap[:3] != (255, 255, 255)
+
+
+def test_projection_cache(monkeypatch, fake_images) -> None:
+    """ Test that the map projects the calls once, to the same pixels as
+    _longlat_to_screen, and that the visualizer only renders a frame when the
+    calls or the view changed.
+    """
+    numpy = pytest.importorskip('numpy')
+    monkeypatch.setattr(visualizer, 'STATS', Stats(enabled=True))
+    v = visualizer.Visualizer(pygame.Surface(visualizer.SCREEN_SIZE))
+    screen_map = v._map
+    calls = make_calls(500)
+    call_list = CallList(calls)
+    positions = screen_map.image_positions(call_list.table)
+    assert screen_map.image_positions(call_list.table) is positions
+    screen_map.zoom(1.3)
+    screen_map.pan((-150, -75))
+    rows = call_list.row_array()
+    screen = [numpy.rint(coords).astype(int).tolist() for coords in
+              screen_map.screen_positions(call_list.table, rows)]
+    for i, call in enumerate(calls):
+        assert screen_map._longlat_to_screen(call.src_loc) == \
+            (screen[0][i], screen[1][i])
+        assert screen_map._longlat_to_screen(call.dst_loc) == \
+            (screen[2][i], screen[3][i])
+
+    # the frames shown, including the initial one
+    frames = visualizer.STATS.histograms['render.frame']
+    v.render_calls(call_list)
+    v.render_calls(call_list)
+    assert frames.count == 2
+    screen_map.pan((10, 0))
+    v.render_calls(call_list)
+    v.render_calls(call_list[:10])
+    assert frames.count == 4
+    v.render_drawables([])
+    v.render_calls(call_list)
+    assert frames.count == 6
+
+
+def test_frame_cache(monkeypatch, fake_images) -> None:
+    """ Test that the visualizer shows the frames it rendered before again
+    without rendering them, and waits between frames.
+    """
+    pytest.importorskip('numpy')
+    rendered = []
+    render_calls = visualizer.Map.render_calls
+
+    def count_render(self: visualizer.Map, calls: CallList,
+                     screen: pygame.Surface) -> None:
+        rendered.append(len(calls))
+        render_calls(self, calls, screen)
+
+    monkeypatch.setattr(visualizer.Map, 'render_calls', count_render)
+    v = visualizer.Visualizer(pygame.Surface(visualizer.SCREEN_SIZE))
+    screen_map = v._map
+    assert screen_map.get_current_view() is screen_map.get_current_view()
+    call_list = CallList(make_calls(300))
+    filtered = call_list[:100]
+    start = time.perf_counter()
+    v.render_calls(call_list)
+    first = v._screen.copy()
+    v.render_calls(call_list)
+    v.render_calls(call_list)
+    assert time.perf_counter() - start >= 1.5 / visualizer.FRAME_RATE
+    assert rendered == [300]
+    screen_map.zoom(1)
+    v.render_calls(call_list)
+    v.render_calls(filtered)
+    screen_map.zoom(-1)
+    v.render_calls(call_list)
+    assert rendered == [300, 300, 100]
+    assert pygame.image.tostring(v._screen, 'RGB') == \
+        pygame.image.tostring(first, 'RGB')
+    # the least recently shown frames are dropped
+    for i in range(visualizer.FRAME_CACHE_ENTRIES):
+        v.render_calls(call_list[:i + 1])
+    v.render_calls(filtered)
+    assert rendered[-1] == 100
+    assert len(v._frames) == visualizer.FRAME_CACHE_ENTRIES
+
+
 def test_filters() -> None:
     """ Test the functionality of the filters.
 
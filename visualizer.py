@@ -19,21 +19,29 @@ There's quite a bit in this file, but you aren't responsible for most of it.
 
 It also contains the Map class, which is responsible for converting between
 longitude/latitude coordinates and pixel coordinates on the pygame window.
+The Map only draws the calls in view, found through the SpatialIndex of their
+CallTable, and draws a density heatmap of their endpoints instead of every
+call when more than LOD_CALLS calls are in view.
 
 DO NOT CHANGE ANY CODE IN THIS FILE, unless instructed in the handout.
 """
-import math
 import os
-import threading
 import time
+from collections import OrderedDict
 from tkinter import *
-from typing import Optional, Union, Callable, Any
+from typing import Optional, Union, Callable, Any, Sequence
 
 import pygame
 
-from call import Drawable, Call
+from call import Drawable, Call, END_CALL_SPRITE, SPRITE_SIZE, \
+    START_CALL_SPRITE, load_sprite
+from callindex import SpatialIndex
+from calltable import CallList, numpy
 from customer import Customer
-from filter import Filter, DurationFilter, CustomerFilter, LocationFilter, ResetFilter
+from filter import (Filter, DurationFilter, CustomerFilter, LocationFilter,
+                    ResetFilter, FilterCache)
+from instrument import STATS
+from parallel import FilterExecutor, ProcessFilterExecutor
 
 # ----------------------------------------------------------------------------
 # NOTE: You do not need to understand any of the visualization details from
@@ -52,8 +60,25 @@ MAP_MAX = (-79.196382, 43.576959)
 # Window size
 SCREEN_SIZE = (1000, 700)
 
-# Thread settings for Task 5
-NUM_THREADS = 1
+# Number of calls in view above which a density heatmap of their endpoints is
+# drawn instead of the calls
+LOD_CALLS = 5000
+
+# Size in pixels of the map image of the square tiles of the density heatmap,
+# and the opacity of the heatmap
+HEATMAP_TILE = 8
+HEATMAP_ALPHA = 170
+
+# Maximum number of frames rendered per second. The main loop waits between
+# frames, so it barely uses the CPU when idle.
+FRAME_RATE = 30
+
+# Number of rendered frames kept, to show them again without rendering them
+FRAME_CACHE_ENTRIES = 8
+
+# Number of worker processes applying the filters. With a single worker, the
+# filters are applied directly in the visualizer process.
+NUM_WORKERS = 1
 
 
 def get_filter(unicode: str) -> Optional[Filter]:
@@ -70,27 +95,90 @@ def get_filter(unicode: str) -> Optional[Filter]:
     return None
 
 
+def call_drawables(calls: Sequence[Call]) -> list[Drawable]:
+    """ Return the drawables of the <calls>: the sprites of all their sources
+    and destinations, followed by all their connecting lines, so that the
+    lines are drawn on top of the sprites.
+    """
+    connections = []
+    drawables = []
+    for call in calls:
+        connections.append(call.get_connection())
+        drawables.extend(call.get_drawables())
+    drawables.extend(connections)
+    return drawables
+
+
 class Visualizer:
     """Visualizer for the current state of a simulation.
 
     === Public attributes ===
-    r: the Tk object for the main window
+    r: the Tk object for the main window, or None if this visualization is
+      drawn onto a given screen.
     """
     # === Private attributes ===
-    # _screen: the pygame window that is shown to the user.
+    # _screen: the pygame window that is shown to the user, or the screen
+    #   given to draw onto.
     # _mouse_down: whether the user is holding down a mouse button
     #   on the pygame window.
     # _map: the Map object responsible for converting between longitude/latitude
     #   coordinates and the pixels of the visualization window.
+    # _executor: the executor applying the filters selected by the user.
+    # _cache: the results of the filters applied so far.
+    # _drawn: the calls last rendered by render_calls, their number then, and
+    #   the view of the map they were rendered in, or None if the screen was
+    #   drawn over since.
+    # _frames: the frames rendered by render_calls for CallLists, from least
+    #   to most recently shown. Keys are tuples of the generation of the
+    #   calls, their number, and the view of the map.
+    # _clock: the clock limiting the frame rate.
+    # _all_calls: the calls shown by the reset filter instead of the calls of
+    #   the customers, or None to apply the reset filter.
     _uiscreen: pygame.Surface
     _screen: pygame.Surface
     _mouse_down: bool
     _map: 'Map'
     _quit: bool
-    r: Tk
-
-    def __init__(self) -> None:
+    _executor: FilterExecutor
+    _cache: FilterCache
+    _drawn: Optional[tuple[Sequence[Call], int, tuple[float, int, int]]]
+    _frames: OrderedDict[tuple[int, int, tuple[float, int, int]],
+                         pygame.Surface]
+    _clock: pygame.time.Clock
+    _all_calls: Optional[Sequence[Call]]
+    r: Optional[Tk]
+
+    def __init__(self, screen: Optional[pygame.Surface] = None) -> None:
         """Initialize this visualization.
+
+        If a <screen> at least as large as SCREEN_SIZE is given, the
+        visualization is drawn onto it, without opening any window, e.g. to
+        render frames without a display.
+        """
+        if screen is not None:
+            self.r = None
+            self._uiscreen = screen
+        else:
+            self._uiscreen = self._open_window()
+        self._screen = self._uiscreen.subsurface((0, 0), SCREEN_SIZE)
+        self._screen.fill(WHITE)
+        self._mouse_down = False
+        self._map = Map(SCREEN_SIZE)
+
+        self._executor = FilterExecutor()
+        self._cache = FilterCache()
+        self._drawn = None
+        self._frames = OrderedDict()
+        self._clock = pygame.time.Clock()
+        self._all_calls = None
+
+        # Initial render
+        self.render_drawables([])
+        self._quit = False
+
+    def _open_window(self) -> pygame.Surface:
+        """Open the Tk and pygame windows of this visualization, and return
+        the surface of the pygame window.
         """
         self.r = Tk()
         Label(self.r, text="Welcome to MewbileTech phone management system") \
@@ -98,56 +186,122 @@ class Visualizer:
         self.r.title("MewbileTech management system")
         pygame.init()
 
-        self._uiscreen = pygame.display.set_mode(
+        uiscreen = pygame.display.set_mode(
             (SCREEN_SIZE[0] + 200, SCREEN_SIZE[1]),
             pygame.HWSURFACE | pygame.DOUBLEBUF)
 
         # Add the text along the side, displaying the command keys for filters
-        self._uiscreen.fill((125, 125, 125))
+        uiscreen.fill((125, 125, 125))
         font = pygame.font.SysFont(None, 25)
-        self._uiscreen.blit(font.render("FILTER KEYBINDS", True, WHITE),
-                            (SCREEN_SIZE[0] + 10, 50))
-        self._uiscreen.blit(font.render("C: customer ID", True, WHITE),
-                            (SCREEN_SIZE[0] + 10, 100))
-        self._uiscreen.blit(font.render("D: duration", True, WHITE),
-                            (SCREEN_SIZE[0] + 10, 150))
-        self._uiscreen.blit(font.render("L: location", True, WHITE),
-                            (SCREEN_SIZE[0] + 10, 200))
-        self._uiscreen.blit(font.render("R: reset filter", True, WHITE),
-                            (SCREEN_SIZE[0] + 10, 250))
-
-        self._uiscreen.blit(font.render("M: monthly bill", True, WHITE),
-                            (SCREEN_SIZE[0] + 10, 500))
-        self._uiscreen.blit(font.render("X: quit application", True, WHITE),
-                            (SCREEN_SIZE[0] + 10, 650))
-
-        self._screen = self._uiscreen.subsurface((0, 0), SCREEN_SIZE)
-        self._screen.fill(WHITE)
-        self._mouse_down = False
-        self._map = Map(SCREEN_SIZE)
-
-        # Initial render
-        self.render_drawables([])
-        self._quit = False
+        uiscreen.blit(font.render("FILTER KEYBINDS", True, WHITE),
+                      (SCREEN_SIZE[0] + 10, 50))
+        uiscreen.blit(font.render("C: customer ID", True, WHITE),
+                      (SCREEN_SIZE[0] + 10, 100))
+        uiscreen.blit(font.render("D: duration", True, WHITE),
+                      (SCREEN_SIZE[0] + 10, 150))
+        uiscreen.blit(font.render("L: location", True, WHITE),
+                      (SCREEN_SIZE[0] + 10, 200))
+        uiscreen.blit(font.render("R: reset filter", True, WHITE),
+                      (SCREEN_SIZE[0] + 10, 250))
+
+        uiscreen.blit(font.render("M: monthly bill", True, WHITE),
+                      (SCREEN_SIZE[0] + 10, 500))
+        uiscreen.blit(font.render("X: quit application", True, WHITE),
+                      (SCREEN_SIZE[0] + 10, 650))
+        return uiscreen
 
     def render_drawables(self, drawables: list[Drawable]) -> None:
         """Render the <drawables> to the screen
         """
-        # Draw the background map onto the screen
+        self._drawn = None
+        with STATS.timer('render.frame'):
+            # Draw the background map onto the screen
+            self._screen.fill(WHITE)
+            self._screen.blit(self._map.get_current_view(), (0, 0))
+
+            # Add all of the objects onto the screen
+            self._map.render_objects(drawables, self._screen)
+
+            # Show the new image
+            self._flip()
+
+    def render_calls(self, calls: Sequence[Call]) -> None:
+        """Render the <calls> to the screen, as their sprites and connecting
+        lines, or as a density heatmap if there are too many of them in view.
+
+        Nothing is rendered if the same <calls> were rendered last, in the
+        same view of the map, and the last FRAME_CACHE_ENTRIES frames rendered
+        for CallLists are shown again without rendering them. Then wait, so
+        that at most FRAME_RATE frames are shown per second.
+        """
+        view = self._map.get_view()
+        if (self._drawn is None or self._drawn[0] is not calls
+                or self._drawn[1] != len(calls) or self._drawn[2] != view):
+            with STATS.timer('render.frame'):
+                self._show_frame(calls, view)
+                self._flip()
+            self._drawn = (calls, len(calls), view)
+        self._clock.tick(FRAME_RATE)
+
+    def _show_frame(self, calls: Sequence[Call],
+                    view: tuple[float, int, int]) -> None:
+        """Draw the frame showing the <calls> in the <view> of the map onto
+        the screen, from the cached frames if it was rendered before.
+        """
+        key = None
+        if isinstance(calls, CallList):
+            key = (calls.generation, len(calls), view)
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                self._screen.blit(frame, (0, 0))
+                return
         self._screen.fill(WHITE)
         self._screen.blit(self._map.get_current_view(), (0, 0))
+        self._map.render_calls(calls, self._screen)
+        if key is not None:
+            self._frames[key] = self._screen.copy()
+            if len(self._frames) > FRAME_CACHE_ENTRIES:
+                self._frames.popitem(last=False)
+
+    def set_all_calls(self, calls: Optional[Sequence[Call]]) -> None:
+        """Show the <calls> when the filters are reset, instead of the calls
+        in the call histories of the customers, e.g. when the calls are read
+        from a call store and not registered into the call histories.
+        If <calls> is None, the reset filter is applied again.
+        """
+        self._all_calls = calls
 
-        # Add all of the objects onto the screen
-        self._map.render_objects(drawables, self._screen)
-
-        # Show the new image
-        pygame.display.flip()
+    def _flip(self) -> None:
+        """Show the screen in the pygame window, if there is one.
+        """
+        if self.r is not None:
+            pygame.display.flip()
 
     def has_quit(self) -> bool:
         """Returns if the program has received the quit command
         """
         return self._quit
 
+    def get_executor(self, customers: list[Customer],
+                     data: list[Call]) -> FilterExecutor:
+        """Returns the executor to apply filters to <data> with.
+        A pool of NUM_WORKERS processes is started the first time it is
+        needed, and restarted if <data> comes from a different set of calls.
+        """
+        if (NUM_WORKERS > 1 and numpy is not None
+                and not self._executor.covers(data)
+                and isinstance(data, CallList)):
+            self._executor.close()
+            self._executor = ProcessFilterExecutor(data.table, customers,
+                                                   NUM_WORKERS)
+        return self._executor
+
+    def close(self) -> None:
+        """Releases the resources held by this visualizer
+        """
+        self._executor.close()
+
     def set_event_button_motion(self) -> None:
         """pan's the map if the _mouse_down is true
         """
@@ -187,57 +341,26 @@ class Visualizer:
                 f = get_filter(event.unicode)
 
                 if f is not None:
-                    def result_wrapper(fun: Callable[[list[Customer],
-                                                      list[Call],
-                                                      str], list[Call]],
-                                       customers: list[Customer],
-                                       data: list[Call],
-                                       filter_string: str,
-                                       res: list) -> None:
-                        """A final wrapper to return the result of the operation
-                        """
-                        res.append(fun(customers, data, filter_string))
-
-                    def threading_wrapper(customers: list[Customer],
-                                          data: list[Call],
-                                          filter_string: str) -> list[Call]:
+                    def executor_wrapper(customers: list[Customer],
+                                         data: list[Call],
+                                         filter_string: str) -> list[Call]:
                         """A wrapper for the application of filters with
-                        threading
+                        the filter executor
                         """
-                        chk_cls = math.ceil(
-                            (len(data) + NUM_THREADS - 1) / NUM_THREADS)
-                        print("Num_threads:", NUM_THREADS)
-                        print("Chunk_calls:", chk_cls)
-                        threads = []
-                        results = []
-                        for i in range(NUM_THREADS):
-                            res = []
-                            results.append(res)
-                            t = threading.Thread(target=result_wrapper,
-                                                 args=(f.apply,
-                                                       customers,
-                                                       data[i * chk_cls:
-                                                            (i + 1) * chk_cls],
-                                                       filter_string,
-                                                       res))
-                            t.daemon = True
-                            t.start()
-                            threads.append(t)
-                            # f.apply(customers, data, filter_string)
-                        # Wait to finish
-                        for t in threads:
-                            t.join()
-
-                        # Now reconstruct the data
-                        new_data = []
-                        for res in results:
-                            new_data.extend(res[0])
-                        return new_data
+                        print("Num_workers:", NUM_WORKERS)
+                        if (isinstance(f, ResetFilter)
+                                and self._all_calls is not None):
+                            return self._all_calls
+                        executor = self.get_executor(customers, data)
+                        with STATS.timer('filter.' + type(f).__name__):
+                            return self._cache.apply(f, customers, data,
+                                                     filter_string,
+                                                     executor.apply)
 
                     new_drawables = self.entry_window(str(f),
                                                       customers,
                                                       drawables,
-                                                      threading_wrapper)
+                                                      executor_wrapper)
 
                 # Perform the billing for a selected customer:
                 if event.unicode == "m":
@@ -298,6 +421,9 @@ class Visualizer:
                 self._mouse_down = False
             elif event.type == pygame.MOUSEMOTION:
                 self.set_event_button_motion()
+            elif event.type == pygame.VIDEOEXPOSE:
+                # the window must be drawn again
+                self._drawn = None
         return new_drawables
 
     def entry_window(self, field: str,
@@ -367,6 +493,15 @@ class Map:
     #    offset on y axis
     # _zoom:
     #    map zoom level
+    # _projected:
+    #    the table whose calls were last projected onto the map image, its
+    #    number of rows then, and the image_positions of its rows, or None
+    # _tiles:
+    #    the calls whose tile_counts were last computed, their number then,
+    #    and their tile_counts, or None
+    # _scaled:
+    #    the view of the last subimage returned by get_current_view, and that
+    #    subimage, or None
     image: pygame.image
     min_coords: tuple[float, float]
     max_coords: tuple[float, float]
@@ -374,6 +509,9 @@ class Map:
     _xoffset: int
     _yoffset: int
     _zoom: int
+    _projected: Optional[tuple[Any, int, tuple[Any, Any, Any, Any]]]
+    _tiles: Optional[tuple[CallList, int, Any]]
+    _scaled: Optional[tuple[tuple[float, int, int], pygame.Surface]]
 
     def __init__(self, screendims: tuple[int, int]) -> None:
         """ Initialize this map for the given screen dimensions <screendims>.
@@ -387,22 +525,248 @@ class Map:
         self._yoffset = 0
         self._zoom = 1
         self.screensize = screendims
+        self._projected = None
+        self._tiles = None
+        self._scaled = None
 
     def render_objects(self, drawables: list[Drawable],
                        screen: pygame.Surface) -> None:
         """ Render the <drawables> onto the <screen>.
+
+        The drawables entirely out of the screen are skipped.
         """
+        width, height = screen.get_size()
         for drawable in drawables:
             longlat_position = drawable.get_position()
             if longlat_position is not None:
-                sprite_position = self._longlat_to_screen(longlat_position)
-                screen.blit(drawable.sprite, sprite_position)
+                x, y = self._longlat_to_screen(longlat_position)
+                if (-SPRITE_SIZE[0] < x < width
+                        and -SPRITE_SIZE[1] < y < height):
+                    screen.blit(drawable.sprite, (x, y))
             else:  # is a line segment
                 endpoints = drawable.get_linelimits()
-                pygame.draw.aaline(screen,
-                                   LINE_COLOUR,
-                                   self._longlat_to_screen(endpoints[0]),
-                                   self._longlat_to_screen(endpoints[1]))
+                start = self._longlat_to_screen(endpoints[0])
+                end = self._longlat_to_screen(endpoints[1])
+                # skip the lines entirely on one side of the screen
+                if not (max(start[0], end[0]) < 0
+                        or min(start[0], end[0]) >= width
+                        or max(start[1], end[1]) < 0
+                        or min(start[1], end[1]) >= height):
+                    pygame.draw.aaline(screen, LINE_COLOUR, start, end)
+
+    def render_calls(self, calls: Sequence[Call],
+                     screen: pygame.Surface) -> None:
+        """ Render the <calls> onto the <screen>, as the sprites of their
+        source and destination, and the lines connecting them on top.
+
+        If <calls> is a CallList and NumPy is installed, only the sprites in
+        view and the lines crossing the view are drawn, and if more than
+        LOD_CALLS calls have an endpoint in view, a density heatmap of their
+        endpoints is drawn instead.
+        Otherwise, every call is turned into Drawables and rendered by
+        render_objects.
+        """
+        if numpy is None or not isinstance(calls, CallList):
+            self.render_objects(call_drawables(calls), screen)
+            return
+        rows = calls.row_array()[self.visible_positions(calls)]
+        table = calls.table
+        if len(rows) > LOD_CALLS:
+            self._render_heatmap(calls, screen)
+            return
+        src_x, src_y, dst_x, dst_y = (
+            numpy.rint(coords).astype(numpy.int64).tolist()
+            for coords in self.screen_positions(table, rows))
+        start_sprite = load_sprite(START_CALL_SPRITE)
+        end_sprite = load_sprite(END_CALL_SPRITE)
+        screen.blits([(start_sprite, position)
+                      for position in zip(src_x, src_y)]
+                     + [(end_sprite, position)
+                        for position in zip(dst_x, dst_y)], False)
+        # a line can cross the view without any of its endpoints in view
+        rows = calls.row_array()[self.crossing_positions(calls)]
+        src_x, src_y, dst_x, dst_y = (
+            numpy.rint(coords).astype(numpy.int64).tolist()
+            for coords in self.screen_positions(table, rows))
+        # pygame has no call drawing separate line segments at once: aalines
+        # draws a single polyline. The lines are drawn one at a time, as
+        # almost all of the time is spent by aaline drawing their pixels,
+        # not in the calls themselves, and the frame is then cached by the
+        # Visualizer.
+        draw_line = pygame.draw.aaline
+        for x1, y1, x2, y2 in zip(src_x, src_y, dst_x, dst_y):
+            draw_line(screen, LINE_COLOUR, (x1, y1), (x2, y2))
+
+    def visible_area(self) -> tuple[float, float, float, float]:
+        """ Return the rectangle of the map in view, widened by the size of a
+        sprite on each side, as its lower-left and upper-right (long, lat)
+        coordinates: (lower long, lower lat, upper long, upper lat).
+        """
+        width = self.image.get_width()
+        height = self.image.get_height()
+        margin_x = SPRITE_SIZE[0] * width / (self._zoom * self.screensize[0])
+        margin_y = SPRITE_SIZE[1] * height / (self._zoom * self.screensize[1])
+        longs = sorted(self.min_coords[0] + x / width
+                       * (self.max_coords[0] - self.min_coords[0])
+                       for x in (self._xoffset - margin_x,
+                                 self._xoffset + width / self._zoom + margin_x))
+        lats = sorted(self.min_coords[1] + y / height
+                      * (self.max_coords[1] - self.min_coords[1])
+                      for y in (self._yoffset - margin_y,
+                                self._yoffset + height / self._zoom + margin_y))
+        return longs[0], lats[0], longs[1], lats[1]
+
+    def visible_positions(self, calls: CallList) -> Any:
+        """ Return the positions in <calls> of the calls whose source or
+        destination is in the visible_area, as a sorted NumPy array.
+
+        Precondition: NumPy is installed.
+        """
+        table = calls.table
+        area = self.visible_area()
+        index = table.get_index(SpatialIndex)
+        if index.count_candidates(*area) * 4 < len(table):
+            # few calls are in view, they are found through the index
+            visible = numpy.zeros(len(table), dtype=bool)
+            visible[index.query(*area)] = True
+        else:
+            # most of the map is in view, checking every call is faster
+            visible = numpy.zeros(len(table), dtype=bool)
+            for lon, lat in (('src_lon', 'src_lat'), ('dst_lon', 'dst_lat')):
+                longs = table.column(lon)
+                lats = table.column(lat)
+                visible |= ((area[0] <= longs) & (longs <= area[2])
+                            & (area[1] <= lats) & (lats <= area[3]))
+        return numpy.flatnonzero(visible[calls.row_array()])
+
+    def crossing_positions(self, calls: CallList) -> Any:
+        """ Return the positions in <calls> of the calls whose connecting line
+        may cross the visible_area, because its bounding box overlaps it, as a
+        sorted NumPy array.
+
+        Precondition: NumPy is installed.
+        """
+        table = calls.table
+        rows = calls.row_array()
+        low_long, low_lat, high_long, high_lat = self.visible_area()
+        src_lon = table.column('src_lon')[rows]
+        dst_lon = table.column('dst_lon')[rows]
+        src_lat = table.column('src_lat')[rows]
+        dst_lat = table.column('dst_lat')[rows]
+        return numpy.flatnonzero(
+            ((src_lon <= high_long) | (dst_lon <= high_long))
+            & ((src_lon >= low_long) | (dst_lon >= low_long))
+            & ((src_lat <= high_lat) | (dst_lat <= high_lat))
+            & ((src_lat >= low_lat) | (dst_lat >= low_lat)))
+
+    def image_positions(self, table: Any) -> tuple[Any, Any, Any, Any]:
+        """ Return the pixel coordinates on the map image of the source and
+        destination of every row of <table>, as NumPy arrays, rounded as
+        _longlat_to_screen rounds them: (source x, source y, destination x,
+        destination y).
+
+        The coordinates are computed once for a table, and computed again if
+        rows were appended to it since.
+
+        Precondition: NumPy is installed.
+        """
+        if (self._projected is None or self._projected[0] is not table
+                or self._projected[1] != len(table)):
+            width = self.image.get_width()
+            height = self.image.get_height()
+            positions = []
+            for name, size, axis in (('src_lon', width, 0),
+                                     ('src_lat', height, 1),
+                                     ('dst_lon', width, 0),
+                                     ('dst_lat', height, 1)):
+                coords = ((table.column(name) - self.min_coords[axis])
+                          / (self.max_coords[axis] - self.min_coords[axis])
+                          * size)
+                positions.append(numpy.rint(coords).astype(numpy.int32))
+            self._projected = (table, len(table), tuple(positions))
+        return self._projected[2]
+
+    def screen_positions(self, table: Any,
+                         rows: Any) -> tuple[Any, Any, Any, Any]:
+        """ Return the pixel coordinates on the screen of the source and
+        destination of the calls at <rows> of <table>, as NumPy arrays of
+        floats, which _longlat_to_screen would round: (source x, source y,
+        destination x, destination y).
+
+        Precondition: NumPy is installed.
+        """
+        width = self.image.get_width()
+        height = self.image.get_height()
+        positions = self.image_positions(table)
+        # in the same order of operations as _longlat_to_screen, to round the
+        # coordinates the same way
+        return tuple((positions[i][rows] - offset) * self._zoom * screen_size
+                     / size
+                     for i, offset, screen_size, size in (
+                         (0, self._xoffset, self.screensize[0], width),
+                         (1, self._yoffset, self.screensize[1], height),
+                         (2, self._xoffset, self.screensize[0], width),
+                         (3, self._yoffset, self.screensize[1], height)))
+
+    def tile_counts(self, calls: CallList) -> Any:
+        """ Return the number of endpoints of the <calls> in each tile of
+        HEATMAP_TILE pixels of the map image, as a 2D NumPy array indexed by
+        the column, then the row of the tiles.
+
+        The counts are computed once for the last <calls> given, and computed
+        again if calls were appended to them since.
+
+        Precondition: NumPy is installed.
+        """
+        if (self._tiles is not None and self._tiles[0] is calls
+                and self._tiles[1] == len(calls)):
+            return self._tiles[2]
+        width = self.image.get_width()
+        height = self.image.get_height()
+        columns = -(-width // HEATMAP_TILE)
+        lines = -(-height // HEATMAP_TILE)
+        rows = calls.row_array()
+        src_x, src_y, dst_x, dst_y = self.image_positions(calls.table)
+        x = numpy.concatenate((src_x[rows], dst_x[rows]))
+        y = numpy.concatenate((src_y[rows], dst_y[rows]))
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        tiles = (x[inside] // HEATMAP_TILE * lines
+                 + y[inside] // HEATMAP_TILE)
+        counts = numpy.bincount(tiles, minlength=columns * lines)
+        counts = counts.reshape(columns, lines)
+        self._tiles = (calls, len(calls), counts)
+        return counts
+
+    def _render_heatmap(self, calls: CallList,
+                        screen: pygame.Surface) -> None:
+        """ Render onto the <screen> a heatmap of the number of endpoints of
+        the <calls> in each tile of the map image in view.
+        """
+        width = self.image.get_width()
+        height = self.image.get_height()
+        scale_x = self._zoom * self.screensize[0] / width
+        scale_y = self._zoom * self.screensize[1] / height
+        left = int(self._xoffset // HEATMAP_TILE)
+        top = int(self._yoffset // HEATMAP_TILE)
+        right = -int(-(self._xoffset + width / self._zoom) // HEATMAP_TILE)
+        bottom = -int(-(self._yoffset + height / self._zoom) // HEATMAP_TILE)
+        counts = self.tile_counts(calls)[left:right, top:bottom]
+        if not counts.any():
+            return
+        level = numpy.log1p(counts) / numpy.log1p(counts.max())
+        # from yellow for the fewest calls to red for the most, and black
+        # (transparent) for the tiles without any call
+        colours = numpy.zeros(counts.shape + (3,), dtype=numpy.uint8)
+        colours[..., 0] = numpy.where(counts > 0, 255, 0)
+        colours[..., 1] = numpy.where(counts > 0, 230 * (1 - level), 0)
+        layer = pygame.surfarray.make_surface(colours)
+        layer.set_colorkey((0, 0, 0))
+        layer.set_alpha(HEATMAP_ALPHA)
+        size = (round(counts.shape[0] * HEATMAP_TILE * scale_x),
+                round(counts.shape[1] * HEATMAP_TILE * scale_y))
+        position = (round((left * HEATMAP_TILE - self._xoffset) * scale_x),
+                    round((top * HEATMAP_TILE - self._yoffset) * scale_y))
+        screen.blit(pygame.transform.scale(layer, size), position)
 
     def _longlat_to_screen(self,
                            location: tuple[float, float]) -> tuple[int, int]:
@@ -421,6 +785,11 @@ class Map:
                   / self.image.get_height())
         return x, y
 
+    def get_view(self) -> tuple[float, int, int]:
+        """ Return the zoom level and the x and y offsets of the view.
+        """
+        return self._zoom, self._xoffset, self._yoffset
+
     def pan(self, dp: tuple[int, int]) -> None:
         """ Pan the view in the image by <dp> (dx, dy) screenspace pixels.
         """
@@ -452,7 +821,12 @@ class Map:
 
     def get_current_view(self) -> pygame.Surface:
         """ Get the subimage to display to screen from the map.
+
+        The subimage is scaled once for each view, and must not be modified.
         """
+        view = self.get_view()
+        if self._scaled is not None and self._scaled[0] == view:
+            return self._scaled[1]
         raw_width = self.image.get_width()
         raw_height = self.image.get_height()
         zoom_width = round(raw_width / self._zoom)
@@ -460,7 +834,9 @@ class Map:
 
         mapsegment = self.image.subsurface(((self._xoffset, self._yoffset),
                                             (zoom_width, zoom_height)))
-        return pygame.transform.smoothscale(mapsegment, self.screensize)
+        scaled = pygame.transform.smoothscale(mapsegment, self.screensize)
+        self._scaled = (view, scaled)
+        return scaled
 
 
 if __name__ == '__main__':
@@ -469,12 +845,12 @@ if __name__ == '__main__':
     python_ta.check_all(config={
         'allowed-import-modules': [
             'doctest', 'python_ta', 'typing',
-            'tkinter', 'os', 'pygame',
-            'threading', 'math', 'time',
-            'customer', 'call', 'filter',
+            'tkinter', 'os', 'pygame', 'collections',
+            'time', 'customer', 'call', 'callindex', 'calltable', 'filter',
+            'parallel', 'instrument',
         ],
         'allowed-io': [
-            'entry_window', 'callback_wrapper', 'threading_wrapper',
+            'entry_window', 'callback_wrapper', 'executor_wrapper',
             '__init__', 'handle_window_events'
         ],
         'disable': ['R0915', 'W0613', 'W0401', 'R0201'],